@@ -0,0 +1,291 @@
+"""
+下载 -> 校验 -> 整理 流水线
+
+原来需要依次运行 1.download_*、2.md5check.py、3.data_organize.py, 第一个文件要等最后一个文件下载完才开始校验;
+这里每个文件下载完成后立即交给校验进程, 校验通过且同一run的文件都齐了就整理到样本目录,
+阶段之间用有界队列连接 (下游处理不过来时上游暂停派发), 网络传输、哈希计算和整理同时进行,
+总耗时接近最慢的阶段而不是各阶段之和。
+各文件的状态记录在下载目录的 jobs.sqlite3 中, 中断后重新运行从中断处继续
+"""
+import os
+import sys
+import time
+import queue
+import argparse
+import threading
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+import bandwidth
+import metrics
+import organizer
+import disk_plan
+from manifest import load_manifest
+from download_engine import make_tasks, run_downloads, http_url
+from range_download import download_file
+from sources import SourceSelector, default_stats_path
+from leases import LeaseStore
+from job_store import JobStore, default_job_path, DOWNLOADED, VERIFIED, FAILED, ORGANIZED
+from md5_cache import MD5Cache, default_cache_path, file_signature
+from hash_engine import hash_file, parse_digests
+from fastq_check import FastqValidator
+
+# 配置参数
+MANIFEST_PATH = r"D:\NCBI_ascp\data_report"  # data_report目录 / 单个tsv / xlsx
+DOWNLOAD_DIR = r"D:\NCBI_ascp\data"
+EXTRA_DIRS = []  # 其他磁盘上的下载目录 (主目录空间不够时按run分配过去, 见 disk_plan.py)
+OUTPUT_DIR = r"D:\NCBI_ascp\organized_data"  # 整理后的输出目录
+DOWNLOAD_WORKERS = 8  # 同时下载的文件数
+MAX_PER_HOST = 4  # 单个主机同时下载的文件数
+SEGMENTS = 8  # 单个大文件的分段并行连接数
+HASH_WORKERS = max(1, (os.cpu_count() or 4) // 2)  # 校验进程数
+QUEUE_SIZE = 64  # 阶段之间排队的文件数上限
+FAILOVER = True  # 按实测吞吐在 HTTPS / FTP / Aspera 之间选择来源, 出错时从当前位置切换 (sources.py)
+RATE_LIMIT = None  # 下载带宽上限 (与 ascp -l 相同的单位), 如 "800m"; None 不限速
+RATE_SCHEDULE = None  # 分时段限速, 如 "08:00-20:00=300m,20:00-08:00=900m"
+ORGANIZE_MODE = organizer.MODE  # 整理方式: move / hardlink / reflink / symlink / copy (见 organizer.py)
+ORGANIZE_LAYOUT = organizer.LAYOUT  # 目录布局: run / cellranger (按 sample_accession 分组并按Cell Ranger规则命名)
+FASTQ_COLUMNS = ('read_count', 'fastq_error')  # --validate-fastq 时缓存的附加结果
+
+_DONE = None  # 队列结束标记
+
+
+def verify_file(file_path, digests, validate):
+    """
+    在校验进程中读取一遍文件: 计算摘要, 可选同时流式校验fastq.gz
+    :return: 名称 -> 值 (摘要, 以及 read_count / fastq_error)
+    """
+    validator = FastqValidator() if validate and file_path.endswith('.fastq.gz') else None
+    values = hash_file(file_path, digests, sinks=[validator] if validator else ())
+    if validate:
+        reads, fastq_error = validator.finish() if validator else ('', None)
+        values['read_count'] = str(reads)
+        values['fastq_error'] = fastq_error or ''
+    return values
+
+
+def download_stage(tasks, seeds, verify_queue, jobs, manifest, paths, leases=None):
+    """
+    下载阶段: 先把上次已下载未整理的文件交给校验, 再并发下载, 每完成一个立即交给校验
+    :param paths: 文件名 -> 下载路径 (disk_plan 分配的下载目录)
+    :param leases: 多节点共享下载目录时的下载租约 (leases.LeaseStore)
+    """
+    for file_name in seeds:
+        verify_queue.put(file_name)
+    md5_map = manifest.md5s()
+    selector = (SourceSelector(default_stats_path(DOWNLOAD_DIR), segments=SEGMENTS)
+                if FAILOVER else None)
+
+    def download(link):
+        file_name = link.split('/')[-1]
+        if selector is not None:
+            return selector.download(manifest.by_name[file_name], paths[file_name],
+                                     expected_md5=md5_map.get(file_name))
+        return download_file(http_url(link), paths[file_name],
+                             segments=SEGMENTS, expected_md5=md5_map.get(file_name))
+
+    def on_done(task, result):
+        if result['success']:
+            verify_queue.put(task['file_name'])
+
+    try:
+        run_downloads(tasks, download, max_workers=DOWNLOAD_WORKERS, max_per_host=MAX_PER_HOST,
+                      job_store=jobs, on_done=on_done, leases=leases)
+    finally:
+        verify_queue.put(_DONE)
+
+
+def verify_stage(verify_queue, organize_queue, executor, jobs, cache, md5_map, paths, digests, validate):
+    """校验线程: 每个线程同一时间占用一个校验进程, 通过的文件交给整理阶段"""
+    columns = digests + FASTQ_COLUMNS if validate else digests
+    while True:
+        file_name = verify_queue.get()
+        if file_name is _DONE:
+            verify_queue.put(_DONE)  # 让其他校验线程也退出
+            return
+        file_path = paths[file_name]
+        expected_md5 = md5_map.get(file_name)
+        if jobs.is_done(file_name, (VERIFIED,)):
+            organize_queue.put(file_name)
+            continue
+
+        start = time.time()
+        hashed = 0
+        metrics.start(file_name, stage='hash')
+        try:
+            signature = file_signature(file_path)
+            values = cache.get_digests(file_path, columns, signature)
+            if values is None:
+                values = executor.submit(verify_file, file_path, digests, validate).result()
+                hashed = signature[0]
+                cache.put(file_path, values['md5'], signature,
+                          extra={name: values[name] for name in columns if name != 'md5'})
+            error = values.get('fastq_error') or None
+            if expected_md5 and values['md5'] != expected_md5:
+                error = f"MD5不匹配: 预期 {expected_md5}, 实际 {values['md5']}"
+        except Exception as e:
+            values, error = {}, str(e)
+
+        jobs.transition(file_name, FAILED if error else VERIFIED, record_signature=not error,
+                        md5=values.get('md5'), verify_seconds=time.time() - start, error=error)
+        metrics.finish(file_name, not error, error, nbytes=hashed)
+        if error:
+            print(f"校验失败: {file_name} ({error})")
+        else:
+            print(f"校验通过: {file_name}")
+            organize_queue.put(file_name)
+
+
+def organize_stage(organize_queue, jobs, run_files, targets, paths, leases=None):
+    """
+    整理阶段: 同一run的文件全部校验通过后放到样本目录
+    :param targets: 文件名 -> 相对 OUTPUT_DIR 的目标路径 (organizer.plan)
+    :param paths: 文件名 -> 下载路径
+    :param leases: 多节点共享时按run认领的整理租约; 同一run的文件可能由不同节点校验,
+                   其他节点校验通过的文件从任务状态库确认, 结束前再检查一遍未整理的run
+    """
+    file_runs = {name: run for run, names in run_files.items() for name in names}
+    verified = defaultdict(set)
+    placed = set()
+
+    def ready(run):
+        if verified[run] == run_files[run]:
+            return True
+        return leases is not None and all(name in verified[run] or jobs.is_done(name, (VERIFIED,))
+                                          for name in run_files[run])
+
+    def place(run):
+        if leases is not None and not leases.acquire(run):
+            return  # 其他节点正在整理或已整理
+        placed.add(run)
+        for name in sorted(run_files[run]):
+            placer.submit(paths[name], name, targets.get(name, os.path.join(run, name)))
+        print(f"整理: {run} ({len(run_files[run])} 个文件) -> {OUTPUT_DIR}")
+
+    def on_done(file_name, dst, method):
+        jobs.transition(file_name, ORGANIZED, dest_path=dst, record_signature=True)
+        metrics.finish(file_name, True, stage='organize')
+
+    placer = organizer.Organizer(OUTPUT_DIR, ORGANIZE_MODE, on_done=on_done)
+    while True:
+        file_name = organize_queue.get()
+        if file_name is _DONE:
+            break
+        run = file_runs.get(file_name)
+        if run is None:
+            continue
+        verified[run].add(file_name)
+        if ready(run):
+            place(run)
+    if leases is not None:
+        for run in sorted(run_files):
+            if run not in placed and ready(run):
+                place(run)
+    placer.close()
+    print(placer.summary_line())
+    if leases is not None:
+        for run in placed:
+            leases.release(run, done=True)
+
+    for run, names in sorted(run_files.items()):
+        if run in placed:
+            continue
+        missing = {name for name in names - verified[run]
+                   if leases is None or not jobs.is_done(name, (VERIFIED, ORGANIZED))}
+        if missing:
+            print(f"未整理: {run} (尚未通过校验: {', '.join(sorted(missing))})")
+        else:
+            print(f"未整理: {run} (由其他节点整理)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='下载 -> 校验 -> 整理 流水线')
+    parser.add_argument('-m', '--manifest', type=str, default=MANIFEST_PATH,
+                        help=f'样本清单: data_report目录、filereport tsv或xlsx (默认: {MANIFEST_PATH})')
+    parser.add_argument('--digests', type=str, default='md5',
+                        help='逗号分隔的摘要列表, 例如 md5,sha256 (默认: md5)')
+    parser.add_argument('--validate-fastq', action='store_true',
+                        help='校验时同时流式解压 .fastq.gz, 检查gzip完整性和记录格式')
+    parser.add_argument('--hash-workers', type=int, default=HASH_WORKERS,
+                        help=f'校验进程数 (默认: {HASH_WORKERS})')
+    parser.add_argument('--metrics', type=str, default=metrics.METRICS_FILE,
+                        help='把进度/吞吐/队列长度等指标以JSON-lines写入该文件')
+    parser.add_argument('--prom-file', type=str, default=metrics.PROM_FILE,
+                        help='定期写入Prometheus文本格式的指标文件 (node_exporter textfile)')
+    parser.add_argument('--prom-port', type=int, default=metrics.PROM_PORT,
+                        help='在该端口提供 /metrics (Prometheus文本格式)')
+    parser.add_argument('--shared', action='store_true',
+                        help='多个节点共享下载目录时各运行一个实例, 用租约文件分摊下载和整理 (见 leases.py)')
+    args = parser.parse_args()
+    try:
+        digests = parse_digests(args.digests)
+    except (ValueError, ImportError) as e:
+        print(f"错误: 不支持的摘要 {args.digests}: {e}")
+        sys.exit(1)
+
+    os.makedirs(DOWNLOAD_DIR, exist_ok=True)
+    bandwidth.configure(RATE_LIMIT, RATE_SCHEDULE)
+    metrics.configure(args.metrics, args.prom_file, args.prom_port)
+    manifest = load_manifest(args.manifest)
+    md5_map = manifest.md5s()
+    jobs = JobStore(default_job_path(DOWNLOAD_DIR))
+    cache = MD5Cache(default_cache_path(DOWNLOAD_DIR))
+    # 之前下载到其他下载目录的文件保留记录的位置
+    recorded = jobs.locations(DOWNLOAD_DIR, manifest.by_name)
+    jobs.add([{'file_name': f['file_name'], 'run_accession': f['run_accession'],
+               'url': f['ftp'], 'dest_path': recorded[f['file_name']],
+               'expected_md5': f['md5'] or None, 'size': f['bytes']}
+              for f in manifest.files if f['ftp']])
+
+    # 已整理的文件不再参与; 已下载/已校验但未整理的文件直接进入校验阶段
+    tasks = make_tasks(manifest.links("fastq_ftp"), DOWNLOAD_DIR, sizes=manifest.sizes())
+    tasks = [t for t in tasks if not jobs.is_done(t['file_name'], (ORGANIZED,))]
+    # 检查剩余空间并预分配, 多个下载目录时按run分配
+    tasks = disk_plan.prepare(tasks, [DOWNLOAD_DIR] + EXTRA_DIRS, job_store=jobs)
+    paths = {t['file_name']: t['dest_path'] for t in tasks}
+    seeds = [t['file_name'] for t in tasks if jobs.is_done(t['file_name'], (DOWNLOADED, VERIFIED))]
+    run_files = defaultdict(set)
+    for t in tasks:
+        run_files[manifest.by_name[t['file_name']]['run_accession']].add(t['file_name'])
+    samples = {f['file_name']: f['sample_accession'] for f in manifest.files if f['sample_accession']}
+    targets = organizer.plan(manifest.by_name, samples, ORGANIZE_LAYOUT)
+    download_leases = LeaseStore(DOWNLOAD_DIR, 'download') if args.shared else None
+    organize_leases = LeaseStore(DOWNLOAD_DIR, 'organize') if args.shared else None
+    print(f"流水线: {len(tasks)} 个文件 ({len(seeds)} 个已下载) | 下载 {DOWNLOAD_WORKERS} 并发 | "
+          f"校验 {args.hash_workers} 进程")
+
+    start_time = time.time()
+    verify_queue = queue.Queue(maxsize=QUEUE_SIZE)
+    organize_queue = queue.Queue(maxsize=QUEUE_SIZE)
+    metrics.plan('hash', len(tasks), sum(t['size'] or 0 for t in tasks))
+    metrics.gauge('queue_verify', verify_queue.qsize)
+    metrics.gauge('queue_organize', organize_queue.qsize)
+    with ProcessPoolExecutor(max_workers=args.hash_workers) as executor:
+        organize_thread = threading.Thread(target=organize_stage,
+                                           args=(organize_queue, jobs, run_files, targets, paths,
+                                                 organize_leases))
+        verifiers = [threading.Thread(target=verify_stage,
+                                      args=(verify_queue, organize_queue, executor, jobs, cache,
+                                            md5_map, paths, digests, args.validate_fastq))
+                     for _ in range(args.hash_workers)]
+        organize_thread.start()
+        for thread in verifiers:
+            thread.start()
+        download_stage(tasks, seeds, verify_queue, jobs, manifest, paths, download_leases)
+        for thread in verifiers:
+            thread.join()
+        organize_queue.put(_DONE)
+        organize_thread.join()
+
+    for leases in (download_leases, organize_leases):
+        if leases is not None:
+            leases.close()
+    metrics.flush()
+    print(f"\n流水线结束! 耗时: {time.time() - start_time:.2f}秒")
+    print(cache.stats_line())
+    print(jobs.summary_line())
+    cache.close()
+    jobs.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""
+从 study / sample / experiment / run 编号生成下载清单 (不用在ENA网页上手工导出)
+
+结果写入清单目录的 filereport_read_run_<名称>_tsv.txt, 之后的下载/校验/整理脚本直接读取;
+查询结果缓存 CACHE_TTL (默认7天), 重新规划同一批编号不再访问ENA
+用法:
+    python 0.resolve_accessions.py PRJNA889248
+    python 0.resolve_accessions.py SRX17918111,SRX17918113 SAMN31234567 --name my_cohort
+    python 0.resolve_accessions.py @accessions.txt --refresh
+"""
+import os
+import sys
+import time
+import argparse
+import ena_portal
+from manifest import load_manifest, find_sources
+
+# 配置参数
+DEFAULT_REPORT_DIR = r"D:\NCBI_ascp\data_report"  # 与下载脚本的 manifest_path 相同
+
+
+def main():
+    parser = argparse.ArgumentParser(description='从ENA编号生成下载清单')
+    parser.add_argument('accessions', nargs='+',
+                        help='编号 (PRJNA/SRP/SAMN/SRS/SRX/SRR 等, 逗号或空格分隔), @文件 从文件读取')
+    parser.add_argument('-o', '--report-dir', type=str, default=DEFAULT_REPORT_DIR,
+                        help=f'清单目录 (默认: {DEFAULT_REPORT_DIR})')
+    parser.add_argument('--name', type=str, default=None,
+                        help='清单文件名中的名称 (默认: 只有一个编号时用该编号, 否则为 accessions)')
+    parser.add_argument('--ttl', type=float, default=ena_portal.CACHE_TTL / 3600,
+                        help=f'缓存有效期 (小时, 默认: {ena_portal.CACHE_TTL / 3600:g})')
+    parser.add_argument('--refresh', action='store_true', help='忽略缓存重新查询')
+    parser.add_argument('--batch-size', type=int, default=ena_portal.BATCH_SIZE,
+                        help=f'每个请求合并的编号数 (默认: {ena_portal.BATCH_SIZE})')
+    parser.add_argument('--concurrency', type=int, default=ena_portal.MAX_CONCURRENCY,
+                        help=f'同时进行的请求数 (默认: {ena_portal.MAX_CONCURRENCY})')
+    parser.add_argument('--portal', type=str, default=None,
+                        help=f'portal API 地址 (默认: 环境变量 ENA_PORTAL_URL 或 {ena_portal.PORTAL_URL})')
+    args = parser.parse_args()
+
+    try:
+        accessions = ena_portal.parse_accessions(args.accessions)
+        for accession in accessions:
+            ena_portal.accession_field(accession)
+    except (OSError, ValueError) as e:
+        print(f"错误: {e}")
+        sys.exit(1)
+    name = args.name or (accessions[0] if len(accessions) == 1 else "accessions")
+
+    start_time = time.time()
+    os.makedirs(args.report_dir, exist_ok=True)
+    try:
+        rows, stats = ena_portal.resolve(accessions, ena_portal.default_cache_path(args.report_dir),
+                                         ttl=args.ttl * 3600, refresh=args.refresh,
+                                         batch_size=args.batch_size, max_concurrency=args.concurrency,
+                                         url=args.portal)
+    except RuntimeError as e:
+        print(f"错误: {e}")
+        sys.exit(1)
+    if stats['missing']:
+        print(f"警告: {len(stats['missing'])} 个编号没有查到 run: {', '.join(stats['missing'][:20])}"
+              + (" ..." if len(stats['missing']) > 20 else ""))
+    if not rows:
+        print("没有可写入的 run")
+        sys.exit(1)
+
+    path = ena_portal.write_report(rows, args.report_dir, name)
+    manifest = load_manifest(path, use_cache=False)
+    total = sum(f['bytes'] or 0 for f in manifest.files)
+    no_fastq = sum(1 for row in rows if not row.get('fastq_ftp'))
+    print(f"{len(accessions)} 个编号 -> {len(rows)} 个run, {len(manifest.files)} 个文件, "
+          f"共 {total / 1024 ** 3:.2f} GB (耗时 {time.time() - start_time:.2f}秒)")
+    print(f"缓存命中: {stats['cached']} | 查询: {stats['fetched']} 个编号 / {stats['requests']} 个请求")
+    if no_fastq:
+        print(f"注意: {no_fastq} 个run在ENA上没有fastq文件 (只有 sra_ftp)")
+    others = [p for p in find_sources(args.report_dir) if os.path.abspath(p) != os.path.abspath(path)]
+    if others:
+        print(f"注意: 清单目录中还有 {len(others)} 个其他清单, 下载脚本会一并读取")
+    print(f"清单已保存到: {path}")
+
+
+if __name__ == '__main__':
+    main()
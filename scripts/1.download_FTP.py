@@ -1,60 +1,69 @@
 import os
-import requests
 from pathlib import Path
-import pandas as pd
-
-# 输入文件路径（Excel）
-excel_path = r"D:\NCBI_ascp\data_report\下载样本列表.xlsx"
+from manifest import load_manifest
+import bandwidth
+import metrics
+import disk_plan
+from download_engine import make_tasks, run_downloads, http_url
+from job_store import JobStore, default_job_path
+import sinks
+from leases import LeaseStore
+from range_download import download_file
+from sources import SourceSelector, default_stats_path
+
+# 样本清单: data_report目录 (直接读取ENA导出的tsv) / 单个tsv / 手工挑选的xlsx
+manifest_path = r"D:\NCBI_ascp\data_report"
 
 # 输出目录（确保存在并有写入权限）
 download_dir = r"D:\NCBI_ascp\data"
+# 其他磁盘上的下载目录 (主目录空间不够时按run分配过去), 如 [r"E:\NCBI_ascp\data"]
+extra_dirs = []
 
-# 确保目录存在并有写入权限
-Path(download_dir).mkdir(parents=True, exist_ok=True)
-if not os.access(download_dir, os.W_OK):
-    print(f"错误：没有写入权限 {download_dir}")
-    exit(1)
-
-# 读取Excel文件
-df = pd.read_excel(excel_path)
-ftp_links = df["fastq_ftp"].dropna().tolist()
-
-def download_file(url, dest_path):
-    """
-    下载文件，支持断点续传
-    :param url: 文件下载链接
-    :param dest_path: 文件保存路径
-    """
-    # 检查文件是否已部分下载
-    file_size = 0
-    if os.path.exists(dest_path):
-        file_size = os.path.getsize(dest_path)
+# 并发参数
+MAX_WORKERS = 8  # 同时下载的文件数
+MAX_PER_HOST = 4  # 单个主机同时下载的文件数
+SEGMENTS = 8  # 单个大文件的分段并行连接数 (1 表示不分段)
+CHUNK_SIZE = 1024 * 1024  # 单连接下载的读取块大小
+FAILOVER = True  # 按实测吞吐在 HTTPS / FTP / Aspera (及 sources.EXTRA_MIRRORS) 之间选择来源, 出错时从当前位置切换
 
-    # 设置请求头，支持断点续传
-    headers = {"Range": f"bytes={file_size}-"} if file_size else {}
+# 带宽参数 (与 ascp -l 相同的单位, 比特/秒)
+RATE_LIMIT = None  # 所有并发下载共享的带宽上限, 如 "800m"; None 不限速
+RATE_SCHEDULE = None  # 分时段限速, 如 "08:00-20:00=300m,20:00-08:00=900m"
+ADAPTIVE = False  # 根据吞吐和出错率自动调整同时下载的文件数 (不超过 MAX_WORKERS)
 
-    try:
-        # 发起请求
-        response = requests.get(url, headers=headers, stream=True, timeout=30)
-        response.raise_for_status()
+# 进度指标 (控制台每 metrics.CONSOLE_INTERVAL 秒输出一行汇总)
+METRICS_FILE = None  # JSON-lines 事件文件, 如 "metrics.jsonl"
+PROM_FILE = None  # Prometheus 文本格式文件 (node_exporter textfile collector)
+PROM_PORT = None  # 提供 http://<host>:<port>/metrics, 如 9108
 
-        # 获取文件总大小
-        total_size = int(response.headers.get("content-length", 0)) + file_size
+# 下载目标: None 写入 download_dir; "s3://bucket/prefix" 不落地, 直接流式写入S3兼容的对象存储
+# (multipart 分片并发上传, 边传边核对 fastq_md5, 见 sinks.py; download_dir 只保存状态文件)
+SINK = None
 
-        # 以追加模式写入文件
-        with open(dest_path, "ab") as file:
-            for chunk in response.iter_content(chunk_size=8192):
-                if chunk:  # 过滤掉空的chunk
-                    file.write(chunk)
-                    file_size += len(chunk)
-                    print(f"下载进度: {file_size}/{total_size} bytes", end="\r")
+# 多节点: 几台节点共享同一个下载目录 (并行文件系统) 时各运行一份本脚本, 用租约文件分摊文件 (见 leases.py)
+SHARED = False
 
-        print(f"\n文件下载完成: {dest_path}")
-        return True
+# 确保目录存在并有写入权限
+Path(download_dir).mkdir(parents=True, exist_ok=True)
+if not os.access(download_dir, os.W_OK):
+    print(f"错误：没有写入权限 {download_dir}")
+    exit(1)
 
-    except requests.exceptions.RequestException as e:
-        print(f"下载失败 {url}: {e}")
-        return False
+# 全局带宽预算
+bandwidth.configure(RATE_LIMIT, RATE_SCHEDULE)
+metrics.configure(METRICS_FILE, PROM_FILE, PROM_PORT)
+
+# 读取样本清单
+manifest = load_manifest(manifest_path)
+ftp_links = manifest.links("fastq_ftp")
+md5_map = manifest.md5s()
+selector = SourceSelector(default_stats_path(download_dir), segments=SEGMENTS) if FAILOVER else None
+sizes = manifest.sizes()
+try:
+    sink = sinks.open_sink(SINK) if SINK else None
+except sinks.S3Error as e:
+    print(f"错误：{e}")
+    exit(1)
 
 def download_ftp(link):
     """
@@ -63,24 +72,30 @@ def download_ftp(link):
     """
     # 提取文件名
     file_name = link.split("/")[-1]
-    dest_path = os.path.join(download_dir, file_name)
-
-    # 构建完整的HTTP URL（假设FTP服务器支持HTTP访问）
-    if not link.startswith("ftp://"):
-        link = "ftp://" + link
-    http_link = link.replace("ftp://", "https://")
+    dest_path = dest_paths.get(file_name, os.path.join(download_dir, file_name))
+    if sink is not None:
+        return sinks.stream_download(http_url(link), sink, file_name, expected_md5=md5_map.get(file_name),
+                                     size=sizes.get(file_name))
 
     print(f"正在下载: {file_name}")
-    return download_file(http_link, dest_path)
-
-# 处理所有链接
-for link in ftp_links:
-    if ";" in link:
-        for sublink in link.split(";"):
-            sublink = sublink.strip()
-            if sublink:  # 确保不是空字符串
-                download_ftp(sublink)
-    else:
-        download_ftp(link)
-
-print("所有文件下载完成！")
+    if selector is not None:
+        return selector.download(manifest.by_name[file_name], dest_path,
+                                 expected_md5=md5_map.get(file_name))
+    return download_file(http_url(link), dest_path, segments=SEGMENTS, chunk_size=CHUNK_SIZE,
+                         expected_md5=md5_map.get(file_name))
+
+# 并发处理所有链接 (大文件优先, 按主机限流)
+tasks = make_tasks(ftp_links, download_dir, sizes=sizes)
+if sink is None:
+    job_store = JobStore(default_job_path(download_dir))
+    # 检查剩余空间并预分配, 多个下载目录时按run分配
+    tasks = disk_plan.prepare(tasks, [download_dir] + extra_dirs, job_store=job_store)
+else:
+    job_store = None  # 已完成的对象由元数据中的MD5判断
+dest_paths = {t['file_name']: t['dest_path'] for t in tasks}
+leases = LeaseStore(download_dir, 'download') if SHARED else None
+run_downloads(tasks, download_ftp, max_workers=MAX_WORKERS, max_per_host=MAX_PER_HOST,
+              job_store=job_store, leases=leases,
+              concurrency=bandwidth.adaptive(MAX_WORKERS) if ADAPTIVE else None)
+if leases is not None:
+    leases.close()
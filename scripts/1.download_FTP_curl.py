@@ -1,57 +1,101 @@
 import os
-import subprocess
-import pandas as pd
 from pathlib import Path
+from manifest import load_manifest
+import bandwidth
+import metrics
+import disk_plan
+from download_engine import make_tasks, run_downloads
+from job_store import JobStore, default_job_path
+from leases import LeaseStore
+from md5_stream import HashingWriter, stream_command, finish_download, is_verified
+from transfer_watch import Stalled
 
-# 输入文件路径（Excel）
-excel_path = r"D:\NCBI_ascp\data_report\下载样本列表.xlsx"
+# 样本清单: data_report目录 (直接读取ENA导出的tsv) / 单个tsv / 手工挑选的xlsx
+manifest_path = r"D:\NCBI_ascp\data_report"
 
 # 输出目录（确保存在并有写入权限）
 download_dir = r"D:\NCBI_ascp\data"
 
+# 并发参数
+MAX_WORKERS = 8  # 同时下载的文件数
+MAX_PER_HOST = 4  # 单个主机同时下载的文件数
+STALL_RETRIES = 3  # 吞吐低于下限 (transfer_watch.MIN_RATE) 被中断后重新连接续传的次数
+
+# 带宽参数 (与 ascp -l 相同的单位, 比特/秒)
+RATE_LIMIT = None  # 所有并发下载共享的带宽上限, 如 "800m"; None 不限速
+RATE_SCHEDULE = None  # 分时段限速, 如 "08:00-20:00=300m,20:00-08:00=900m"
+ADAPTIVE = False  # 根据吞吐和出错率自动调整同时下载的文件数 (不超过 MAX_WORKERS)
+
+# 进度指标 (控制台每 metrics.CONSOLE_INTERVAL 秒输出一行汇总)
+METRICS_FILE = None  # JSON-lines 事件文件, 如 "metrics.jsonl"
+PROM_FILE = None  # Prometheus 文本格式文件 (node_exporter textfile collector)
+PROM_PORT = None  # 提供 http://<host>:<port>/metrics, 如 9108
+
+# 多节点: 几台节点共享同一个下载目录 (并行文件系统) 时各运行一份本脚本, 用租约文件分摊文件 (见 leases.py)
+SHARED = False
+
 # 确保目录存在并有写入权限
 Path(download_dir).mkdir(parents=True, exist_ok=True)
 if not os.access(download_dir, os.W_OK):
     print(f"错误：没有写入权限 {download_dir}")
     exit(1)
 
-# 读取Excel文件
-df = pd.read_excel(excel_path)
-ftp_links = df["fastq_ftp"].dropna().tolist()
+# 全局带宽预算
+bandwidth.configure(RATE_LIMIT, RATE_SCHEDULE)
+metrics.configure(METRICS_FILE, PROM_FILE, PROM_PORT)
+
+# 读取样本清单
+manifest = load_manifest(manifest_path)
+ftp_links = manifest.links("fastq_ftp")
+md5_map = manifest.md5s()
 
 def download_curl(link):
     """
     使用curl下载文件，支持断点续传
+    curl的输出经由Python写入文件，下载的同时计算MD5并与清单比对
     :param link: FTP链接
     """
     # 提取文件名
     file_name = link.split("/")[-1]
     dest_path = os.path.join(download_dir, file_name)
+    expected_md5 = md5_map.get(file_name)
+    if expected_md5 and is_verified(dest_path, expected_md5):
+        print(f"文件已下载并校验, 跳过: {dest_path}")
+        return True
 
     # 构建完整的FTP URL
     if not link.startswith("ftp://"):
         link = "ftp://" + link
 
-    # 使用curl下载（支持断点续传）
-    cmd = f'curl -L -C - -o "{dest_path}" "{link}"'
+    # 从已下载的位置续传（并发时关闭进度条避免输出混杂）
     print(f"正在下载: {file_name}")
-
-    try:
-        subprocess.run(cmd, shell=True, check=True)
-        print(f"文件下载完成: {dest_path}")
-        return True
-    except subprocess.CalledProcessError as e:
-        print(f"下载失败 {link}: {e}")
-        return False
-
-# 处理所有链接
-for link in ftp_links:
-    if ";" in link:
-        for sublink in link.split(";"):
-            sublink = sublink.strip()
-            if sublink:  # 确保不是空字符串
-                download_curl(sublink)
+    for attempt in range(1, STALL_RETRIES + 2):
+        writer = HashingWriter(dest_path)
+        cmd = ["curl", "-sS", "-L", "-C", str(writer.offset), link]
+        try:
+            returncode = stream_command(cmd, writer)
+        except Stalled as e:
+            print(f"下载过慢 {file_name} (第{attempt}次): {e}, 从 {writer.offset} 字节处续传")
+            continue
+        finally:
+            actual_md5 = writer.close()
+        break
     else:
-        download_curl(link)
+        print(f"下载失败 {link}: 多次重新连接后仍然过慢")
+        return False
+    if returncode != 0:
+        print(f"下载失败 {link}: curl 退出码 {returncode}")
+        return False
+    print(f"文件下载完成: {dest_path}")
+    return finish_download(dest_path, actual_md5, expected_md5)
 
-print("所有文件下载完成！")
+# 并发处理所有链接 (大文件优先, 按主机限流)
+tasks = make_tasks(ftp_links, download_dir, sizes=manifest.sizes())
+job_store = JobStore(default_job_path(download_dir))
+tasks = disk_plan.prepare(tasks, [download_dir], job_store=job_store)  # 检查剩余空间并预分配
+leases = LeaseStore(download_dir, 'download') if SHARED else None
+run_downloads(tasks, download_curl, max_workers=MAX_WORKERS, max_per_host=MAX_PER_HOST,
+              job_store=job_store, leases=leases,
+              concurrency=bandwidth.adaptive(MAX_WORKERS) if ADAPTIVE else None)
+if leases is not None:
+    leases.close()
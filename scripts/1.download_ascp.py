@@ -1,40 +1,63 @@
-import pandas as pd
 import os
-import subprocess
+import time
+from manifest import load_manifest
+import aspera
+import bandwidth
+import metrics
+import disk_plan
+from download_engine import make_tasks, print_summary
+from job_store import JobStore, default_job_path
+from leases import LeaseStore
 
-# 输入文件路径（Excel）
-excel_path = "/mnt/d/NCBI_ascp/data_report/下载样本列表.xlsx"
+# 样本清单: data_report目录 (直接读取ENA导出的tsv) / 单个tsv / 手工挑选的xlsx
+manifest_path = "/mnt/d/NCBI_ascp/data_report"
 # 输出目录（确保存在）
 download_dir = "/mnt/d/NCBI_ascp/data"
 os.makedirs(download_dir, exist_ok=True)
 
-# 读取 Excel 文件
-df = pd.read_excel(excel_path)
-aspera_links = df["fastq_aspera"].dropna().tolist()
+# 并发参数 (fasp.sra.ebi.ac.uk 单主机, 会话数不宜过多)
+SESSIONS = 4  # 同时运行的 ascp 会话数
+BATCH_SIZE = 20  # 每个会话用 --file-pair-list 批量传输的文件数
+RETRIES = 3  # 未完成的文件最多重试几轮 (断点续传)
+
+# 带宽参数 (与 ascp -l 相同的单位, 比特/秒)
+RATE_LIMIT = None  # 所有会话共享的带宽上限, 如 "800m" (平分给各会话作为 -l); None 不限速
+RATE_SCHEDULE = None  # 分时段限速, 如 "08:00-20:00=300m,20:00-08:00=900m"
+ADAPTIVE = False  # 根据吞吐和出错率自动调整同时运行的会话数 (不超过 SESSIONS)
+
+# 进度指标 (控制台每 metrics.CONSOLE_INTERVAL 秒输出一行汇总)
+METRICS_FILE = None  # JSON-lines 事件文件, 如 "metrics.jsonl"
+PROM_FILE = None  # Prometheus 文本格式文件 (node_exporter textfile collector)
+PROM_PORT = None  # 提供 http://<host>:<port>/metrics, 如 9108
+
+# 多节点: 几台节点共享同一个下载目录 (并行文件系统) 时各运行一份本脚本, 用租约文件分摊文件 (见 leases.py)
+SHARED = False
 
 # Aspera 参数
-ascp_cmd = "ascp"
+ascp_cmd = "ascp"  # 测试时可换成 "python bench/fake_ascp.py"
 aspera_key = "~/.aspera/connect/etc/asperaweb_id_dsa.openssh"
 aspera_user = "anonftp"  # EBI 公共数据使用 anonftp
-aspera_options = "-QT -l 1000m -k 1"  # 断点续传 (-k 1) + 限速 1000Mbps
-
-# 下载函数（支持断点续传）
-def download_aspera(link):
-    file_name = link.split("/")[-1]
-    dest_path = os.path.join(download_dir, file_name)
-    cmd = f"{ascp_cmd} {aspera_options} -i {aspera_key} {aspera_user}@{link} {dest_path}"
-    print(f"Downloading: {file_name}")
-    try:
-        subprocess.run(cmd, shell=True, check=True)
-    except subprocess.CalledProcessError as e:
-        print(f"Error downloading {link}: {e}")
-
-# 遍历所有链接并下载
-for link in aspera_links:
-    if ";" in link:  # 处理多个文件（如 _1.fastq.gz 和 _2.fastq.gz）
-        for sublink in link.split(";"):
-            download_aspera(sublink.strip())
-    else:
-        download_aspera(link)
-
-print("所有文件下载完成！")
+aspera_options = "-QT -k 1"  # 断点续传 (-k 1)
+
+# 全局带宽预算
+bandwidth.configure(RATE_LIMIT, RATE_SCHEDULE)
+metrics.configure(METRICS_FILE, PROM_FILE, PROM_PORT)
+
+# 读取样本清单
+manifest = load_manifest(manifest_path)
+aspera_links = manifest.links("fastq_aspera")
+
+# 并行批量下载（;拼接的 _1.fastq.gz 和 _2.fastq.gz 会被拆分, 大文件优先）
+tasks = make_tasks(aspera_links, download_dir, sizes=manifest.sizes())
+job_store = JobStore(default_job_path(download_dir))
+tasks = disk_plan.prepare(tasks, [download_dir], job_store=job_store)  # 检查剩余空间并预分配
+leases = LeaseStore(download_dir, 'download') if SHARED else None
+start_time = time.time()
+results = aspera.download_all(tasks, download_dir, sessions=SESSIONS, batch_size=BATCH_SIZE,
+                              retries=RETRIES, ascp_cmd=ascp_cmd, key=aspera_key, user=aspera_user,
+                              options=aspera_options,
+                              job_store=job_store, leases=leases,
+                              concurrency=bandwidth.adaptive(SESSIONS) if ADAPTIVE else None)
+print_summary(results, time.time() - start_time)
+if leases is not None:
+    leases.close()
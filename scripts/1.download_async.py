@@ -0,0 +1,65 @@
+import os
+import time
+import asyncio
+from pathlib import Path
+from manifest import load_manifest
+import bandwidth
+import metrics
+import disk_plan
+from download_engine import make_tasks, print_summary
+from job_store import JobStore, default_job_path
+from leases import LeaseStore
+from async_download import download_all
+
+# 样本清单: data_report目录 (直接读取ENA导出的tsv) / 单个tsv / 手工挑选的xlsx
+manifest_path = r"D:\NCBI_ascp\data_report"
+
+# 输出目录（确保存在并有写入权限）
+download_dir = r"D:\NCBI_ascp\data"
+
+# 并发参数 (单进程 asyncio, 适合成千上万个小文件的项目)
+PROTOCOL = "https"  # "https" 复用keep-alive连接, "ftp" 复用登录后的控制连接
+MAX_CONCURRENCY = 200  # 同时传输的文件数
+MAX_PER_HOST = 16  # 单个主机同时传输的文件数; fastq_ftp 链接都在 ftp.sra.ebi.ac.uk 上, 实际并发即此值
+
+# 带宽参数 (与 ascp -l 相同的单位, 比特/秒)
+RATE_LIMIT = None  # 所有并发下载共享的带宽上限, 如 "800m"; None 不限速
+RATE_SCHEDULE = None  # 分时段限速, 如 "08:00-20:00=300m,20:00-08:00=900m"
+ADAPTIVE = False  # 根据吞吐和出错率自动调整同时下载的文件数 (不超过 MAX_CONCURRENCY)
+
+# 进度指标 (控制台每 metrics.CONSOLE_INTERVAL 秒输出一行汇总)
+METRICS_FILE = None  # JSON-lines 事件文件, 如 "metrics.jsonl"
+PROM_FILE = None  # Prometheus 文本格式文件 (node_exporter textfile collector)
+PROM_PORT = None  # 提供 http://<host>:<port>/metrics, 如 9108
+
+# 多节点: 几台节点共享同一个下载目录 (并行文件系统) 时各运行一份本脚本, 用租约文件分摊文件 (见 leases.py)
+SHARED = False
+
+# 确保目录存在并有写入权限
+Path(download_dir).mkdir(parents=True, exist_ok=True)
+if not os.access(download_dir, os.W_OK):
+    print(f"错误：没有写入权限 {download_dir}")
+    exit(1)
+
+# 全局带宽预算
+bandwidth.configure(RATE_LIMIT, RATE_SCHEDULE)
+metrics.configure(METRICS_FILE, PROM_FILE, PROM_PORT)
+
+# 读取样本清单
+manifest = load_manifest(manifest_path)
+ftp_links = manifest.links("fastq_ftp")
+md5_map = manifest.md5s()
+
+# 所有文件在一个事件循环中并发下载 (大文件优先, 按主机限流), 边下载边校验MD5
+tasks = make_tasks(ftp_links, download_dir, sizes=manifest.sizes())
+job_store = JobStore(default_job_path(download_dir))
+tasks = disk_plan.prepare(tasks, [download_dir], job_store=job_store)  # 检查剩余空间并预分配
+leases = LeaseStore(download_dir, 'download') if SHARED else None
+start_time = time.time()
+results = asyncio.run(download_all(tasks, protocol=PROTOCOL, md5_map=md5_map,
+                                   max_concurrency=MAX_CONCURRENCY, max_per_host=MAX_PER_HOST,
+                                   job_store=job_store, leases=leases,
+                                   concurrency=bandwidth.adaptive(MAX_CONCURRENCY) if ADAPTIVE else None))
+print_summary(results, time.time() - start_time)
+if leases is not None:
+    leases.close()
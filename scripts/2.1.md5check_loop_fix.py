@@ -1,21 +1,35 @@
 import os
 import pandas as pd
-import hashlib
 import subprocess
 import time
+import argparse
 from pathlib import Path
 from concurrent.futures import ThreadPoolExecutor, as_completed
+from md5_cache import MD5Cache, default_cache_path, file_signature
+from hash_engine import md5_file
+from io_scheduler import run_by_device
+from manifest import load_manifest
+from job_store import JobStore, default_job_path, DOWNLOADING, VERIFIED, FAILED
+import block_repair
 
 # 配置参数
-EXCEL_PATH = r"D:\NCBI_ascp\data_report\下载样本列表.xlsx"
+MANIFEST_PATH = r"D:\NCBI_ascp\data_report"  # data_report目录 / 单个tsv / xlsx
 DOWNLOAD_DIR = r"D:\NCBI_ascp\data"
 MD5_RESULT_FILE = r"D:\NCBI_ascp\data\md5_verification_results.csv"
 MAX_RETRIES = 3
 MAX_WORKERS = 4
 CHUNK_SIZE = 1024 * 1024  # 1MB
+SMART_REPAIR = True  # MD5不一致时先按块比较并只替换损坏的块 (HTTPS Range), 失败再删除重新下载
+
+md5_cache = None  # MD5缓存, 在main中打开
+force_rehash = False  # --force: 忽略缓存
+job_store = None  # 任务状态库, 在main中打开
+computed_md5 = {}  # 本次运行中算出的MD5: 路径 -> (文件签名, MD5), 最终校验时签名未变化的直接复用
 
 def load_failed_files(md5_file):
-    """从MD5校验结果中加载失败的文件"""
+    """加载失败的文件: 优先使用任务状态库中的 failed 任务, 没有记录时读取MD5校验结果CSV"""
+    if job_store is not None and job_store.counts():
+        return [job['file_name'] for job in job_store.by_state(FAILED)]
     try:
         df = pd.read_csv(md5_file)
         return df[df['is_valid'] == False]['file_name'].tolist()
@@ -23,42 +37,42 @@ def load_failed_files(md5_file):
         print(f"Error loading MD5 result file: {e}")
         return []
 
-def get_download_info(excel_path, file_list):
-    """从Excel中获取需要下载的文件信息"""
+def get_download_info(manifest_path, file_list):
+    """从样本清单中获取需要下载的文件信息"""
     try:
-        df = pd.read_excel(excel_path)
-        download_info = []
-        
-        for file_name in file_list:
-            # 从文件名提取SRR编号
-            srr_id = file_name.split('_')[0]
-            # 查找Excel中对应的行
-            row = df[df['run_accession'].str.startswith(srr_id)]
-            if not row.empty:
-                # 获取下载链接和MD5值
-                urls = row['fastq_ftp'].values[0].split(';')
-                md5s = row['fastq_md5'].values[0].split(';')
-                
-                # 确定是1还是2
-                if '_1.fastq.gz' in file_name:
-                    url = urls[0]
-                    md5 = md5s[0]
-                else:
-                    url = urls[1]
-                    md5 = md5s[1]
-                
-                download_info.append({
-                    'file_name': file_name,
-                    'url': f"ftp://{url}",  # 修改为ftp协议
-                    'md5': md5
-                })
-        return download_info
+        by_name = load_manifest(manifest_path).by_name
     except Exception as e:
-        print(f"Error reading Excel file: {e}")
+        print(f"Error reading manifest: {e}")
         return []
+    download_info = []
+    for file_name in file_list:
+        record = by_name.get(file_name)
+        if record and record['ftp']:
+            download_info.append({
+                'file_name': file_name,
+                'url': f"ftp://{record['ftp']}",  # 修改为ftp协议
+                'md5': record['md5'],
+                'size': record['bytes']
+            })
+    return download_info
 
-def download_with_curl(url, dest_path, md5):
+def try_repair(url, dest_path, md5, size=None):
+    """块级修复已存在但MD5不一致的文件, 成功返回True"""
+    if not SMART_REPAIR or not os.path.exists(dest_path):
+        return False
+    try:
+        result = block_repair.repair(url, dest_path, md5, size=size)
+    except Exception as e:
+        print(f"Block repair unavailable for {dest_path}: {e}")
+        return False
+    computed_md5[dest_path] = (file_signature(dest_path), result['md5'])
+    return result['ok']
+
+def download_with_curl(url, dest_path, md5, size=None):
     """使用curl下载文件并校验MD5"""
+    if os.path.exists(dest_path) and not verify_md5(dest_path, md5) and try_repair(url, dest_path, md5, size):
+        print(f"Repair and verification successful for {dest_path}")
+        return True
     retry = 0
     while retry < MAX_RETRIES:
         try:
@@ -74,6 +88,9 @@ def download_with_curl(url, dest_path, md5):
                 return True
             else:
                 print(f"MD5 verification failed for {dest_path}")
+                if try_repair(url, dest_path, md5, size):
+                    print(f"Repair and verification successful for {dest_path}")
+                    return True
                 os.remove(dest_path)
                 retry += 1
         except Exception as e:
@@ -83,24 +100,101 @@ def download_with_curl(url, dest_path, md5):
                 os.remove(dest_path)
     return False
 
+def known_md5(file_path):
+    """本次运行已算出或缓存中的MD5 (文件签名未变化时), 没有时返回None"""
+    signature = file_signature(file_path)
+    known = computed_md5.get(file_path)
+    if known and known[0] == signature:
+        return known[1]
+    if md5_cache is not None:
+        cached_md5 = md5_cache.get(file_path, signature, force=force_rehash)
+        if cached_md5:
+            computed_md5[file_path] = (signature, cached_md5)
+            return cached_md5
+    return None
+
 def verify_md5(file_path, expected_md5):
-    """验证文件的MD5值"""
+    """验证文件的MD5值 (文件签名未变化时直接使用缓存)"""
     if not os.path.exists(file_path):
         return False
     
-    md5_hash = hashlib.md5()
-    with open(file_path, 'rb') as f:
-        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
-            md5_hash.update(chunk)
-    return md5_hash.hexdigest() == expected_md5
+    actual_md5 = known_md5(file_path)
+    if actual_md5 is None:
+        signature = file_signature(file_path)
+        actual_md5 = md5_file(file_path, CHUNK_SIZE)
+        computed_md5[file_path] = (signature, actual_md5)
+        if md5_cache is not None:
+            md5_cache.put(file_path, actual_md5, signature)
+    return actual_md5 == expected_md5
+
+def hash_worker(file_path):
+    """最终校验的子进程任务: 流式计算MD5 (复用缓冲区, 内存占用固定)"""
+    signature = file_signature(file_path)
+    return file_path, signature, md5_file(file_path, CHUNK_SIZE)
+
+def final_verification(download_info):
+    """
+    重新校验所有文件: 下载/修复时已算出MD5且文件未再变化的直接复用,
+    其余文件按设备并行流式计算
+    """
+    digests = {}
+    tasks = []
+    for info in download_info:
+        file_path = info['dest_path']
+        if not os.path.exists(file_path):
+            continue
+        actual_md5 = known_md5(file_path)
+        if actual_md5:
+            digests[file_path] = actual_md5
+        else:
+            tasks.append((file_path,))
+    if tasks:
+        print(f"Hashing {len(tasks)} files ({len(digests)} reused from this run or cache)...")
+    for file_path, signature, actual_md5 in run_by_device(tasks, hash_worker, max_workers=MAX_WORKERS):
+        digests[file_path] = actual_md5
+        md5_cache.put(file_path, actual_md5, signature)
+    
+    verification_results = []
+    for info in download_info:
+        actual_md5 = digests.get(info['dest_path'])
+        verification_results.append({
+            'file_name': info['file_name'],
+            'expected_md5': info['md5'],
+            'actual_md5': actual_md5,
+            'is_valid': actual_md5 == info['md5']
+        })
+    return verification_results
+
+def save_results(verification_results, result_file):
+    """把本次结果合并到已有的校验结果CSV: 替换重新下载的文件所在的行, 保留其他文件的结果"""
+    result_df = pd.DataFrame(verification_results)
+    if os.path.exists(result_file):
+        try:
+            existing = pd.read_csv(result_file)
+        except Exception as e:
+            print(f"Error loading MD5 result file, it will be replaced: {e}")
+        else:
+            kept = existing[~existing['file_name'].isin(result_df['file_name'])]
+            result_df = pd.concat([kept, result_df], ignore_index=True)[
+                list(dict.fromkeys(list(existing.columns) + list(result_df.columns)))]
+    tmp_file = result_file + ".tmp"
+    result_df.to_csv(tmp_file, index=False)
+    os.replace(tmp_file, result_file)
 
 def process_download(download_info):
     """处理单个下载任务"""
     file_name = download_info['file_name']
-    dest_path = os.path.join(DOWNLOAD_DIR, file_name)
-    os.makedirs(DOWNLOAD_DIR, exist_ok=True)
+    dest_path = download_info['dest_path']
+    os.makedirs(os.path.dirname(dest_path), exist_ok=True)
     
-    success = download_with_curl(download_info['url'], dest_path, download_info['md5'])
+    job_store.transition(file_name, DOWNLOADING, url=download_info['url'], dest_path=dest_path)
+    start = time.time()
+    success = download_with_curl(download_info['url'], dest_path, download_info['md5'],
+                                 download_info.get('size'))
+    job_store.transition(file_name, VERIFIED if success else FAILED, record_signature=success,
+                         download_seconds=time.time() - start,
+                         md5=download_info['md5'] if success else None,
+                         error=None if success else "重新下载后仍未通过MD5校验")
     return {
         'file_name': file_name,
         'success': success,
@@ -108,6 +202,15 @@ def process_download(download_info):
     }
 
 def main():
+    global md5_cache, force_rehash, job_store
+    parser = argparse.ArgumentParser(description='MD5校验失败文件的循环修复')
+    parser.add_argument('--force', action='store_true',
+                        help='忽略MD5缓存, 重新计算所有文件')
+    force_rehash = parser.parse_args().force
+    os.makedirs(DOWNLOAD_DIR, exist_ok=True)
+    md5_cache = MD5Cache(default_cache_path(DOWNLOAD_DIR))
+    job_store = JobStore(default_job_path(DOWNLOAD_DIR))
+    
     # 1. 加载校验失败的文件
     failed_files = load_failed_files(MD5_RESULT_FILE)
     if not failed_files:
@@ -119,11 +222,18 @@ def main():
         print(f" - {f}")
     
     # 2. 获取下载信息
-    download_info = get_download_info(EXCEL_PATH, failed_files)
+    download_info = get_download_info(MANIFEST_PATH, failed_files)
     if not download_info:
         print("No download information found for failed files.")
         return
     
+    # 重新下载到原来的位置 (下载时可能放在其他下载目录, 见 disk_plan.py)
+    paths = job_store.locations(DOWNLOAD_DIR, [info['file_name'] for info in download_info])
+    for info in download_info:
+        info['dest_path'] = paths[info['file_name']]
+    job_store.add([{'file_name': info['file_name'], 'url': info['url'], 'expected_md5': info['md5'],
+                    'dest_path': info['dest_path']} for info in download_info])
+    
     # 3. 并发下载
     print(f"Starting download with {MAX_WORKERS} workers...")
     start_time = time.time()
@@ -142,25 +252,17 @@ def main():
     
     # 4. 重新校验所有文件
     print("\nVerifying downloaded files...")
-    verification_results = []
-    for info in download_info:
-        file_path = os.path.join(DOWNLOAD_DIR, info['file_name'])
-        is_valid = verify_md5(file_path, info['md5'])
-        verification_results.append({
-            'file_name': info['file_name'],
-            'expected_md5': info['md5'],
-            'actual_md5': hashlib.md5(open(file_path, 'rb').read()).hexdigest() if os.path.exists(file_path) else None,
-            'is_valid': is_valid
-        })
+    verification_results = final_verification(download_info)
     
-    # 5. 保存校验结果
-    result_df = pd.DataFrame(verification_results)
-    result_df.to_csv(MD5_RESULT_FILE, index=False)
-    print(f"Verification results saved to {MD5_RESULT_FILE}")
+    # 5. 保存校验结果 (合并到已有的CSV)
+    save_results(verification_results, MD5_RESULT_FILE)
+    print(f"Verification results merged into {MD5_RESULT_FILE}")
     
     # 6. 显示最终结果
-    success_count = result_df['is_valid'].sum()
-    print(f"\nFinal result: {success_count} files successfully downloaded and verified, {len(result_df) - success_count} files failed")
+    success_count = sum(1 for r in verification_results if r['is_valid'])
+    print(f"\nFinal result: {success_count} files successfully downloaded and verified, {len(verification_results) - success_count} files failed")
+    print(md5_cache.stats_line())
+    print(job_store.summary_line())
 
 if __name__ == "__main__":
     main()
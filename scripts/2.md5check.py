@@ -1,101 +1,221 @@
 import os
 import sys
-import hashlib
 import pandas as pd
-from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 import time
 import argparse
+import metrics
+from md5_cache import MD5Cache, default_cache_path, file_signature
+import io_scheduler
+from hash_engine import md5_file, hash_file, parse_digests
+from io_scheduler import run_by_device
+from manifest import load_manifest
+from job_store import JobStore, default_job_path, VERIFIED, FAILED, ORGANIZED
+from fastq_check import FastqValidator, check_pairs, PAIR_PATTERN
+from leases import LeaseStore
 
 # 配置参数
-DEFAULT_EXCEL_PATH = r"D:\NCBI_ascp\data_report\下载样本列表.xlsx"
+DEFAULT_MANIFEST_PATH = r"D:\NCBI_ascp\data_report"  # data_report目录 / 单个tsv / xlsx
 DOWNLOAD_DIR = r"D:\NCBI_ascp\data"
-MAX_WORKERS = os.cpu_count()  # 使用所有可用CPU核心
-CHUNK_SIZE = 8192  # 读取文件的块大小
+MAX_WORKERS = os.cpu_count()  # 进程总数上限
+CHUNK_SIZE = 8 * 1024 * 1024  # 读取文件的块大小 (8MB, 机械盘和SSD都适用)
+USE_MMAP = False  # 使用mmap读取 (部分NVMe上更快, 可用 bench/bench_hash.py 对比)
+FASTQ_COLUMNS = ('read_count', 'fastq_error')  # --validate-fastq 的结果列
 
 def calculate_md5(file_path):
-    """计算文件的MD5值 (使用内存高效的方式)"""
-    md5 = hashlib.md5()
-    with open(file_path, 'rb') as f:
-        while chunk := f.read(CHUNK_SIZE):
-            md5.update(chunk)
-    return md5.hexdigest()
+    """计算文件的MD5值 (复用缓冲区的大块读取, 读后丢弃页缓存)"""
+    return md5_file(file_path, CHUNK_SIZE, use_mmap=USE_MMAP)
 
-def process_file(file_path, expected_md5):
-    """处理单个文件的MD5校验"""
+def calculate_digests(file_path, digests, sinks=()):
+    """一次读取计算多种摘要 (md5 / sha256 / crc32c ...), 同时把数据交给 sinks"""
+    return hash_file(file_path, digests, CHUNK_SIZE, use_mmap=USE_MMAP, sinks=sinks)
+
+def make_result(file_name, expected_md5, columns, values=None, error=None):
+    """组装单个文件的校验结果, md5以外的摘要和fastq校验结果作为附加列"""
+    values = values or {}
+    result = {
+        'file_name': file_name,
+        'expected_md5': expected_md5,
+        'actual_md5': values.get('md5'),
+        'is_valid': values.get('md5') == expected_md5,
+        'error': error
+    }
+    for name in columns:
+        if name != 'md5':
+            result[name] = values.get(name)
+    return result
+
+def process_file(file_path, expected_md5, digests=('md5',), validate=False):
+    """
+    处理单个文件的MD5校验 (同一次读取顺带计算其他摘要)
+    :param validate: 同时流式解压 .fastq.gz, 检查gzip完整性和FASTQ格式并统计reads数
+    """
     file_name = os.path.basename(file_path)
+    columns = digests + FASTQ_COLUMNS if validate else digests
+    validator = FastqValidator() if validate and file_name.endswith('.fastq.gz') else None
     try:
-        actual_md5 = calculate_md5(file_path)
-        is_valid = (actual_md5 == expected_md5)
-        return {
-            'file_name': file_name,
-            'expected_md5': expected_md5,
-            'actual_md5': actual_md5,
-            'is_valid': is_valid,
-            'error': None
-        }
+        if digests == ('md5',) and validator is None:
+            values = {'md5': calculate_md5(file_path)}
+        else:
+            values = calculate_digests(file_path, digests, [validator] if validator else ())
+        if validate:
+            reads, fastq_error = validator.finish() if validator else ('', None)
+            values['read_count'] = str(reads)
+            values['fastq_error'] = fastq_error or ''
+        return make_result(file_name, expected_md5, columns, values)
     except Exception as e:
-        return {
-            'file_name': file_name,
-            'expected_md5': expected_md5,
-            'actual_md5': None,
-            'is_valid': False,
-            'error': str(e)
-        }
+        return make_result(file_name, expected_md5, columns, error=str(e))
 
-def build_md5_map(excel_path):
-    """从Excel构建文件名到MD5的映射字典"""
+def build_md5_map(manifest_path):
+    """从样本清单构建文件名到MD5的映射字典"""
     try:
-        df = pd.read_excel(excel_path)
+        return load_manifest(manifest_path).md5s()
     except FileNotFoundError:
-        print(f"错误: 找不到Excel文件 {excel_path}")
+        print(f"错误: 找不到清单文件 {manifest_path}")
         sys.exit(1)
     except Exception as e:
-        print(f"读取Excel文件失败: {str(e)}")
+        print(f"读取清单失败: {str(e)}")
         sys.exit(1)
-        
-    md5_map = {}
-    
-    for _, row in df.iterrows():
-        if pd.notna(row['fastq_ftp']) and pd.notna(row['fastq_md5']):
-            files = row['fastq_ftp'].split(';')
-            md5s = row['fastq_md5'].split(';')
-            
-            for file, md5 in zip(files, md5s):
-                file_name = file.split('/')[-1]
-                md5_map[file_name] = md5.strip()
+
+def record_job(jobs, result):
+    """把校验结果写入任务状态库"""
+    valid = result['is_valid'] and not result.get('fastq_error')
+    jobs.transition(result['file_name'], VERIFIED if valid else FAILED,
+                    record_signature=bool(result['actual_md5']), md5=result['actual_md5'],
+                    error=None if valid else (result['error'] or result.get('fastq_error') or "MD5不匹配"))
+
+def report_fastq_validation(results):
+    """输出fastq校验失败的文件和reads数不一致的R1/R2配对, 并给结果添加 pair_ok 列"""
+    bad_files = [r for r in results if r.get('fastq_error')]
+    read_counts = {r['file_name']: int(r['read_count']) for r in results
+                   if r.get('read_count') and not r.get('fastq_error')}
+    mismatched = check_pairs(read_counts)
+    bad_runs = {run for run, _, _ in mismatched}
+    mates = {}
+    for file_name in read_counts:
+        match = PAIR_PATTERN.match(file_name)
+        if match:
+            mates[match.group(1)] = mates.get(match.group(1), 0) + 1
+    for r in results:
+        match = PAIR_PATTERN.match(r['file_name'])
+        paired = match and r['file_name'] in read_counts and mates[match.group(1)] == 2
+        r['pair_ok'] = (match.group(1) not in bad_runs) if paired else None
     
-    return md5_map
+    print(f"\nFASTQ校验: {len(read_counts)} 个文件通过 | {len(bad_files)} 个文件异常 | "
+          f"{len(mismatched)} 对R1/R2 reads数不一致")
+    for r in bad_files:
+        print(f" - {r['file_name']}: {r['fastq_error']}")
+    for run, r1_reads, r2_reads in mismatched:
+        print(f" - {run}: R1 {r1_reads} reads, R2 {r2_reads} reads")
 
 def main():
     parser = argparse.ArgumentParser(description='MD5校验工具')
-    parser.add_argument('-e', '--excel', type=str, default=DEFAULT_EXCEL_PATH,
-                       help=f'Excel文件路径 (默认: {DEFAULT_EXCEL_PATH})')
+    parser.add_argument('-m', '--manifest', '-e', '--excel', dest='manifest', type=str,
+                       default=DEFAULT_MANIFEST_PATH,
+                       help=f'样本清单: data_report目录、filereport tsv或xlsx (默认: {DEFAULT_MANIFEST_PATH})')
+    parser.add_argument('--force', action='store_true',
+                       help='忽略MD5缓存, 重新计算所有文件')
+    parser.add_argument('--digests', type=str, default='md5',
+                       help='逗号分隔的摘要列表, 一次读取全部算出并写入结果CSV, 例如 md5,sha256,crc32c (默认: md5)')
+    parser.add_argument('--validate-fastq', action='store_true',
+                       help='同时流式解压 .fastq.gz, 检查gzip完整性/记录格式, 统计reads数并核对R1/R2配对')
+    parser.add_argument('--hdd-readers', type=int, default=io_scheduler.HDD_READERS,
+                       help=f'每块机械盘同时读取的文件数 (默认: {io_scheduler.HDD_READERS})')
+    parser.add_argument('--ssd-readers', type=int, default=io_scheduler.SSD_READERS,
+                       help=f'每块SSD/NVMe同时读取的文件数 (默认: {io_scheduler.SSD_READERS})')
+    parser.add_argument('--unknown-readers', type=int, default=io_scheduler.UNKNOWN_READERS,
+                       help=f'无法识别类型的设备同时读取的文件数 (默认: {io_scheduler.UNKNOWN_READERS})')
+    parser.add_argument('--metrics', type=str, default=metrics.METRICS_FILE,
+                       help='把进度/吞吐等指标以JSON-lines写入该文件')
+    parser.add_argument('--prom-file', type=str, default=metrics.PROM_FILE,
+                       help='定期写入Prometheus文本格式的指标文件 (node_exporter textfile)')
+    parser.add_argument('--prom-port', type=int, default=metrics.PROM_PORT,
+                       help='在该端口提供 /metrics (Prometheus文本格式)')
+    parser.add_argument('--shared', action='store_true',
+                       help='多个节点共享下载目录时各运行一个实例, 用租约文件分摊校验 (见 leases.py)')
     args = parser.parse_args()
+    try:
+        digests = parse_digests(args.digests)
+    except (ValueError, ImportError) as e:
+        print(f"错误: 不支持的摘要 {args.digests}: {e}")
+        sys.exit(1)
+    columns = digests + FASTQ_COLUMNS if args.validate_fastq else digests
+    metrics.configure(args.metrics, args.prom_file, args.prom_port)
     
-    print(f"开始MD5校验 (使用 {MAX_WORKERS} 个并行进程)...")
+    print(f"开始MD5校验 (按设备调度, 最多 {MAX_WORKERS} 个并行进程)...")
     start_time = time.time()
     
     # 构建MD5映射表
-    md5_map = build_md5_map(args.excel)
+    md5_map = build_md5_map(args.manifest)
     
-    # 准备任务列表
+    # 准备任务列表 (文件签名未变化的直接使用缓存中的MD5)
+    cache = MD5Cache(default_cache_path(DOWNLOAD_DIR))
+    jobs = JobStore(default_job_path(DOWNLOAD_DIR))
+    paths = jobs.locations(DOWNLOAD_DIR, md5_map)  # 下载时可能放在其他下载目录 (EXTRA_DIRS)
+    jobs.add([{'file_name': name, 'dest_path': paths[name], 'expected_md5': md5}
+              for name, md5 in md5_map.items()])
+    results = []
     tasks = []
+    signatures = {}
+    organized = 0
     for file_name, expected_md5 in md5_map.items():
-        file_path = os.path.join(DOWNLOAD_DIR, file_name)
-        if os.path.exists(file_path):
-            tasks.append((file_path, expected_md5))
-        else:
+        file_path = paths[file_name]
+        if jobs.is_done(file_name, (ORGANIZED,)):
+            organized += 1  # 已校验并整理到样本目录
+            continue
+        if not os.path.exists(file_path):
             print(f"警告: 文件未找到 {file_name}")
+            continue
+        signatures[file_name] = file_signature(file_path)
+        cached = cache.get_digests(file_path, columns, signatures[file_name], force=args.force)
+        if cached:
+            result = make_result(file_name, expected_md5, columns, cached)
+            results.append(result)
+            record_job(jobs, result)
+        else:
+            tasks.append((file_path, expected_md5, digests, args.validate_fastq))
     
-    # 并行处理
-    results = []
-    with ProcessPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        futures = [executor.submit(process_file, *task) for task in tasks]
-        
-        for future in as_completed(futures):
-            results.append(future.result())
-            print(".", end="", flush=True)  # 进度指示
+    # 多节点共享: 每个文件先认领, 其他节点已校验的文件之后从缓存读取结果
+    leases = LeaseStore(DOWNLOAD_DIR, 'verify') if args.shared else None
+    elsewhere = []
+
+    def claim(task):
+        claimed = leases.acquire(os.path.basename(task[0]), task[0])
+        if claimed is False:
+            elsewhere.append(task)
+        return claimed
+
+    metrics.plan('hash', len(tasks), sum(signatures[os.path.basename(t[0])][0] for t in tasks))
+    # 按设备并行处理 (机械盘少量顺序读取, SSD多路并发, 不同设备同时进行)
+    for result in run_by_device(tasks, process_file,
+                                hdd_readers=args.hdd_readers,
+                                ssd_readers=args.ssd_readers,
+                                unknown_readers=args.unknown_readers,
+                                max_workers=MAX_WORKERS,
+                                claim=claim if leases is not None else None):
+        results.append(result)
+        if result['actual_md5']:
+            cache.put(paths[result['file_name']], result['actual_md5'],
+                      signatures[result['file_name']],
+                      extra={name: result[name] for name in columns if name != 'md5'})
+        record_job(jobs, result)
+        metrics.finish(result['file_name'], result['is_valid'], result['error'],
+                       nbytes=signatures[result['file_name']][0], stage='hash')  # 进度/吞吐/ETA 定期汇总
+        if leases is not None:
+            leases.release(result['file_name'], done=result['actual_md5'] is not None,
+                           path=paths[result['file_name']])
+    for file_path, expected_md5, _, _ in elsewhere:
+        file_name = os.path.basename(file_path)
+        cached = cache.get_digests(file_path, columns, signatures[file_name])
+        if cached:
+            results.append(make_result(file_name, expected_md5, columns, cached))
+        else:
+            print(f"警告: {file_name} 由其他节点校验, 缓存中没有所需的结果列")
+    if leases is not None:
+        print(leases.summary_line())
+        leases.close()
+    metrics.flush()
+    cache.close()
     
     # 分析结果
     valid_count = sum(1 for r in results if r['is_valid'])
@@ -103,6 +223,11 @@ def main():
     
     print(f"\n\n校验完成! 耗时: {time.time()-start_time:.2f}秒")
     print(f"总计: {len(results)} 个文件 | 有效: {valid_count} | 无效: {invalid_count}")
+    print(cache.stats_line())
+    if organized:
+        print(f"跳过 {organized} 个已整理的文件")
+    print(jobs.summary_line())
+    jobs.close()
     
     # 输出无效文件
     if invalid_count > 0:
@@ -115,6 +240,10 @@ def main():
             if file['error']:
                 print(f"错误: {file['error']}")
     
+    # fastq 完整性与 R1/R2 配对
+    if args.validate_fastq:
+        report_fastq_validation(results)
+    
     # 保存完整结果到CSV
     result_df = pd.DataFrame(results)
     result_csv = os.path.join(DOWNLOAD_DIR, "md5_verification_results.csv")
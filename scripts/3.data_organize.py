@@ -1,50 +1,80 @@
 # D:\NCBI_ascp\data
 ## 数据合并
 import os
-import shutil
+import argparse
 from pathlib import Path
-import re
+import organizer
+from manifest import load_manifest
+from job_store import JobStore, default_job_path, FAILED, ORGANIZED
 
 # 配置参数
 DATA_DIR = r"D:\NCBI_ascp\data"
 OUTPUT_DIR = r"D:\NCBI_ascp\organized_data"  # 整理后的输出目录
+MANIFEST_PATH = r"D:\NCBI_ascp\data_report"  # cellranger布局需要清单中的 sample_accession
+MODE = organizer.MODE  # move / hardlink / reflink / symlink / copy (见 organizer.py)
+LAYOUT = organizer.LAYOUT  # run: <run>/原文件名; cellranger: <sample>/<sample>_S1_L001_R1_001.fastq.gz
 
-def organize_fastq_files():
+def load_samples(manifest_path):
+    """文件名 -> sample_accession, 清单读取失败时返回空表 (按run编号分组)"""
+    try:
+        manifest = load_manifest(manifest_path)
+    except Exception as e:
+        print(f"警告: 无法读取样本清单 ({e}), 按run编号分组")
+        return {}
+    return {f['file_name']: f['sample_accession'] for f in manifest.files if f['sample_accession']}
+
+def organize_fastq_files(mode=MODE, layout=LAYOUT):
     # 创建输出目录
     Path(OUTPUT_DIR).mkdir(parents=True, exist_ok=True)
-    
-    # 获取所有SRR开头的fastq文件
-    fastq_files = [f for f in os.listdir(DATA_DIR) 
-                  if f.startswith('SRR') and f.endswith('.fastq.gz')]
-    
-    # 提取唯一的SRR编号
-    srr_ids = set()
-    for file in fastq_files:
-        match = re.match(r'(SRR\d+)_[12]\.fastq\.gz', file)
-        if match:
-            srr_ids.add(match.group(1))
-    
-    # 为每个SRR创建文件夹并移动文件
-    for srr_id in sorted(srr_ids):
-        srr_dir = os.path.join(OUTPUT_DIR, srr_id)
-        os.makedirs(srr_dir, exist_ok=True)
-        
-        # 查找配对的fastq文件
-        r1 = f"{srr_id}_1.fastq.gz"
-        r2 = f"{srr_id}_2.fastq.gz"
-        
-        # 移动文件
-        for f in [r1, r2]:
-            src = os.path.join(DATA_DIR, f)
-            dst = os.path.join(srr_dir, f)
-            
-            if os.path.exists(src):
-                shutil.move(src, dst)
-                print(f"已移动: {f} -> {srr_dir}")
-            else:
-                print(f"警告: 文件不存在 {f}")
-    
+
+    # 任务状态库: 记录已整理的文件, 重新运行时下载/校验脚本会跳过它们
+    jobs = JobStore(default_job_path(DATA_DIR))
+
+    # 获取所有 SRR/ERR/DRR 的fastq文件 (双端 _1/_2, index read _3, 单端);
+    # 已整理的文件也参与规划, 保证同一样本的lane编号稳定
+    organized = {job['file_name']: job['dest_path'] for job in jobs.by_state(ORGANIZED)}
+    # 下载时放在其他下载目录 (EXTRA_DIRS, 见 disk_plan.py) 的文件从任务状态库记录的位置读取
+    downloaded = {f: path for f, path in jobs.locations(DATA_DIR).items() if os.path.exists(path)}
+    fastq_files = {f for f in os.listdir(DATA_DIR) if organizer.parse_name(f)}
+    fastq_files |= {f for f in list(organized) + list(downloaded) if organizer.parse_name(f)}
+    samples = load_samples(MANIFEST_PATH) if layout == 'cellranger' else None
+    targets = organizer.plan(fastq_files, samples, layout)
+
+    def on_done(file_name, dst, method):
+        jobs.add([{'file_name': file_name}])
+        jobs.transition(file_name, ORGANIZED, dest_path=dst, record_signature=True)
+        print(f"已整理 ({method}): {file_name} -> {dst}")
+
+    # 同一文件系统内改名/链接, 跨文件系统并行复制
+    placer = organizer.Organizer(OUTPUT_DIR, mode, on_done=on_done)
+    for file_name, rel_path in sorted(targets.items()):
+        src = downloaded.get(file_name) or os.path.join(DATA_DIR, file_name)
+        dst = os.path.join(OUTPUT_DIR, rel_path)
+        if file_name in organized and jobs.is_done(file_name, (ORGANIZED,)):
+            if os.path.abspath(organized[file_name]) == os.path.abspath(dst):
+                print(f"已整理: {file_name}")
+                continue
+            if not os.path.exists(src):  # 换了布局: 从上次整理的位置重新放置
+                src = os.path.realpath(organized[file_name])
+        if not os.path.exists(src):
+            print(f"警告: 文件不存在 {file_name}")
+            continue
+        job = jobs.get(file_name)
+        if job and job['state'] == FAILED:
+            print(f"警告: {file_name} 未通过校验 ({job['error']})")
+        placer.submit(src, file_name, rel_path)
+    placer.close()
+
     print(f"\n整理完成! 所有文件已组织到: {OUTPUT_DIR}")
+    print(placer.summary_line())
+    print(jobs.summary_line())
+    jobs.close()
 
 if __name__ == '__main__':
-    organize_fastq_files()
+    parser = argparse.ArgumentParser(description='按样本整理fastq文件')
+    parser.add_argument('--mode', choices=organizer.MODES, default=MODE,
+                        help=f'放置方式 (默认: {MODE})')
+    parser.add_argument('--layout', choices=organizer.LAYOUTS, default=LAYOUT,
+                        help=f'目录布局 (默认: {LAYOUT})')
+    args = parser.parse_args()
+    organize_fastq_files(args.mode, args.layout)
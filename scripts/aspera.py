@@ -0,0 +1,343 @@
+"""
+并行 Aspera (ascp) 下载引擎
+
+- 同时运行多个 ascp 会话, 每个会话用 --file-pair-list 批量传输多个文件, 省去每个文件一次的会话握手
+- 解析 ascp 的进度输出, 产生结构化的逐文件事件 (进度 / 速率 / ETA), 流量计入全局带宽统计
+- 会话结束后按文件大小 (或100%进度) 判断每个文件是否完成, 未完成的文件断点续传重试 (-k 1)
+- 全局带宽预算 (bandwidth.py) 平分给同时运行的会话作为 -l
+测试时可以把 ascp 命令换成 bench/fake_ascp.py
+"""
+import os
+import re
+import time
+import shlex
+import tempfile
+import threading
+import subprocess
+from collections import defaultdict
+from contextlib import ExitStack
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import bandwidth
+import metrics
+import transfer_watch
+from download_engine import resume_tasks, plan_metrics
+from job_store import DOWNLOADING, DOWNLOADED, FAILED
+
+# 配置参数
+ASCP_CMD = "ascp"
+ASCP_KEY = "~/.aspera/connect/etc/asperaweb_id_dsa.openssh"
+ASCP_USER = "anonftp"  # EBI 公共数据使用 anonftp
+ASCP_OPTIONS = "-QT -k 1"  # 公平传输策略、不加密、断点续传
+DEFAULT_LIMIT = "1000m"  # 未设置全局带宽时每个会话的 -l
+SESSIONS = 4  # 同时运行的 ascp 会话数
+BATCH_SIZE = 20  # 每个会话批量传输的文件数
+RETRIES = 3  # 每个文件的重试轮数
+PROGRESS_INTERVAL = 10  # 同一文件的进度至少间隔多少秒打印一次
+
+# ascp 进度行, 例如:
+#   SRR21934201_1.fastq.gz     45%  460MB  300Mb/s    00:15 ETA
+#   SRR21934201_1.fastq.gz    100% 1024MB  299Mb/s    00:30
+PROGRESS_PATTERN = re.compile(
+    r'^(?P<name>\S+)\s+(?P<percent>\d+)%\s+(?P<size>[\d.]+)\s*(?P<size_unit>[KMGT]?B)\s+'
+    r'(?P<rate>[\d.]+)\s*(?P<rate_unit>[KMG]?)b/s\s+(?P<time>[\d:]+)(?P<eta>\s+ETA)?')
+ERROR_PATTERN = re.compile(r'(Session Stop|Error|error|failed|ascp:)')
+_SIZE_UNITS = {'B': 1, 'KB': 1024, 'MB': 1024 ** 2, 'GB': 1024 ** 3, 'TB': 1024 ** 4}
+_RATE_UNITS = {'': 1, 'K': 1e3, 'M': 1e6, 'G': 1e9}
+
+
+def split_link(link):
+    """fasp.sra.ebi.ac.uk:/vol1/fastq/... -> (主机, 远程路径)"""
+    link = link.split('://', 1)[-1]
+    host, _, path = link.partition(':')
+    return host, path if path.startswith('/') else '/' + path
+
+
+def _seconds(text):
+    seconds = 0
+    for part in text.split(':'):
+        seconds = seconds * 60 + int(part)
+    return seconds
+
+
+def parse_progress(line):
+    """
+    解析一行 ascp 进度输出
+    :return: {'file_name', 'percent', 'bytes', 'rate' (字节/秒), 'eta' (秒或None), 'elapsed'} 或 None
+    """
+    match = PROGRESS_PATTERN.match(line.strip())
+    if not match:
+        return None
+    seconds = _seconds(match.group('time'))
+    return {
+        'file_name': match.group('name'),
+        'percent': int(match.group('percent')),
+        'bytes': int(float(match.group('size')) * _SIZE_UNITS[match.group('size_unit')]),
+        'rate': float(match.group('rate')) * _RATE_UNITS[match.group('rate_unit')] / 8,
+        'eta': seconds if match.group('eta') else None,
+        'elapsed': None if match.group('eta') else seconds,
+    }
+
+
+def make_batches(tasks, batch_size=BATCH_SIZE):
+    """按主机分组, 每组按大小轮流分配到各批次, 各批次的总字节数大致相同"""
+    by_host = defaultdict(list)
+    for task in tasks:
+        by_host[split_link(task['link'])[0]].append(task)
+    batches = []
+    for host, host_tasks in by_host.items():
+        count = -(-len(host_tasks) // batch_size)
+        host_batches = [[] for _ in range(count)]
+        for i, task in enumerate(host_tasks):  # make_tasks 已按大小从大到小排序
+            host_batches[i % count].append(task)
+        batches.extend((host, batch) for batch in host_batches)
+    return batches
+
+
+class ProgressPrinter:
+    """默认的进度回调: 每个文件按间隔打印速率与ETA, 完成时打印一次"""
+
+    def __init__(self, interval=PROGRESS_INTERVAL):
+        self.interval = interval
+        self.last = {}
+        self.lock = threading.Lock()
+
+    def __call__(self, event):
+        now = time.time()
+        name = event['file_name']
+        with self.lock:
+            if event['percent'] < 100 and now - self.last.get(name, 0) < self.interval:
+                return
+            if event['percent'] == 100 and self.last.get(name) == -1:
+                return
+            self.last[name] = -1 if event['percent'] == 100 else now
+        eta = f" ETA {event['eta']}秒" if event['eta'] is not None else ""
+        print(f"  {name}: {event['percent']}% {event['bytes'] / 1024 ** 2:.0f}MB "
+              f"{event['rate'] / 1024 ** 2:.1f}MB/s{eta}")
+
+
+class AsperaSession:
+    """一次 ascp 运行 (一个 --file-pair-list 批次)"""
+
+    def __init__(self, host, tasks, download_dir, limit, ascp_cmd=ASCP_CMD, key=ASCP_KEY,
+                 user=ASCP_USER, options=ASCP_OPTIONS, on_progress=None):
+        self.host = host
+        self.tasks = tasks
+        self.download_dir = download_dir
+        self.limit = limit
+        self.ascp_cmd = ascp_cmd
+        self.key = key
+        self.user = user
+        self.options = options
+        self.on_progress = on_progress
+        self.progress = {}  # 文件名 -> 最后一次进度事件
+        self.errors = []
+
+    def command(self, pair_list):
+        cmd = shlex.split(self.ascp_cmd) + shlex.split(self.options)
+        if self.limit:
+            cmd += ['-l', self.limit]
+        if self.key:
+            cmd += ['-i', os.path.expanduser(self.key)]
+        return cmd + ['--mode=recv', f'--user={self.user}', f'--host={self.host}',
+                      f'--file-pair-list={pair_list}', self.download_dir]
+
+    def run(self):
+        """运行 ascp, 返回退出码"""
+        with tempfile.NamedTemporaryFile('w', suffix='.pairs', delete=False) as f:
+            for task in self.tasks:
+                f.write(f"{split_link(task['link'])[1]}\n{task['file_name']}\n")
+            pair_list = f.name
+        try:
+            process = subprocess.Popen(self.command(pair_list), stdout=subprocess.PIPE,
+                                       stderr=subprocess.STDOUT)
+            with ExitStack() as stack:
+                # 批次中任一文件被取消 (租约被其他节点接手) 时结束 ascp, 其余文件下一轮续传
+                for task in self.tasks:
+                    stack.enter_context(transfer_watch.on_cancel(task['file_name'], process.kill))
+                self._read_output(process.stdout)
+                return process.wait()
+        except OSError as e:
+            self.errors.append(f"无法运行 ascp: {e}")
+            return -1
+        finally:
+            os.remove(pair_list)
+
+    def _read_output(self, stream):
+        # 进度行以 \r 刷新, 按 \r 和 \n 切分
+        pending = b''
+        while chunk := stream.read1(65536):
+            pending += chunk
+            *lines, pending = re.split(rb'[\r\n]', pending)
+            for line in lines:
+                self._handle_line(line.decode('utf-8', 'replace'))
+        if pending:
+            self._handle_line(pending.decode('utf-8', 'replace'))
+        stream.close()
+
+    def _handle_line(self, line):
+        if not line.strip():
+            return
+        event = parse_progress(line)
+        if event is None:
+            if ERROR_PATTERN.search(line):
+                self.errors.append(line.strip())
+            return
+        previous = self.progress.get(event['file_name'])
+        bandwidth.manager().record(max(0, event['bytes'] - (previous['bytes'] if previous else 0)))
+        metrics.set_done(event['file_name'], event['bytes'])
+        self.progress[event['file_name']] = event
+        if self.on_progress:
+            self.on_progress(event)
+
+    def completed(self, task, returncode):
+        """判断文件是否完整: 已知大小时比较本地大小, 否则要求 ascp 报告100%且正常退出"""
+        dest_path = task['dest_path']
+        if not os.path.exists(dest_path):
+            return False
+        if task['size']:
+            return os.path.getsize(dest_path) == task['size']
+        event = self.progress.get(task['file_name'])
+        return returncode == 0 and event is not None and event['percent'] == 100
+
+
+def _local_size(path):
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+
+def download_all(tasks, download_dir, sessions=SESSIONS, batch_size=BATCH_SIZE, retries=RETRIES,
+                 ascp_cmd=ASCP_CMD, key=ASCP_KEY, user=ASCP_USER, options=ASCP_OPTIONS,
+                 on_progress=None, job_store=None, concurrency=None, leases=None):
+    """
+    并行批量下载 Aspera 链接
+    :param tasks: make_tasks 返回的任务列表 (fastq_aspera 列)
+    :param on_progress: 进度回调, 参数为 parse_progress 返回的事件; 默认按间隔打印
+    :param concurrency: 自适应并发控制 (bandwidth.adaptive), 同时运行的会话数在 1..sessions 之间调整
+    :param leases: 多节点共享下载目录时的租约 (leases.LeaseStore), 有空闲会话时才认领组成批次所需的文件
+                   (随用随认领, 其余文件留给其他节点), 其他节点正在下载的留到下一轮
+    :return: 每个文件的结果列表 (可交给 download_engine.print_summary)
+    """
+    if job_store is not None:
+        tasks = resume_tasks(tasks, job_store)
+    on_progress = on_progress or ProgressPrinter()
+    attempts = defaultdict(int)
+    started = {}
+    before = {t['file_name']: _local_size(t['dest_path']) for t in tasks}
+    errors = {}
+    finished = []
+    remaining = list(tasks)
+    waiting = []
+    skipped = 0  # 其他节点已完成的文件
+    unclaimed = []  # 本轮还没有认领的文件 (多节点时)
+    plan_metrics(tasks)
+
+    def claim(free_sessions):
+        """按优先级认领至多 free_sessions 个批次的文件, 返回组成的批次"""
+        nonlocal skipped
+        claimed = []
+        while unclaimed and len(claimed) < free_sessions * batch_size:
+            task = unclaimed.pop(0)
+            result = leases.acquire(task['file_name'], task['dest_path'])
+            if result:
+                claimed.append(task)
+            elif result is None:
+                waiting.append(task)
+            else:
+                skipped += 1
+                print(f"[{len(finished) + skipped}/{len(tasks)}] 其他节点已完成: {task['file_name']}")
+        return make_batches(claimed, batch_size)
+
+    round_number = 0
+    while round_number < retries:
+        if leases is None:
+            pending = make_batches(remaining, batch_size)
+            print(f"第{round_number + 1}轮: {len(remaining)} 个文件, {len(pending)} 个批次, "
+                  f"最多 {sessions} 个会话")
+        else:
+            # 上一轮失败的文件仍由本节点持有; 其他文件等有空闲会话时再认领
+            unclaimed[:], waiting[:] = remaining + waiting, []
+            pending = claim(sessions)
+            if not pending:
+                if not waiting:
+                    break
+                print(f"等待其他节点: {len(waiting)} 个文件")
+                time.sleep(leases.poll_interval)
+                continue
+            print(f"第{round_number + 1}轮: {len(unclaimed) + sum(len(b) for _, b in pending)} 个文件, "
+                  f"最多 {sessions} 个会话, 随用随认领")
+        round_number += 1
+        failed = []
+        running = {}
+        with ThreadPoolExecutor(max_workers=sessions) as executor:
+            while pending or running or unclaimed:
+                limit = min(sessions, concurrency.limit()) if concurrency is not None else sessions
+                if not pending and unclaimed and len(running) < limit:
+                    pending = claim(limit - len(running))
+                while pending and len(running) < limit:
+                    host, batch = pending.pop(0)
+                    rate = bandwidth.manager().ascp_limit(limit) or DEFAULT_LIMIT
+                    session = AsperaSession(host, batch, download_dir, rate, ascp_cmd, key, user,
+                                            options, on_progress)
+                    for task in batch:
+                        attempts[task['file_name']] += 1
+                        started.setdefault(task['file_name'], time.time())
+                        metrics.start(task['file_name'], total=task['size'],
+                                      done=_local_size(task['dest_path']))
+                        if job_store is not None:
+                            job_store.transition(task['file_name'], DOWNLOADING)
+                    running[executor.submit(session.run)] = session
+
+                done, _ = wait(running, timeout=1 if concurrency is not None else None,
+                               return_when=FIRST_COMPLETED)
+                for future in done:
+                    session = running.pop(future)
+                    returncode = future.result()
+                    for task in session.tasks:
+                        if leases is not None and leases.is_lost(task['file_name']):
+                            # 对方完成则跳过, 对方崩溃则再接手
+                            print(f"租约已被其他节点接手, 停止: {task['file_name']}")
+                            metrics.finish(task['file_name'], False, "租约已被其他节点接手")
+                            waiting.append(task)
+                            continue
+                        ok = session.completed(task, returncode)
+                        if concurrency is not None:
+                            concurrency.record(ok)
+                        if ok:
+                            finished.append((task, True))
+                            errors.pop(task['file_name'], None)
+                        else:
+                            errors[task['file_name']] = (session.errors[-1] if session.errors
+                                                         else f"ascp 退出码 {returncode}")
+                            failed.append(task)
+                        if ok or round_number == retries:
+                            metrics.finish(task['file_name'], ok, None if ok else errors[task['file_name']])
+                        else:
+                            metrics.inc('retries')
+                        if leases is not None and (ok or round_number == retries):
+                            leases.release(task['file_name'], ok, task['dest_path'])
+                        if job_store is not None and (ok or round_number == retries):
+                            job_store.transition(task['file_name'], DOWNLOADED if ok else FAILED,
+                                                 record_signature=ok,
+                                                 bytes_done=_local_size(task['dest_path']),
+                                                 download_seconds=time.time() - started[task['file_name']],
+                                                 error=None if ok else errors[task['file_name']])
+                        status = "完成" if ok else "未完成"
+                        print(f"[{len(finished) + skipped}/{len(tasks)}] {status}: {task['file_name']}")
+        remaining = failed
+        if remaining and round_number < retries:
+            time.sleep(min(2 ** round_number, 30))
+
+    finished.extend((task, False) for task in remaining)
+    if leases is not None:
+        if waiting:
+            print(f"{len(waiting)} 个文件仍由其他节点下载中")
+        print(leases.summary_line())
+    metrics.flush()
+    return [{
+        'file_name': task['file_name'],
+        'link': task['link'],
+        'success': ok,
+        'bytes': max(_local_size(task['dest_path']) - before[task['file_name']], 0),
+        'seconds': time.time() - started.get(task['file_name'], time.time()),
+        'error': None if ok else errors.get(task['file_name']),
+        'attempts': attempts[task['file_name']],
+    } for task, ok in finished]
@@ -0,0 +1,503 @@
+"""
+asyncio 下载器 (纯Python下载路径, 单进程驱动数百个并发传输)
+
+- HTTP: 按 (协议, 主机, 端口) 复用 keep-alive 连接, 连续下载的文件不再重复 TCP+TLS 握手
+- FTP: 按主机复用已登录的控制连接, 同一控制连接上连续 RETR 多个文件 (同一目录不再重复 CWD),
+  每个文件只新建一个被动模式数据连接
+- 断点续传 (HTTP Range / FTP REST), 边下载边计算MD5 (md5_stream.HashingWriter), 失败或吞吐过低自动重试
+- 全局与单主机并发上限, 任务列表与 download_engine.make_tasks 相同 (大文件优先);
+  ENA 的 fastq_ftp 链接都在 ftp.sra.ebi.ac.uk 上, 实际并发是 MAX_PER_HOST 而不是 MAX_CONCURRENCY,
+  链接分布在多个主机 (镜像) 上时才能达到全局上限; 需要对单个主机开更多连接时调高 MAX_PER_HOST
+不依赖第三方库; 写文件和计算MD5放在线程中执行, 不阻塞事件循环
+"""
+import os
+import re
+import ssl
+import time
+import asyncio
+from collections import defaultdict
+from urllib.parse import urlparse
+import bandwidth
+import metrics
+import transfer_watch
+from transfer_watch import Stalled, Cancelled
+from download_engine import resume_tasks, plan_metrics, http_url
+from md5_stream import HashingWriter, finish_download, is_verified
+from job_store import DOWNLOADING, DOWNLOADED, FAILED
+
+# 配置参数
+MAX_CONCURRENCY = 200  # 全局同时传输的文件数
+MAX_PER_HOST = 16  # 单个主机同时传输的文件数 (也是每个主机连接池的大小); ENA 只有一个主机时即实际并发数
+CHUNK_SIZE = 1024 * 1024  # 攒够1MB再写入文件
+RETRIES = 3  # 每个文件的重试次数
+TIMEOUT = 60  # 单次网络读写的超时 (秒)
+MAX_REDIRECTS = 5
+FTP_USER = "anonymous"
+FTP_PASSWORD = "anonymous@"
+USER_AGENT = "NCBI_SRA_downloader"
+
+
+class TransferError(Exception):
+    """服务器返回错误 (文件不存在等), 重试也不会成功"""
+
+
+class _Sink:
+    """把网络上读到的小块数据攒成大块, 在线程中写入文件并更新MD5"""
+
+    def __init__(self, writer, monitor=None):
+        self.writer = writer
+        self.monitor = monitor
+        self.buffer = bytearray()
+
+    async def feed(self, data):
+        await bandwidth.athrottle(len(data))
+        if self.monitor is not None:
+            self.monitor.update(len(data))  # 吞吐低于下限时抛出 Stalled
+        self.buffer += data
+        if len(self.buffer) >= CHUNK_SIZE:
+            await self.flush()
+
+    async def flush(self):
+        if self.buffer:
+            data, self.buffer = bytes(self.buffer), bytearray()
+            await asyncio.to_thread(self.writer.write, data)
+
+
+class _Pool:
+    """按键保存空闲连接"""
+
+    def __init__(self):
+        self.idle = defaultdict(list)
+        self.opened = 0  # 新建的连接数
+        self.reused = 0  # 复用的次数
+
+    def take(self, key):
+        while self.idle[key]:
+            conn = self.idle[key].pop()
+            if not conn.reader.at_eof():
+                self.reused += 1
+                return conn
+            conn.close()
+        return None
+
+    def put(self, key, conn):
+        self.idle[key].append(conn)
+
+    def close(self):
+        for conns in self.idle.values():
+            for conn in conns:
+                conn.close()
+        self.idle.clear()
+
+
+class _Connection:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.cwd = None  # FTP控制连接的当前目录
+
+    def close(self):
+        self.writer.close()
+
+
+async def _read_line(reader):
+    line = await asyncio.wait_for(reader.readline(), TIMEOUT)
+    if not line:
+        raise ConnectionError("连接被服务器关闭")
+    return line.decode('latin-1').rstrip('\r\n')
+
+
+# ---------------- HTTP ----------------
+
+class HTTPClient:
+    """最小的 HTTP/1.1 GET 客户端, 按主机复用 keep-alive 连接"""
+
+    def __init__(self):
+        self.pool = _Pool()
+        self.ssl_context = ssl.create_default_context()
+
+    async def _connect(self, key):
+        scheme, host, port = key
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(
+            host, port, ssl=self.ssl_context if scheme == 'https' else None), TIMEOUT)
+        self.pool.opened += 1
+        return _Connection(reader, writer)
+
+    async def fetch(self, url, offset, on_restart, sink):
+        """
+        从 offset 开始下载 url 的内容写入 sink
+        :param on_restart: 服务器忽略Range从头返回时调用, 返回新的 sink
+        :return: 写入的字节数; 416 (本地文件已完整) 时为0
+        """
+        for _ in range(MAX_REDIRECTS + 1):
+            parsed = urlparse(url)
+            port = parsed.port or (443 if parsed.scheme == 'https' else 80)
+            key = (parsed.scheme, parsed.hostname, port)
+            path = parsed.path + (f"?{parsed.query}" if parsed.query else "")
+            request = (f"GET {path} HTTP/1.1\r\nHost: {parsed.netloc}\r\n"
+                       f"User-Agent: {USER_AGENT}\r\nAccept-Encoding: identity\r\n"
+                       + (f"Range: bytes={offset}-\r\n" if offset else "") + "\r\n").encode()
+
+            conn = self.pool.take(key)
+            status = None
+            if conn is not None:
+                try:
+                    status, headers = await self._request(conn, request)
+                except (ConnectionError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+                    conn.close()  # 空闲期间被服务器关闭的连接, 换新连接重发
+                except BaseException:
+                    conn.close()
+                    raise
+            if status is None:
+                conn = await self._connect(key)
+                try:
+                    status, headers = await self._request(conn, request)
+                except BaseException:
+                    conn.close()  # 服务器重置连接等: 不泄漏新建的连接
+                    raise
+
+            try:
+                if status in (301, 302, 303, 307, 308) and 'location' in headers:
+                    await self._read_body(conn, headers, None)
+                    self._release(key, conn, headers)
+                    url = headers['location']
+                    continue
+                if status == 416 and offset:
+                    await self._read_body(conn, headers, None)
+                    self._release(key, conn, headers)
+                    return 0
+                if status == 200 and offset:
+                    sink = await on_restart()  # 服务器不支持Range, 从头开始
+                elif status not in (200, 206):
+                    raise TransferError(f"HTTP {status}")
+                received = await self._read_body(conn, headers, sink)
+                self._release(key, conn, headers)
+                return received
+            except BaseException:
+                conn.close()
+                raise
+        raise TransferError("重定向次数过多")
+
+    @staticmethod
+    async def _request(conn, request):
+        conn.writer.write(request)
+        await conn.writer.drain()
+        status_line = await _read_line(conn.reader)
+        parts = status_line.split(None, 2)
+        if len(parts) < 2 or not parts[0].startswith('HTTP/'):
+            raise ConnectionError(f"无效的响应: {status_line[:80]}")
+        headers = {'_version': parts[0]}
+        while line := await _read_line(conn.reader):
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        return int(parts[1]), headers
+
+    @staticmethod
+    async def _read_body(conn, headers, sink):
+        """读取响应体, sink为None时丢弃; 返回字节数"""
+        received = 0
+        reader = conn.reader
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            while True:
+                size = int((await _read_line(reader)).split(';')[0], 16)
+                if size == 0:
+                    while await _read_line(reader):  # trailer
+                        pass
+                    break
+                data = await asyncio.wait_for(reader.readexactly(size), TIMEOUT)
+                await reader.readexactly(2)
+                received += len(data)
+                if sink:
+                    await sink.feed(data)
+        elif 'content-length' in headers:
+            remaining = int(headers['content-length'])
+            while remaining:
+                data = await asyncio.wait_for(reader.read(min(remaining, CHUNK_SIZE)), TIMEOUT)
+                if not data:
+                    raise ConnectionError(f"连接中断, 还差 {remaining} 字节")
+                remaining -= len(data)
+                received += len(data)
+                if sink:
+                    await sink.feed(data)
+        else:
+            while data := await asyncio.wait_for(reader.read(CHUNK_SIZE), TIMEOUT):
+                received += len(data)
+                if sink:
+                    await sink.feed(data)
+            headers['connection'] = 'close'
+        if sink:
+            await sink.flush()
+        return received
+
+    def _release(self, key, conn, headers):
+        keep_alive = (headers.get('_version') == 'HTTP/1.1'
+                      and headers.get('connection', '').lower() != 'close')
+        if keep_alive:
+            self.pool.put(key, conn)
+        else:
+            conn.close()
+
+    def close(self):
+        self.pool.close()
+
+
+# ---------------- FTP ----------------
+
+class FTPClient:
+    """最小的被动模式 FTP 客户端, 按主机复用已登录的控制连接"""
+
+    def __init__(self, user=FTP_USER, password=FTP_PASSWORD):
+        self.user = user
+        self.password = password
+        self.pool = _Pool()
+
+    @staticmethod
+    async def _reply(conn):
+        """读取一个 (可能多行的) 应答, 返回 (代码, 文本)"""
+        line = await _read_line(conn.reader)
+        lines = [line]
+        if line[3:4] == '-':
+            while not (len(line) >= 4 and line[:3] == lines[0][:3] and line[3] == ' '):
+                line = await _read_line(conn.reader)
+                lines.append(line)
+        return int(lines[0][:3]), "\n".join(lines)
+
+    async def _command(self, conn, command, expect):
+        conn.writer.write(command.encode('latin-1') + b"\r\n")
+        await conn.writer.drain()
+        code, text = await self._reply(conn)
+        if code // 100 not in expect:
+            if code // 100 == 5:
+                raise TransferError(f"{command.split()[0]}: {text}")
+            raise ConnectionError(f"{command.split()[0]}: {text}")
+        return code, text
+
+    async def _connect(self, host, port):
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), TIMEOUT)
+        self.pool.opened += 1
+        conn = _Connection(reader, writer)
+        try:
+            code, text = await self._reply(conn)
+            if code != 220:
+                raise ConnectionError(text)
+            code, _ = await self._command(conn, f"USER {self.user}", (2, 3))
+            if code == 331:
+                await self._command(conn, f"PASS {self.password}", (2,))
+            await self._command(conn, "TYPE I", (2,))
+        except BaseException:
+            conn.close()
+            raise
+        return conn
+
+    async def _open_data(self, conn, host):
+        """进入被动模式并建立数据连接 (EPSV优先, 数据连接总是连到控制连接的主机)"""
+        try:
+            _, text = await self._command(conn, "EPSV", (2,))
+            port = int(re.search(r'\|\|\|(\d+)\|', text).group(1))
+        except (TransferError, AttributeError):
+            _, text = await self._command(conn, "PASV", (2,))
+            numbers = re.search(r'(\d+),(\d+),(\d+),(\d+),(\d+),(\d+)', text).groups()
+            port = int(numbers[4]) * 256 + int(numbers[5])
+        return await asyncio.wait_for(asyncio.open_connection(host, port), TIMEOUT)
+
+    async def fetch(self, url, offset, on_restart, sink):
+        """从 offset 开始 RETR, 返回写入的字节数"""
+        parsed = urlparse(url)
+        host, port = parsed.hostname, parsed.port or 21
+        directory, _, name = parsed.path.rpartition('/')
+        conn = self.pool.take((host, port))
+        for attempt in range(2):
+            if conn is None:
+                conn = await self._connect(host, port)
+            try:
+                if conn.cwd != directory:
+                    await self._command(conn, f"CWD {directory or '/'}", (2,))
+                    conn.cwd = directory
+                data_reader, data_writer = await self._open_data(conn, host)
+                break
+            except (ConnectionError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+                conn.close()  # 空闲的控制连接已被服务器断开, 重新登录
+                conn = None
+                if attempt:
+                    raise
+            except BaseException:
+                conn.close()
+                raise
+
+        received = 0
+        try:
+            try:
+                if offset:
+                    await self._command(conn, f"REST {offset}", (3,))
+                await self._command(conn, f"RETR {name}", (1,))
+                while data := await asyncio.wait_for(data_reader.read(CHUNK_SIZE), TIMEOUT):
+                    received += len(data)
+                    await sink.feed(data)
+                await sink.flush()
+            finally:
+                data_writer.close()
+            await self._reply(conn)  # 226 传输完成
+        except BaseException:
+            conn.close()
+            raise
+        self.pool.put((host, port), conn)
+        return received
+
+    def close(self):
+        for conns in self.pool.idle.values():
+            for conn in conns:
+                try:
+                    conn.writer.write(b"QUIT\r\n")
+                except Exception:
+                    pass
+        self.pool.close()
+
+
+# ---------------- 调度 ----------------
+
+def to_url(link, protocol):
+    """把清单中的链接 (不带协议) 转换为 ftp:// 或 https:// 地址"""
+    if protocol == 'https':
+        return http_url(link)
+    return f"{protocol}://{link.split('://', 1)[-1]}"
+
+
+async def download_one(client, url, dest_path, expected_md5=None):
+    """下载单个文件 (断点续传, 边下载边计算MD5), 返回是否成功"""
+    if expected_md5 and await asyncio.to_thread(is_verified, dest_path, expected_md5):
+        return True
+    for attempt in range(1, RETRIES + 1):
+        writer = await asyncio.to_thread(HashingWriter, dest_path)
+        monitor = transfer_watch.watch(os.path.basename(dest_path))
+        state = {'writer': writer}
+
+        async def restart():
+            """服务器从头返回: 丢弃已有部分重新写入"""
+            await asyncio.to_thread(state['writer'].close)
+            await asyncio.to_thread(os.remove, dest_path)
+            metrics.set_done(os.path.basename(dest_path), 0)
+            state['writer'] = await asyncio.to_thread(HashingWriter, dest_path)
+            return _Sink(state['writer'], monitor)
+
+        try:
+            with monitor:
+                await client.fetch(url, writer.offset, restart, _Sink(writer, monitor))
+        except TransferError as e:
+            await asyncio.to_thread(state['writer'].close)
+            print(f"下载失败 {url}: {e}")
+            return False
+        except Cancelled:
+            await asyncio.to_thread(state['writer'].close)
+            raise
+        except Stalled as e:
+            await asyncio.to_thread(state['writer'].close)
+            print(f"下载过慢 {url} (第{attempt}次): {e}")
+            continue  # 换一条新连接立即续传
+        except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError) as e:
+            await asyncio.to_thread(state['writer'].close)
+            print(f"下载中断 {url} (第{attempt}次): {e!r}")
+            await asyncio.sleep(min(2 ** attempt, 30))
+            continue
+        actual_md5 = await asyncio.to_thread(state['writer'].close)
+        return await asyncio.to_thread(finish_download, dest_path, actual_md5, expected_md5)
+    return False
+
+
+async def download_all(tasks, protocol='https', md5_map=None, max_concurrency=MAX_CONCURRENCY,
+                       max_per_host=MAX_PER_HOST, job_store=None, concurrency=None, leases=None):
+    """
+    并发下载 make_tasks 返回的任务
+    :param protocol: 'https' 或 'ftp'
+    :param concurrency: 自适应并发控制 (bandwidth.adaptive), 同时传输数在 1..max_concurrency 之间自动调整
+    :param leases: 多节点共享下载目录时的租约 (leases.LeaseStore), 拿到并发名额后先认领文件
+    :return: 每个文件的结果列表 (与 download_engine.run_downloads 相同, 可交给 print_summary)
+    """
+    md5_map = md5_map or {}
+    if job_store is not None:
+        tasks = resume_tasks(tasks, job_store)
+    client = FTPClient() if protocol == 'ftp' else HTTPClient()
+    limit = asyncio.Semaphore(max_concurrency)
+    host_limits = defaultdict(lambda: asyncio.Semaphore(max_per_host))
+    results = []
+    active = [0]
+    skipped = [0]  # 其他节点已完成的文件
+    plan_metrics(tasks)
+    metrics.gauge('download_running', lambda: active[0])
+
+    async def transfer(task):
+        if job_store is not None:
+            job_store.transition(task['file_name'], DOWNLOADING)
+        start = time.time()
+        before = os.path.getsize(task['dest_path']) if os.path.exists(task['dest_path']) else 0
+        metrics.start(task['file_name'], total=task['size'], done=before)
+        error = None
+        try:
+            success = await download_one(client, to_url(task['link'], protocol),
+                                         task['dest_path'], md5_map.get(task['file_name']))
+        except Exception as e:
+            success, error = False, repr(e)
+        metrics.finish(task['file_name'], success, error)
+        size = os.path.getsize(task['dest_path']) if os.path.exists(task['dest_path']) else 0
+        result = {
+            'file_name': task['file_name'],
+            'link': task['link'],
+            'success': success,
+            'bytes': max(size - before, 0),
+            'seconds': time.time() - start,
+            'error': error,
+            'lost': transfer_watch.is_cancelled(task['file_name']),  # 租约被其他节点接手
+        }
+        if job_store is not None and not result['lost']:
+            job_store.transition(task['file_name'], DOWNLOADED if success else FAILED,
+                                 record_signature=success, bytes_done=size,
+                                 download_seconds=result['seconds'],
+                                 error=None if success else (error or "下载失败"))
+        return result
+
+    async def run(task):
+        while True:
+            # 先占主机名额再占全局名额: 排队等繁忙主机的任务不占用全局名额, 不会饿死其他主机
+            async with host_limits[task['host']], limit:
+                claimed = True
+                if leases is not None:
+                    claimed = await asyncio.to_thread(leases.acquire, task['file_name'], task['dest_path'])
+                if claimed:
+                    # 自适应模式下等待并发上限允许
+                    while concurrency is not None and active[0] >= concurrency.limit():
+                        await asyncio.sleep(0.5)
+                    active[0] += 1
+                    try:
+                        result = await transfer(task)
+                    finally:
+                        active[0] -= 1
+                    if not result['lost']:
+                        if leases is not None:
+                            await asyncio.to_thread(leases.release, task['file_name'], result['success'],
+                                                    task['dest_path'])
+                        break
+                    # 租约被其他节点接手: 传输已停止, 之后再看 (对方完成则跳过, 对方崩溃则再接手)
+                    print(f"租约已被其他节点接手, 停止: {task['file_name']}")
+                    claimed = None
+            if claimed is False:
+                skipped[0] += 1
+                transfer_watch.set_remaining(len(tasks) - len(results) - skipped[0])
+                print(f"[{len(results) + skipped[0]}/{len(tasks)}] 其他节点已完成: {task['file_name']}")
+                return
+            # 其他节点正在下载: 让出名额, 稍后再看 (对方崩溃时接手)
+            await asyncio.sleep(leases.poll_interval)
+        results.append(result)
+        transfer_watch.set_remaining(len(tasks) - len(results) - skipped[0])
+        if concurrency is not None:
+            concurrency.record(result['success'])
+        status = "完成" if result['success'] else "失败"
+        print(f"[{len(results) + skipped[0]}/{len(tasks)}] {status}: {task['file_name']}")
+
+    try:
+        await asyncio.gather(*(run(task) for task in tasks))
+    finally:
+        metrics.flush()
+        print(f"连接: 新建 {client.pool.opened} | 复用 {client.pool.reused}")
+        if leases is not None:
+            print(leases.summary_line())
+        client.close()
+    return results
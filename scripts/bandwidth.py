@@ -0,0 +1,253 @@
+"""
+全局带宽管理
+
+- 令牌桶: 所有并发下载 (线程 / asyncio / curl、wget管道) 共享一个 字节/秒 预算
+- 分时段限速: 例如白天给所里的共享链路留余量, 夜间放开
+- 自适应并发: 根据观察到的聚合吞吐和出错率增减同时下载的文件数
+速率写法与 ascp -l 相同 (比特/秒): "800m" = 800Mbps ≈ 100MB/s, 也可写 "500k"、"1g" 或纯数字
+用法:
+    bandwidth.configure("800m", schedule="08:00-20:00=300m")
+    bandwidth.throttle(len(chunk))         # 线程中每写入一块数据调用一次
+    await bandwidth.athrottle(len(chunk))  # asyncio 中
+未调用 configure 时不限速, throttle 只统计流量
+"""
+import time
+import asyncio
+import threading
+from datetime import datetime
+
+# 配置参数
+BURST_SECONDS = 0.5  # 令牌桶容量 (相当于多少秒的流量), 允许短暂突发
+WINDOW_SECONDS = 10  # 自适应并发的统计窗口
+ERROR_THRESHOLD = 0.2  # 窗口内失败比例超过该值时减少并发
+SATURATED = 0.95  # 聚合吞吐达到预算的95%时不再增加并发
+
+_UNITS = {'': 1, 'k': 1e3, 'm': 1e6, 'g': 1e9}
+
+
+def parse_rate(text):
+    """把 ascp 风格的速率 ("800m"、"1g"、"500k") 转换为 字节/秒, None/空/0 表示不限速"""
+    if text in (None, '', 0):
+        return None
+    text = str(text).strip().lower().rstrip('bps')
+    unit = text[-1] if text[-1] in _UNITS else ''
+    value = float(text[:-1] if unit else text) * _UNITS[unit] / 8
+    return value or None
+
+
+def format_rate(bytes_per_second):
+    """字节/秒 -> ascp -l 的参数 (Mbps)"""
+    return f"{max(1, int(bytes_per_second * 8 / 1e6))}m"
+
+
+def parse_schedule(text):
+    """
+    解析分时段限速, 例如 "08:00-20:00=300m,20:00-08:00=900m"
+    :return: [(开始分钟, 结束分钟, 字节/秒或None)]
+    """
+    rules = []
+    for part in (text or '').split(','):
+        if not part.strip():
+            continue
+        span, _, rate = part.partition('=')
+        start, _, end = span.strip().partition('-')
+        rules.append((_minutes(start), _minutes(end), parse_rate(rate)))
+    return rules
+
+
+def _minutes(hhmm):
+    hours, _, minutes = hhmm.strip().partition(':')
+    return int(hours) * 60 + int(minutes or 0)
+
+
+def schedule_rate(rules, default, now=None):
+    """当前时刻适用的速率, 没有匹配的时段时使用 default (可跨越午夜, 如 20:00-08:00)"""
+    now = now or datetime.now()
+    minute = now.hour * 60 + now.minute
+    for start, end, rate in rules:
+        inside = start <= minute < end if start < end else (minute >= start or minute < end)
+        if inside:
+            return rate
+    return default
+
+
+class TokenBucket:
+    """
+    线程安全的令牌桶
+    reserve 先扣除令牌 (允许为负) 再返回需要等待的秒数, 线程和协程各自用自己的方式等待
+    """
+
+    def __init__(self, rate=None):
+        self.lock = threading.Lock()
+        self.rate = rate
+        self.tokens = 0.0
+        self.updated = time.monotonic()
+
+    def set_rate(self, rate):
+        with self.lock:
+            self._refill()
+            self.rate = rate
+
+    def _refill(self):
+        now = time.monotonic()
+        if self.rate:
+            capacity = self.rate * BURST_SECONDS
+            self.tokens = min(capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount):
+        with self.lock:
+            if not self.rate:
+                return 0.0
+            self._refill()
+            self.tokens -= amount
+            return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+
+class BandwidthManager:
+    """全局速率上限 + 分时段限速 + 流量统计"""
+
+    def __init__(self, rate=None, schedule=None):
+        self.default_rate = parse_rate(rate)
+        self.rules = parse_schedule(schedule)
+        self.bucket = TokenBucket(self.current_rate())
+        self.lock = threading.Lock()
+        self.total_bytes = 0
+        self.checked = time.monotonic()
+
+    def current_rate(self):
+        """当前生效的 字节/秒 上限 (None 为不限速)"""
+        return schedule_rate(self.rules, self.default_rate) if self.rules else self.default_rate
+
+    def _check_schedule(self):
+        # 每分钟检查一次时段是否切换
+        now = time.monotonic()
+        if self.rules and now - self.checked >= 60:
+            self.checked = now
+            rate = self.current_rate()
+            if rate != self.bucket.rate:
+                self.bucket.set_rate(rate)
+                print(f"\n带宽时段切换: {'不限速' if rate is None else format_rate(rate)}")
+
+    def reserve(self, amount):
+        with self.lock:
+            self.total_bytes += amount
+        self._check_schedule()
+        return self.bucket.reserve(amount)
+
+    def record(self, amount):
+        """只统计流量不限速 (ascp 等自己控制速率的传输)"""
+        with self.lock:
+            self.total_bytes += amount
+
+    def throttle(self, amount):
+        """记录 amount 字节并在超出预算时阻塞当前线程"""
+        delay = self.reserve(amount)
+        if delay > 0:
+            time.sleep(delay)
+
+    async def athrottle(self, amount):
+        """throttle 的 asyncio 版本"""
+        delay = self.reserve(amount)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def ascp_limit(self, sessions):
+        """
+        ascp 自己收发数据, 无法共享令牌桶: 把全局预算平分给同时运行的会话, 返回 -l 参数
+        不限速时返回 None
+        """
+        rate = self.current_rate()
+        return format_rate(rate / max(1, sessions)) if rate else None
+
+
+class AdaptiveConcurrency:
+    """
+    根据观察到的吞吐自动调整同时下载的文件数 (爬山法):
+    出错率高时减半; 吞吐达到带宽预算时保持; 上次增加后聚合吞吐明显提高则继续增加,
+    没有提高 (单流吞吐被摊薄) 则退回
+    """
+
+    def __init__(self, manager, minimum=1, maximum=16, initial=4):
+        self.manager = manager
+        self.minimum = minimum
+        self.maximum = maximum
+        self.current = max(minimum, min(maximum, initial))
+        self.lock = threading.Lock()
+        self.window_start = time.monotonic()
+        self.window_bytes = manager.total_bytes
+        self.finished = 0
+        self.failed = 0
+        self.last_rate = None
+        self.last_step = 0
+
+    def limit(self):
+        """当前允许的并发数 (按窗口定期调整)"""
+        with self.lock:
+            if time.monotonic() - self.window_start >= WINDOW_SECONDS:
+                self._adjust()
+            return self.current
+
+    def record(self, success):
+        """每个文件结束时调用"""
+        with self.lock:
+            self.finished += 1
+            if not success:
+                self.failed += 1
+
+    def _adjust(self):
+        now = time.monotonic()
+        rate = (self.manager.total_bytes - self.window_bytes) / (now - self.window_start)
+        error_rate = self.failed / self.finished if self.finished else 0.0
+        budget = self.manager.current_rate()
+        previous = self.current
+
+        if error_rate > ERROR_THRESHOLD:
+            step = -max(1, self.current // 2)
+        elif budget and rate >= budget * SATURATED:
+            step = 0
+        elif self.last_rate is None or self.last_step <= 0 or rate > self.last_rate * 1.05:
+            step = 1
+        else:
+            step = -1  # 上次增加没有带来更高的聚合吞吐
+        self.current = max(self.minimum, min(self.maximum, self.current + step))
+        if self.current != previous:
+            print(f"\n自适应并发: {previous} -> {self.current} "
+                  f"(聚合 {rate / 1024 ** 2:.1f} MB/s, 失败率 {error_rate:.0%})")
+
+        self.last_rate = rate
+        self.last_step = self.current - previous
+        self.window_start = now
+        self.window_bytes = self.manager.total_bytes
+        self.finished = self.failed = 0
+
+
+_manager = BandwidthManager()
+
+
+def configure(rate=None, schedule=None):
+    """设置全局带宽预算 (每个脚本启动时调用一次)"""
+    global _manager
+    _manager = BandwidthManager(rate, schedule)
+    limit = _manager.current_rate()
+    if limit or _manager.rules:
+        print(f"带宽上限: {'不限速' if limit is None else format_rate(limit)}"
+              + (f" (分时段: {schedule})" if schedule else ""))
+    return _manager
+
+
+def manager():
+    return _manager
+
+
+def adaptive(maximum, initial=None):
+    """创建基于全局流量统计的自适应并发控制, 并发数在 1..maximum 之间调整"""
+    return AdaptiveConcurrency(_manager, maximum=maximum, initial=initial or max(1, maximum // 2))
+
+
+def throttle(amount):
+    _manager.throttle(amount)
+
+
+async def athrottle(amount):
+    await _manager.athrottle(amount)
@@ -0,0 +1,151 @@
+"""
+ascp 的替身 (测试 aspera.py 用, 不需要 Aspera 客户端和网络)
+
+从本地目录 FAKE_ASCP_ROOT "下载" 文件: 远程路径 /vol1/fastq/... 对应 FAKE_ASCP_ROOT/vol1/fastq/...
+- 支持 --file-pair-list 批量模式和 user@host:/path 目标 两种用法
+- 按 -l 限速, 输出与 ascp 相同格式的进度行 (以 \r 刷新), 结束时输出 Completed 汇总
+- -k 1 时从本地已有部分续传
+- FAKE_ASCP_FAIL=文件名1,文件名2: 这些文件第一次传输到一半时模拟会话中断 (退出码1)
+用法: 在 1.download_ascp.py 中设置 ascp_cmd = "python bench/fake_ascp.py", 并设置环境变量 FAKE_ASCP_ROOT
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+CHUNK_SIZE = 256 * 1024
+REPORT_INTERVAL = 0.2
+
+
+def parse_limit(text):
+    """-l 参数 (比特/秒, 如 100m) -> 字节/秒"""
+    units = {'k': 1e3, 'm': 1e6, 'g': 1e9}
+    text = (text or '').lower()
+    if not text:
+        return None
+    if text[-1] in units:
+        return float(text[:-1]) * units[text[-1]] / 8
+    return float(text) / 8
+
+
+def human(size):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024 or unit == 'GB':
+            return f"{size:.0f}{unit}" if unit == 'B' else f"{size:.1f}{unit}"
+        size /= 1024
+
+
+def progress_line(name, done, total, rate, elapsed, finished):
+    percent = int(done * 100 / total) if total else 100
+    rate_text = f"{rate * 8 / 1e6:.1f}Mb/s"
+    if finished:
+        clock = elapsed
+        suffix = ""
+    else:
+        clock = (total - done) / rate if rate else 0
+        suffix = " ETA"
+    return (f"{name:<40} {percent:>3}% {human(done):>8} {rate_text:>10}    "
+            f"{int(clock) // 60:02d}:{int(clock) % 60:02d}{suffix}")
+
+
+def should_fail(name):
+    names = {n.strip() for n in os.environ.get('FAKE_ASCP_FAIL', '').split(',') if n.strip()}
+    if name not in names:
+        return False
+    marker = os.path.join(os.environ.get('FAKE_ASCP_STATE', tempfile.gettempdir()),
+                          f"fake_ascp_failed_{name}")
+    if os.path.exists(marker):
+        return False
+    open(marker, 'w').close()
+    return True
+
+
+def transfer(source, dest, resume, rate_limit):
+    """复制一个文件并输出进度, 返回传输的字节数; 模拟中断时抛出 ConnectionError"""
+    name = os.path.basename(dest)
+    total = os.path.getsize(source)
+    offset = os.path.getsize(dest) if resume and os.path.exists(dest) else 0
+    if offset > total:
+        offset = 0
+    fail_at = total // 2 if should_fail(name) else None
+    start = time.time()
+    last_report = 0
+    sent = 0
+    with open(source, 'rb') as src, open(dest, 'r+b' if offset else 'wb') as dst:
+        src.seek(offset)
+        dst.seek(offset)
+        dst.truncate()
+        while chunk := src.read(CHUNK_SIZE):
+            if fail_at is not None and offset + sent + len(chunk) > fail_at:
+                dst.write(chunk[:fail_at - offset - sent])
+                raise ConnectionError("Connection lost")
+            dst.write(chunk)
+            sent += len(chunk)
+            elapsed = time.time() - start
+            if rate_limit and sent / rate_limit > elapsed:
+                time.sleep(sent / rate_limit - elapsed)
+            now = time.time()
+            if now - last_report >= REPORT_INTERVAL:
+                rate = sent / max(now - start, 1e-6)
+                sys.stdout.write("\r" + progress_line(name, offset + sent, total, rate, now - start, False))
+                sys.stdout.flush()
+                last_report = now
+    elapsed = time.time() - start
+    rate = sent / max(elapsed, 1e-6)
+    sys.stdout.write("\r" + progress_line(name, total, total, rate, elapsed, True) + "\n")
+    sys.stdout.flush()
+    return sent
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ascp 替身')
+    parser.add_argument('-l', dest='limit')
+    parser.add_argument('-i', dest='key')
+    parser.add_argument('-k', dest='resume', type=int, default=0)
+    parser.add_argument('-P', dest='port')
+    parser.add_argument('-Q', action='store_true')
+    parser.add_argument('-T', action='store_true')
+    parser.add_argument('-QT', action='store_true')
+    parser.add_argument('--mode')
+    parser.add_argument('--user')
+    parser.add_argument('--host')
+    parser.add_argument('--file-pair-list', dest='pair_list')
+    parser.add_argument('paths', nargs='+')
+    args = parser.parse_args()
+
+    root = os.environ.get('FAKE_ASCP_ROOT', '.')
+    if args.pair_list:
+        with open(args.pair_list) as f:
+            lines = [line.strip() for line in f if line.strip()]
+        target = args.paths[-1]
+        pairs = [(lines[i], os.path.join(target, lines[i + 1])) for i in range(0, len(lines) - 1, 2)]
+    else:
+        *sources, target = args.paths
+        pairs = []
+        for source in sources:
+            remote = source.split(':', 1)[-1]
+            dest = target if not os.path.isdir(target) else os.path.join(target, os.path.basename(remote))
+            pairs.append((remote, dest))
+
+    rate_limit = parse_limit(args.limit)
+    total = 0
+    start = time.time()
+    for remote, dest in pairs:
+        source = os.path.join(root, remote.lstrip('/'))
+        if not os.path.isfile(source):
+            print(f"ascp: Server aborted session: No such file or directory ({remote}), exiting.")
+            return 1
+        try:
+            total += transfer(source, dest, args.resume == 1, rate_limit)
+        except ConnectionError as e:
+            print(f"\nSession Stop  (Error: {e})")
+            return 1
+    elapsed = max(time.time() - start, 1e-6)
+    print(f"Completed: {total // 1024}K bytes transferred in {elapsed:.0f} seconds")
+    print(f" ({total * 8 / elapsed / 1000:.0f}K bits/sec), in {len(pairs)} file{'s' if len(pairs) != 1 else ''}.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,525 @@
+"""
+本地的 ENA 替身服务器 (基准测试和故障注入用, 不需要网络)
+
+在 --root 目录 (bench/make_corpus.py 生成, 与ENA相同的 vol1/fastq/... 结构) 上同时提供:
+- HTTP: GET/HEAD, 支持 Range 和 keep-alive, 相当于 https://ftp.sra.ebi.ac.uk/vol1/...
+- FTP: 匿名登录, 被动模式 (EPSV/PASV), CWD/SIZE/MDTM/REST/RETR, 相当于 ftp://ftp.sra.ebi.ac.uk/vol1/...
+两种协议使用相同的网络条件和故障注入:
+- --latency: 每个HTTP请求/FTP命令应答前的延迟 (秒), 近似往返时间
+- --rate: 每个连接的带宽上限; --total-rate: 所有连接共享的上限 (与 ascp -l 相同的单位, 如 "50m")
+- --drop-rate: 传输到随机位置时断开连接的概率 (测试续传)
+- --error-rate: 直接拒绝请求的概率 (HTTP 503 / FTP 421)
+- --corrupt-rate: 传输内容中翻转一个字节的概率 (测试MD5不一致后的修复/重新下载)
+- --no-range: HTTP 忽略 Range 从头返回 200
+- Conditions.fail_next(429, 503, ...): 接下来的HTTP请求依次返回这些状态码 (测试重试, bench/test_ena_portal.py)
+HTTP 另外提供 ENA portal API 的最小替身 (/ena/portal/api/search 和 /filereport, result=read_run, tsv),
+数据来自 --root/data_report 中 make_corpus.py 写出的清单, 供 ena_portal.py 测试:
+ENA_PORTAL_URL=http://127.0.0.1:<HTTP端口>/ena/portal/api
+清单中的FTP链接为 127.0.0.1:<FTP端口>/vol1/..., HTTPS下载通过环境变量
+SRA_HTTP_HOSTS=127.0.0.1:<FTP端口>=http://127.0.0.1:<HTTP端口> 转到本地 (见 download_engine.HTTP_HOSTS)
+用法: python bench/fake_ena.py --root /tmp/sra_bench/corpus --rate 100m --latency 0.02 --drop-rate 0.1
+"""
+import os
+import re
+import sys
+import glob
+import time
+import random
+import socket
+import argparse
+import threading
+import socketserver
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bandwidth import TokenBucket, parse_rate  # noqa: E402
+from manifest import read_tsv, TSV_PATTERN  # noqa: E402
+
+# 配置参数
+HTTP_PORT = 18080
+FTP_PORT = 18021
+CHUNK_SIZE = 64 * 1024  # 每次发送的字节数
+DATA_TIMEOUT = 30  # FTP 等待数据连接的超时 (秒)
+PORTAL_PATH = "/ena/portal/api/"
+REPORT_DIR = "data_report"  # portal 查询的数据来源 (make_corpus.py 写出的清单)
+# filereport?accession= 可以匹配的字段
+ACCESSION_FIELDS = ('study_accession', 'secondary_study_accession', 'sample_accession',
+                    'secondary_sample_accession', 'experiment_accession', 'run_accession')
+
+
+class Conditions:
+    """网络条件、故障注入和统计 (HTTP 和 FTP 共用)"""
+
+    def __init__(self, latency=0.0, rate=None, total_rate=None, drop_rate=0.0, error_rate=0.0,
+                 corrupt_rate=0.0, ranges=True, seed=None):
+        self.latency = latency
+        self.rate = parse_rate(rate)
+        self.total = TokenBucket(parse_rate(total_rate))
+        self.drop_rate = drop_rate
+        self.error_rate = error_rate
+        self.corrupt_rate = corrupt_rate
+        self.ranges = ranges
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.failures = []  # 接下来的HTTP请求依次返回的状态码
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.stats = {'requests': 0, 'bytes': 0, 'connections': 0, 'drops': 0, 'errors': 0,
+                          'corruptions': 0, 'portal_requests': 0}
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.stats[name] += value
+
+    def fail_next(self, *codes):
+        with self.lock:
+            self.failures.extend(codes)
+
+    def next_failure(self):
+        with self.lock:
+            return self.failures.pop(0) if self.failures else None
+
+    def chance(self, probability):
+        with self.lock:
+            return probability > 0 and self.random.random() < probability
+
+    def plan(self, length):
+        """决定这次传输的故障: (断开位置或None, 翻转字节的位置或None)"""
+        with self.lock:
+            drop = corrupt = None
+            if length > 0 and self.drop_rate and self.random.random() < self.drop_rate:
+                drop = self.random.randrange(length)
+            if length > 0 and self.corrupt_rate and self.random.random() < self.corrupt_rate:
+                corrupt = self.random.randrange(length)
+            return drop, corrupt
+
+    def delay(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def send_file(self, path, offset, length, write):
+        """
+        按带宽限制发送 path 的 [offset, offset+length), 按计划注入故障
+        :return: 是否完整发送 (模拟断开时返回False, 调用方应关闭连接)
+        """
+        drop, corrupt = self.plan(length)
+        bucket = TokenBucket(self.rate)
+        sent = 0
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            while sent < length:
+                chunk = f.read(min(CHUNK_SIZE, length - sent))
+                if not chunk:
+                    break
+                if corrupt is not None and sent <= corrupt < sent + len(chunk):
+                    chunk = bytearray(chunk)
+                    chunk[corrupt - sent] ^= 0xFF
+                    self.count('corruptions')
+                if drop is not None and sent + len(chunk) > drop:
+                    chunk = chunk[:drop - sent]
+                wait = max(bucket.reserve(len(chunk)), self.total.reserve(len(chunk)))
+                if wait > 0:
+                    time.sleep(wait)
+                write(chunk)
+                sent += len(chunk)
+                self.count('bytes', len(chunk))
+                if drop is not None and sent >= drop:
+                    self.count('drops')
+                    return False
+        return True
+
+
+def resolve(root, path):
+    """URL/FTP路径 -> root下的本地路径, 越出 root 时返回None"""
+    local = os.path.realpath(os.path.join(root, path.lstrip('/')))
+    if local != root and not local.startswith(root + os.sep):
+        return None
+    return local
+
+
+_portal_index = {}  # 清单签名 -> (字段, 值) -> 行列表
+
+
+def portal_rows(root):
+    """读取 --root/data_report 中的清单并按各编号列建立索引 (清单不变时复用)"""
+    paths = sorted(glob.glob(os.path.join(root, REPORT_DIR, TSV_PATTERN)))
+    signature = tuple((p, os.stat(p).st_mtime_ns) for p in paths)
+    if signature not in _portal_index:
+        index = {}
+        for path in paths:
+            for row in read_tsv(path):
+                for field in ACCESSION_FIELDS:
+                    if row.get(field):
+                        index.setdefault((field, row[field].upper()), []).append(row)
+        _portal_index.clear()
+        _portal_index[signature] = index
+    return _portal_index[signature]
+
+
+def portal_query(root, endpoint, params):
+    """
+    portal API 替身: search 支持 field="value" 用 OR 连接的查询, filereport 按 accession 匹配各编号列
+    :return: tsv 文本 (第一行为 fields 列名), 参数不支持时返回None
+    """
+    if params.get('result', 'read_run') != 'read_run':
+        return None
+    if endpoint == 'search':
+        terms = re.findall(r'(\w+)\s*=\s*"?([^"\s)]+)"?', params.get('query', ''))
+    elif endpoint == 'filereport':
+        terms = [(field, params.get('accession', '')) for field in ACCESSION_FIELDS]
+    else:
+        return None
+    index = portal_rows(root)
+    fields = [f for f in params.get('fields', 'run_accession').split(',') if f]
+    lines = ["\t".join(fields)]
+    seen = set()
+    for field, value in terms:
+        for row in index.get((field, value.upper()), ()):
+            if id(row) not in seen:
+                seen.add(id(row))
+                lines.append("\t".join(row.get(f, '') for f in fields))
+    return "\n".join(lines) + "\n"
+
+
+# ---------------- HTTP ----------------
+
+class HTTPHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+
+    def setup(self):
+        super().setup()
+        self.server.conditions.count('connections')
+
+    def do_HEAD(self):
+        self._respond(send_body=False)
+
+    def do_GET(self):
+        self._respond(send_body=True)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0) or 0))
+        self._respond(send_body=True, form=body.decode('utf-8'))
+
+    def _respond(self, send_body, form=None):
+        conditions = self.server.conditions
+        conditions.count('requests')
+        conditions.delay()
+        failure = conditions.next_failure()
+        if failure is None and conditions.chance(conditions.error_rate):
+            failure = 503
+        if failure is not None:
+            conditions.count('errors')
+            self._empty(failure)
+            return
+        url_path, _, query = self.path.partition('?')
+        if url_path.startswith(PORTAL_PATH):
+            conditions.count('portal_requests')
+            params = dict(urllib.parse.parse_qsl(form if form is not None else query))
+            text = portal_query(self.server.root, url_path[len(PORTAL_PATH):].strip('/'), params)
+            if text is None:
+                self._empty(400)
+                return
+            data = text.encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; charset=utf-8')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            if send_body:
+                self.wfile.write(data)
+            return
+        if form is not None:
+            self._empty(405)
+            return
+        path = resolve(self.server.root, url_path)
+        if path is None or not os.path.isfile(path):
+            self._empty(404)
+            return
+        size = os.path.getsize(path)
+        start, end = 0, size - 1
+        match = re.match(r'bytes=(\d*)-(\d*)$', self.headers.get('Range', ''))
+        if match and conditions.ranges:
+            if match.group(1):
+                start = int(match.group(1))
+                end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+            else:  # bytes=-N (最后N字节)
+                start = max(size - int(match.group(2) or 0), 0)
+            if start >= size:
+                self.send_response(416)
+                self.send_header('Content-Range', f"bytes */{size}")
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', f"bytes {start}-{end}/{size}")
+        else:
+            self.send_response(200)
+        length = end - start + 1
+        self.send_header('Accept-Ranges', 'bytes' if conditions.ranges else 'none')
+        self.send_header('Content-Length', str(length))
+        self.send_header('Content-Type', 'application/x-gzip')
+        self.end_headers()
+        if send_body and not conditions.send_file(path, start, length, self.wfile.write):
+            self.close_connection = True
+            self.connection.shutdown(socket.SHUT_RDWR)
+
+    def _empty(self, code):
+        self.send_response(code)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class HTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, root, conditions):
+        self.root = root
+        self.conditions = conditions
+        super().__init__(address, HTTPHandler)
+
+
+# ---------------- FTP ----------------
+
+class FTPHandler(socketserver.StreamRequestHandler):
+    """最小的匿名只读FTP服务 (只支持被动模式)"""
+
+    def setup(self):
+        super().setup()
+        self.cwd = '/'
+        self.rest = 0
+        self.passive = None
+        self.server.conditions.count('connections')
+
+    def reply(self, text):
+        self.server.conditions.delay()
+        self.wfile.write(text.encode('utf-8') + b"\r\n")
+
+    def handle(self):
+        self.reply("220 fake ENA FTP ready")
+        while True:
+            try:
+                line = self.rfile.readline()
+            except OSError:
+                break
+            if not line:
+                break
+            command, _, arg = line.decode('utf-8', 'replace').strip().partition(' ')
+            handler = getattr(self, f"ftp_{command.upper()}", None)
+            try:
+                if handler is None:
+                    self.reply(f"502 {command} not implemented")
+                elif handler(arg) is False:
+                    break
+            except OSError:
+                break
+        self._close_passive()
+
+    def _path(self, arg):
+        return resolve(self.server.root, os.path.join(self.cwd, arg) if arg else self.cwd)
+
+    def _close_passive(self):
+        if self.passive is not None:
+            self.passive.close()
+            self.passive = None
+
+    def ftp_USER(self, arg):
+        self.reply("331 Please specify the password")
+
+    def ftp_PASS(self, arg):
+        self.reply("230 Login successful")
+
+    def ftp_SYST(self, arg):
+        self.reply("215 UNIX Type: L8")
+
+    def ftp_FEAT(self, arg):
+        self.reply("211-Features:\r\n EPSV\r\n PASV\r\n SIZE\r\n MDTM\r\n REST STREAM\r\n211 End")
+
+    def ftp_OPTS(self, arg):
+        self.reply("200 OK")
+
+    def ftp_NOOP(self, arg):
+        self.reply("200 OK")
+
+    def ftp_TYPE(self, arg):
+        self.reply("200 Switching to Binary mode")
+
+    def ftp_PWD(self, arg):
+        self.reply(f'257 "{self.cwd}" is the current directory')
+
+    def ftp_CWD(self, arg):
+        path = self._path(arg)
+        if path is None or not os.path.isdir(path):
+            self.reply("550 Failed to change directory")
+            return
+        self.cwd = '/' + os.path.relpath(path, self.server.root).replace(os.sep, '/').lstrip('.')
+        self.reply("250 Directory successfully changed")
+
+    def ftp_CDUP(self, arg):
+        self.ftp_CWD('..')
+
+    def ftp_SIZE(self, arg):
+        path = self._path(arg)
+        if path is None or not os.path.isfile(path):
+            self.reply("550 Could not get file size")
+        else:
+            self.reply(f"213 {os.path.getsize(path)}")
+
+    def ftp_MDTM(self, arg):
+        path = self._path(arg)
+        if path is None or not os.path.isfile(path):
+            self.reply("550 Could not get file modification time")
+        else:
+            self.reply("213 " + time.strftime("%Y%m%d%H%M%S", time.gmtime(os.path.getmtime(path))))
+
+    def ftp_REST(self, arg):
+        self.rest = int(arg or 0)
+        self.reply(f"350 Restart position accepted ({self.rest})")
+
+    def _listen(self):
+        self._close_passive()
+        self.passive = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.passive.bind((self.server.server_address[0], 0))
+        self.passive.listen(1)
+        self.passive.settimeout(DATA_TIMEOUT)
+        return self.passive.getsockname()
+
+    def ftp_EPSV(self, arg):
+        _, port = self._listen()
+        self.reply(f"229 Entering Extended Passive Mode (|||{port}|)")
+
+    def ftp_PASV(self, arg):
+        host, port = self._listen()
+        self.reply(f"227 Entering Passive Mode ({host.replace('.', ',')},{port // 256},{port % 256})")
+
+    def ftp_RETR(self, arg):
+        conditions = self.server.conditions
+        conditions.count('requests')
+        offset, self.rest = self.rest, 0
+        path = self._path(arg)
+        if self.passive is None:
+            self.reply("425 Use PASV or EPSV first")
+            return
+        if conditions.chance(conditions.error_rate):
+            conditions.count('errors')
+            self.reply("421 Service not available, closing control connection")
+            return False
+        if path is None or not os.path.isfile(path):
+            self._close_passive()
+            self.reply("550 Failed to open file")
+            return
+        size = os.path.getsize(path)
+        try:
+            data, _ = self.passive.accept()
+        except OSError:
+            self._close_passive()
+            self.reply("425 Failed to establish connection")
+            return
+        self._close_passive()
+        self.reply(f"150 Opening BINARY mode data connection for {arg} ({size} bytes)")
+        with data:
+            complete = conditions.send_file(path, offset, max(size - offset, 0), data.sendall)
+        if not complete:
+            return False  # 模拟断开: 数据和控制连接都关闭
+        self.reply("226 Transfer complete")
+
+    def ftp_ABOR(self, arg):
+        self.reply("226 Abort successful")
+
+    def ftp_QUIT(self, arg):
+        self.reply("221 Goodbye")
+        return False
+
+    def ftp_PORT(self, arg):
+        self.reply("502 Active mode not supported, use PASV")
+
+    ftp_EPRT = ftp_PORT
+
+
+class FTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, root, conditions):
+        self.root = root
+        self.conditions = conditions
+        super().__init__(address, FTPHandler)
+
+
+class FakeENA:
+    """在后台线程中运行 HTTP 和 FTP 服务 (bench/run_bench.py 使用)"""
+
+    def __init__(self, root, http_port=HTTP_PORT, ftp_port=FTP_PORT, host='127.0.0.1', **conditions):
+        self.root = os.path.realpath(root)
+        self.conditions = Conditions(**conditions)
+        self.http = HTTPServer((host, http_port), self.root, self.conditions)
+        self.ftp = FTPServer((host, ftp_port), self.root, self.conditions)
+        self.host = host
+        self.threads = []
+
+    @property
+    def ftp_host(self):
+        return f"{self.host}:{self.ftp.server_address[1]}"
+
+    @property
+    def http_base(self):
+        return f"http://{self.host}:{self.http.server_address[1]}"
+
+    @property
+    def portal_url(self):
+        return self.http_base + PORTAL_PATH.rstrip('/')
+
+    def http_hosts(self):
+        """SRA_HTTP_HOSTS 环境变量的值: FTP链接的主机 -> 本地HTTP服务"""
+        return f"{self.ftp_host}={self.http_base}"
+
+    def start(self):
+        for server in (self.http, self.ftp):
+            thread = threading.Thread(target=server.serve_forever, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        return self
+
+    def stop(self):
+        for server in (self.http, self.ftp):
+            server.shutdown()
+            server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地 ENA 替身服务器 (HTTP + FTP)')
+    parser.add_argument('--root', type=str, required=True, help='数据目录 (make_corpus.py 的 --dir)')
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='监听地址')
+    parser.add_argument('--http-port', type=int, default=HTTP_PORT, help=f'HTTP端口 (默认: {HTTP_PORT})')
+    parser.add_argument('--ftp-port', type=int, default=FTP_PORT, help=f'FTP端口 (默认: {FTP_PORT})')
+    parser.add_argument('--latency', type=float, default=0.0, help='每次应答前的延迟 (秒)')
+    parser.add_argument('--rate', type=str, default=None, help='每个连接的带宽上限, 如 50m')
+    parser.add_argument('--total-rate', type=str, default=None, help='所有连接共享的带宽上限, 如 500m')
+    parser.add_argument('--drop-rate', type=float, default=0.0, help='传输中途断开的概率')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='拒绝请求的概率')
+    parser.add_argument('--corrupt-rate', type=float, default=0.0, help='翻转一个字节的概率')
+    parser.add_argument('--no-range', action='store_true', help='HTTP 不支持 Range')
+    parser.add_argument('--seed', type=int, default=None, help='故障注入的随机种子')
+    args = parser.parse_args()
+
+    server = FakeENA(args.root, args.http_port, args.ftp_port, args.host, latency=args.latency,
+                     rate=args.rate, total_rate=args.total_rate, drop_rate=args.drop_rate,
+                     error_rate=args.error_rate, corrupt_rate=args.corrupt_rate,
+                     ranges=not args.no_range, seed=args.seed).start()
+    print(f"HTTP: {server.http_base}  FTP: ftp://{server.ftp_host}  数据目录: {server.root}")
+    print(f"HTTPS下载转到本地: export SRA_HTTP_HOSTS={server.http_hosts()}")
+    print(f"portal 查询转到本地: export ENA_PORTAL_URL={server.portal_url}")
+    try:
+        while True:
+            time.sleep(60)
+            print(server.conditions.stats)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
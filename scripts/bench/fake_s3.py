@@ -0,0 +1,287 @@
+"""
+本地的 S3 兼容替身服务器 (测试 sinks.S3Sink, 不需要网络和 MinIO)
+
+path-style 地址 http://127.0.0.1:<端口>/<bucket>/<key>, 对象保存在 --root/<bucket>/<key>, 元数据在同名 .meta.json;
+支持 multipart upload (CreateMultipartUpload / UploadPart / CompleteMultipartUpload / AbortMultipartUpload)、
+PutObject、HeadObject、GetObject:
+- 用 sinks.sign_v4 按收到的请求重新计算 SigV4 签名并核对 (凭据 --access-key / --secret-key)
+- 核对每个分片的 Content-MD5, 完成上传时核对各分片的 ETag
+- --error-rate: 分片上传返回 503 的概率 (测试重试); --latency: 每个请求的延迟 (秒)
+- 统计分片数、同时上传的最大分片数、字节数、完成/放弃的上传数
+用法:
+    python bench/fake_s3.py --root /tmp/sra_bench/s3 --port 18900
+    export AWS_ENDPOINT_URL=http://127.0.0.1:18900 AWS_ACCESS_KEY_ID=bench AWS_SECRET_ACCESS_KEY=benchsecret
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import base64
+import random
+import shutil
+import hashlib
+import argparse
+import datetime
+import threading
+import urllib.parse
+import xml.etree.ElementTree as ET
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from sinks import sign_v4  # noqa: E402
+
+# 配置参数
+PORT = 18900
+ACCESS_KEY = "bench"
+SECRET_KEY = "benchsecret"
+UPLOADS_DIR = ".uploads"  # 未完成的分片, 位于 --root
+META_SUFFIX = ".meta.json"
+
+
+class S3Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _reply(self, code, body=b'', headers=None):
+        self.send_response(code)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if body and self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def _error(self, code, error, message=''):
+        body = f"<Error><Code>{error}</Code><Message>{message}</Message></Error>".encode()
+        self._reply(code, body, {'Content-Type': 'application/xml'})
+
+    def _check_signature(self, body):
+        """按收到的请求重新签名, 与 Authorization 比对"""
+        server = self.server
+        auth = self.headers.get('Authorization', '')
+        if not auth.startswith('AWS4-HMAC-SHA256 '):
+            return False
+        fields = dict(item.strip().split('=', 1) for item in auth[len('AWS4-HMAC-SHA256 '):].split(','))
+        access_key, date, region, service, _ = fields['Credential'].split('/')
+        if access_key != server.access_key:
+            return False
+        payload_hash = self.headers.get('x-amz-content-sha256', '')
+        if payload_hash != 'UNSIGNED-PAYLOAD' and payload_hash != hashlib.sha256(body).hexdigest():
+            return False
+        names = fields['SignedHeaders'].split(';')
+        headers = {name: self.headers.get(name, '') for name in names
+                   if name not in ('host', 'x-amz-date', 'x-amz-content-sha256')}
+        now = datetime.datetime.strptime(self.headers.get('x-amz-date', ''), '%Y%m%dT%H%M%SZ').replace(
+            tzinfo=datetime.timezone.utc)
+        expected = sign_v4(self.command, f"http://{self.headers.get('Host')}{self.path}", headers,
+                           access_key, server.secret_key, region, payload_hash, now, service)
+        return expected['Authorization'] == auth
+
+    def _handle(self):
+        server = self.server
+        server.count('requests')
+        if server.latency:
+            time.sleep(server.latency)
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0) or 0))
+        if not self._check_signature(body):
+            server.count('bad_signatures')
+            self._error(403, 'SignatureDoesNotMatch')
+            return
+        path, _, query = self.path.partition('?')
+        params = dict(urllib.parse.parse_qsl(query, keep_blank_values=True))
+        bucket, _, key = urllib.parse.unquote(path).lstrip('/').partition('/')
+        if not bucket or not key or '..' in key.split('/'):
+            self._error(400, 'InvalidRequest')
+            return
+        object_path = os.path.join(server.root, bucket, key)
+
+        if self.command == 'POST' and 'uploads' in params:
+            upload_id = uuid.uuid4().hex
+            os.makedirs(server.upload_dir(upload_id))
+            meta = {k.lower(): v for k, v in self.headers.items() if k.lower().startswith('x-amz-meta-')}
+            with open(os.path.join(server.upload_dir(upload_id), 'meta.json'), 'w') as f:
+                json.dump({'bucket': bucket, 'key': key, 'meta': meta}, f)
+            self._reply(200, (f"<InitiateMultipartUploadResult><Bucket>{bucket}</Bucket><Key>{key}</Key>"
+                              f"<UploadId>{upload_id}</UploadId></InitiateMultipartUploadResult>").encode())
+        elif self.command == 'PUT' and 'uploadId' in params:
+            self._upload_part(params, body)
+        elif self.command == 'POST' and 'uploadId' in params:
+            self._complete(params['uploadId'], object_path, body)
+        elif self.command == 'DELETE' and 'uploadId' in params:
+            shutil.rmtree(server.upload_dir(params['uploadId']), ignore_errors=True)
+            server.count('aborts')
+            self._reply(204)
+        elif self.command == 'PUT':
+            meta = {k.lower(): v for k, v in self.headers.items() if k.lower().startswith('x-amz-meta-')}
+            etag = f'"{hashlib.md5(body).hexdigest()}"'
+            server.store(object_path, [body], meta, etag)
+            self._reply(200, headers={'ETag': etag})
+        elif self.command in ('GET', 'HEAD'):
+            if not os.path.isfile(object_path):
+                self._error(404, 'NoSuchKey')
+                return
+            with open(object_path + META_SUFFIX) as f:
+                meta = json.load(f)
+            with open(object_path, 'rb') as f:
+                data = f.read() if self.command == 'GET' else b''
+            headers = dict(meta['meta'], ETag=meta['etag'])
+            if self.command == 'HEAD':
+                headers['Content-Length'] = str(os.path.getsize(object_path))
+                self.send_response(200)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+            else:
+                self._reply(200, data, headers)
+        else:
+            self._error(405, 'MethodNotAllowed')
+
+    def _upload_part(self, params, body):
+        server = self.server
+        upload_dir = server.upload_dir(params['uploadId'])
+        if not os.path.isdir(upload_dir):
+            self._error(404, 'NoSuchUpload')
+            return
+        if server.chance(server.error_rate):
+            server.count('errors')
+            self._error(503, 'SlowDown')
+            return
+        digest = hashlib.md5(body).digest()
+        if self.headers.get('Content-MD5') and base64.b64decode(self.headers['Content-MD5']) != digest:
+            self._error(400, 'BadDigest')
+            return
+        with server.lock:
+            server.inflight += 1
+            server.stats['max_inflight'] = max(server.stats['max_inflight'], server.inflight)
+        try:
+            if server.part_delay:
+                time.sleep(server.part_delay)  # 近似上传耗时, 便于观察并发
+            with open(os.path.join(upload_dir, f"{int(params['partNumber']):05d}"), 'wb') as f:
+                f.write(body)
+        finally:
+            with server.lock:
+                server.inflight -= 1
+        server.count('parts')
+        server.count('bytes', len(body))
+        self._reply(200, headers={'ETag': f'"{digest.hex()}"'})
+
+    def _complete(self, upload_id, object_path, body):
+        server = self.server
+        upload_dir = server.upload_dir(upload_id)
+        if not os.path.isdir(upload_dir):
+            self._error(404, 'NoSuchUpload')
+            return
+        parts = []
+        for part in ET.fromstring(body).iter('Part'):
+            number, etag = int(part.findtext('PartNumber')), part.findtext('ETag').strip('"')
+            path = os.path.join(upload_dir, f"{number:05d}")
+            if not os.path.exists(path):
+                self._error(400, 'InvalidPart')
+                return
+            with open(path, 'rb') as f:
+                data = f.read()
+            if hashlib.md5(data).hexdigest() != etag:
+                self._error(400, 'InvalidPart')
+                return
+            parts.append(data)
+        with open(os.path.join(upload_dir, 'meta.json')) as f:
+            meta = json.load(f)['meta']
+        digests = b"".join(hashlib.md5(data).digest() for data in parts)
+        etag = f'"{hashlib.md5(digests).hexdigest()}-{len(parts)}"'
+        server.store(object_path, parts, meta, etag)
+        shutil.rmtree(upload_dir, ignore_errors=True)
+        server.count('completes')
+        self._reply(200, f"<CompleteMultipartUploadResult><ETag>{etag}</ETag></CompleteMultipartUploadResult>"
+                    .encode(), {'Content-Type': 'application/xml'})
+
+    do_GET = do_HEAD = do_PUT = do_POST = do_DELETE = _handle
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeS3(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, root, port=PORT, host='127.0.0.1', access_key=ACCESS_KEY, secret_key=SECRET_KEY,
+                 error_rate=0.0, latency=0.0, part_delay=0.0, seed=None):
+        self.root = os.path.realpath(root)
+        os.makedirs(os.path.join(self.root, UPLOADS_DIR), exist_ok=True)
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.error_rate = error_rate
+        self.latency = latency
+        self.part_delay = part_delay
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.inflight = 0
+        self.stats = {'requests': 0, 'parts': 0, 'bytes': 0, 'max_inflight': 0, 'completes': 0,
+                      'aborts': 0, 'errors': 0, 'bad_signatures': 0}
+        self.thread = None
+        super().__init__((host, port), S3Handler)
+
+    @property
+    def endpoint(self):
+        return f"http://{self.server_address[0]}:{self.server_address[1]}"
+
+    def env(self):
+        """让 sinks.S3Client 连接本服务器的环境变量"""
+        return {'AWS_ENDPOINT_URL': self.endpoint, 'AWS_ACCESS_KEY_ID': self.access_key,
+                'AWS_SECRET_ACCESS_KEY': self.secret_key}
+
+    def upload_dir(self, upload_id):
+        return os.path.join(self.root, UPLOADS_DIR, os.path.basename(upload_id))
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.stats[name] += value
+
+    def chance(self, probability):
+        with self.lock:
+            return probability > 0 and self.random.random() < probability
+
+    def store(self, object_path, parts, meta, etag):
+        os.makedirs(os.path.dirname(object_path), exist_ok=True)
+        with open(object_path + ".tmp", 'wb') as f:
+            for data in parts:
+                f.write(data)
+        os.replace(object_path + ".tmp", object_path)
+        with open(object_path + META_SUFFIX, 'w') as f:
+            json.dump({'meta': meta, 'etag': etag}, f)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地 S3 兼容替身服务器')
+    parser.add_argument('--root', type=str, required=True, help='对象保存目录')
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='监听地址')
+    parser.add_argument('--port', type=int, default=PORT, help=f'端口 (默认: {PORT})')
+    parser.add_argument('--access-key', type=str, default=ACCESS_KEY)
+    parser.add_argument('--secret-key', type=str, default=SECRET_KEY)
+    parser.add_argument('--error-rate', type=float, default=0.0, help='分片上传返回503的概率')
+    parser.add_argument('--latency', type=float, default=0.0, help='每个请求的延迟 (秒)')
+    parser.add_argument('--part-delay', type=float, default=0.0, help='每个分片额外的处理时间 (秒)')
+    args = parser.parse_args()
+
+    server = FakeS3(args.root, args.port, args.host, args.access_key, args.secret_key,
+                    args.error_rate, args.latency, args.part_delay).start()
+    print(f"S3: {server.endpoint}  对象目录: {server.root}")
+    print("export " + " ".join(f"{k}={v}" for k, v in server.env().items()))
+    try:
+        while True:
+            time.sleep(60)
+            print(server.stats)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
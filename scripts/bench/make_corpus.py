@@ -0,0 +1,169 @@
+"""
+生成基准测试用的合成数据 (不需要网络)
+
+- 按ENA的目录结构生成 <root>/vol1/fastq/SRR900/00n/SRR900000n/SRR900000n_1.fastq.gz 等文件:
+  双端 run 生成 _1/_2 (reads数相同, 可通过 --validate-fastq 的配对检查), --single 个单端 run 只有 <run>.fastq.gz
+- 每个样本 RUNS_PER_SAMPLE 个 run (测试 cellranger 布局的多 lane), 各 run 的reads数在 0.5~1.5 倍之间变化
+  (测试大文件优先的调度)
+- 写出与 ENA filereport 相同列的 filereport_read_run_PRJNA900000_tsv.txt, 包含真实的 MD5 和字节数;
+  FTP链接指向 --host (bench/fake_ena.py 的FTP端口), Aspera链接保持 fasp.sra.ebi.ac.uk (bench/fake_ascp.py 使用)
+- 内容由 --seed 决定, 参数不变时再次运行直接复用已生成的文件 (只按新的 --host 重写清单)
+用法: python bench/make_corpus.py --dir /tmp/sra_bench/corpus --runs 4 --reads 200000 --host 127.0.0.1:18021
+"""
+import os
+import gzip
+import json
+import random
+import hashlib
+import argparse
+
+# 配置参数
+RUNS = 4  # 双端 run 数
+SINGLE = 0  # 单端 run 数
+READS = 200000  # 每个文件的平均reads数 (150bp 时压缩后约 18MB)
+READ_LENGTH = 150
+RUNS_PER_SAMPLE = 2
+COMPRESS_LEVEL = 6
+SEED = 1
+FIRST_RUN = 9000001  # 合成的 run 编号从 SRR9000001 开始
+STUDY = "PRJNA900000"
+SECONDARY_STUDY = "SRP900000"
+HOST = "127.0.0.1:18021"
+ASPERA_HOST = "fasp.sra.ebi.ac.uk"
+REPORT_NAME = f"filereport_read_run_{STUDY}_tsv.txt"
+INFO_FILE = "corpus.json"
+BATCH = 10000  # 每次生成的reads数
+
+BASES = bytes(b"ACGT"[i % 4] for i in range(256))
+QUALITIES = bytes(b"FFFF:FF,F:FFFFFF#F"[i % 18] for i in range(256))  # NovaSeq 风格的分级质量值
+REPORT_COLUMNS = ('study_accession', 'secondary_study_accession', 'sample_accession',
+                  'secondary_sample_accession', 'experiment_accession', 'run_accession', 'library_layout', 'read_count', 'fastq_bytes', 'fastq_md5', 'fastq_ftp',
+                  'fastq_aspera', 'sra_ftp')
+
+
+def ena_dir(run):
+    """ENA的目录规则: SRR900/001/SRR9000001 (编号6位时没有第二级目录)"""
+    digits = len(run) - 3
+    if digits <= 6:
+        return f"{run[:6]}/{run}"
+    return f"{run[:6]}/{run[9:].rjust(3, '0')}/{run}"
+
+
+def write_fastq(path, run, mate, reads, read_length, rng, level):
+    """写一个 fastq.gz, 返回 (md5, 字节数)"""
+    suffix = f" {mate}" if mate else ""
+    written = 0
+    with gzip.open(path, 'wb', compresslevel=level) as f:
+        while written < reads:
+            count = min(BATCH, reads - written)
+            seqs = rng.randbytes(count * read_length).translate(BASES)
+            quals = rng.randbytes(count * read_length).translate(QUALITIES)
+            lines = []
+            for i in range(count):
+                header = f"{run}.{written + i + 1}{suffix} length={read_length}".encode()
+                start = i * read_length
+                lines += [b"@" + header, seqs[start:start + read_length],
+                          b"+" + header, quals[start:start + read_length]]
+            f.write(b"\n".join(lines) + b"\n")
+            written += count
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        while chunk := f.read(8 * 1024 * 1024):
+            md5.update(chunk)
+    return md5.hexdigest(), os.path.getsize(path)
+
+
+def generate(root, runs=RUNS, single=SINGLE, reads=READS, read_length=READ_LENGTH, seed=SEED,
+             level=COMPRESS_LEVEL, host=HOST):
+    """
+    生成 (或复用) 合成数据并写出清单
+    :return: {'root', 'report_dir', 'files': [{'file_name', 'path', 'md5', 'bytes', 'run', 'sample'}]}
+    """
+    params = {'runs': runs, 'single': single, 'reads': reads, 'read_length': read_length,
+              'seed': seed, 'level': level}
+    info_path = os.path.join(root, INFO_FILE)
+    try:
+        with open(info_path, 'r', encoding='utf-8') as f:
+            info = json.load(f)
+        if info['params'] != params or not all(os.path.getsize(item['path']) == item['bytes']
+                                               for item in info['files']):
+            info = None
+    except (OSError, ValueError, KeyError):
+        info = None
+
+    if info is None:
+        rng = random.Random(seed)
+        files = []
+        for index in range(runs + single):
+            run = f"SRR{FIRST_RUN + index}"
+            sample = f"SAMN{90000000 + index // RUNS_PER_SAMPLE}"
+            run_reads = int(reads * (0.5 + rng.random()))
+            directory = os.path.join(root, "vol1", "fastq", *ena_dir(run).split('/'))
+            os.makedirs(directory, exist_ok=True)
+            mates = ('1', '2') if index < runs else ('',)
+            for mate in mates:
+                file_name = f"{run}_{mate}.fastq.gz" if mate else f"{run}.fastq.gz"
+                path = os.path.join(directory, file_name)
+                print(f"生成 {file_name} ({run_reads} reads)")
+                md5, size = write_fastq(path, run, mate, run_reads, read_length, rng, level)
+                files.append({'file_name': file_name, 'path': path, 'md5': md5, 'bytes': size,
+                              'run': run, 'sample': sample, 'reads': run_reads})
+        info = {'params': params, 'files': files}
+        with open(info_path, 'w', encoding='utf-8') as f:
+            json.dump(info, f, indent=1)
+
+    report_dir = os.path.join(root, "data_report")
+    write_report(report_dir, info['files'], host)
+    return {'root': root, 'report_dir': report_dir, 'files': info['files']}
+
+
+def write_report(report_dir, files, host=HOST):
+    """写出 ENA filereport 格式的清单 (同一 run 的多个文件用 ; 拼接)"""
+    os.makedirs(report_dir, exist_ok=True)
+    runs = {}
+    for item in files:
+        runs.setdefault(item['run'], []).append(item)
+    lines = ["\t".join(REPORT_COLUMNS)]
+    for number, (run, items) in enumerate(runs.items(), 1):
+        paths = [f"/vol1/fastq/{ena_dir(run)}/{item['file_name']}" for item in items]
+        row = {
+            'study_accession': STUDY,
+            'secondary_study_accession': SECONDARY_STUDY,
+            'sample_accession': items[0]['sample'],
+            'secondary_sample_accession': "SRS" + items[0]['sample'][4:],
+            'experiment_accession': f"SRX{FIRST_RUN + number - 1}",
+            'run_accession': run,
+            'library_layout': 'PAIRED' if len(items) > 1 else 'SINGLE',
+            'read_count': str(items[0]['reads']),
+            'fastq_bytes': ";".join(str(item['bytes']) for item in items),
+            'fastq_md5': ";".join(item['md5'] for item in items),
+            'fastq_ftp': ";".join(f"{host}{path}" for path in paths),
+            'fastq_aspera': ";".join(f"{ASPERA_HOST}:{path}" for path in paths),
+            'sra_ftp': '',
+        }
+        lines.append("\t".join(row[column] for column in REPORT_COLUMNS))
+    path = os.path.join(report_dir, REPORT_NAME)
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        f.write("\n".join(lines) + "\n")
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description='生成合成的 fastq.gz 数据和 ENA 清单')
+    parser.add_argument('--dir', type=str, required=True, help='输出目录')
+    parser.add_argument('--runs', type=int, default=RUNS, help=f'双端 run 数 (默认: {RUNS})')
+    parser.add_argument('--single', type=int, default=SINGLE, help=f'单端 run 数 (默认: {SINGLE})')
+    parser.add_argument('--reads', type=int, default=READS, help=f'每个文件的平均reads数 (默认: {READS})')
+    parser.add_argument('--read-length', type=int, default=READ_LENGTH, help=f'读长 (默认: {READ_LENGTH})')
+    parser.add_argument('--seed', type=int, default=SEED, help='随机种子')
+    parser.add_argument('--level', type=int, default=COMPRESS_LEVEL, help='gzip 压缩级别')
+    parser.add_argument('--host', type=str, default=HOST, help=f'清单中FTP链接的主机 (默认: {HOST})')
+    args = parser.parse_args()
+    corpus = generate(args.dir, args.runs, args.single, args.reads, args.read_length, args.seed,
+                      args.level, args.host)
+    total = sum(item['bytes'] for item in corpus['files'])
+    print(f"{len(corpus['files'])} 个文件, 共 {total / 1024 ** 2:.1f} MB; 清单: {corpus['report_dir']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,408 @@
+"""
+端到端基准测试: 下载脚本、校验脚本和整理脚本在同一份合成数据上的耗时与资源占用
+
+1. bench/make_corpus.py 生成 (或复用) 合成的双端 fastq.gz 和 ENA 清单 (真实的 MD5)
+2. bench/fake_ena.py 在本地提供 HTTP/FTP 服务, 可设置延迟、带宽、断开/出错/损坏的概率
+3. 每个脚本复制到独立的工作目录, 像手工修改一样替换顶部的路径配置 (清单、下载目录、输出目录),
+   作为子进程运行; 记录墙钟时间、CPU时间 (含 curl/wget/ascp 等子进程)、峰值内存 (整个进程树的RSS之和),
+   并逐个核对结果 (下载的文件MD5 / 校验结果CSV / 整理后的文件数)
+4. 结果打印成表格, 并追加到 --output (TSV, 带时间和 git 提交号), 方便比较修改前后的结果
+
+下载: ftp_range (1.download_FTP.py 分段) / ftp_single (不分段) / curl / wget / async_https / async_ftp /
+      ascp (bench/fake_ascp.py, 不经过 fake_ena, 网络条件不生效) / pipeline (0.pipeline.py 下载+校验+整理) /
+      s3_sink (1.download_FTP.py 的 SINK 指向 bench/fake_s3.py, 不落地直接分片上传)
+校验: md5check (2.md5check.py) / md5check_HDD (2.md5check_HDD.py) / md5check_validate (加 --validate-fastq)
+整理: organize_<方式> (3.data_organize.py --mode copy/hardlink/symlink/move ...)
+用法:
+    python bench/run_bench.py --work /tmp/sra_bench --runs 4 --reads 200000 --rate 200m --latency 0.01
+    python bench/run_bench.py --work /tmp/sra_bench --backends curl,async_ftp --checkers none --organize none --drop-rate 0.2
+"""
+import os
+import re
+import csv
+import sys
+import time
+import shutil
+import hashlib
+import argparse
+import threading
+import subprocess
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SCRIPTS_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, SCRIPTS_DIR)
+sys.path.insert(0, BENCH_DIR)
+import make_corpus  # noqa: E402
+from fake_ena import FakeENA  # noqa: E402
+from fake_s3 import FakeS3  # noqa: E402
+from disk_plan import RESERVE  # noqa: E402
+from hash_engine import _advise  # noqa: E402
+
+# 配置参数
+TIMEOUT = 1800  # 单个脚本的最长运行时间 (秒)
+HTTP_PORT = 0  # 0 表示自动选择空闲端口
+FTP_PORT = 0
+RSS_INTERVAL = 0.05  # 采样进程树内存的间隔 (秒)
+FAKE_ASCP = os.path.join(BENCH_DIR, "fake_ascp.py")
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+# 名称 -> (脚本, 替换的配置)
+BACKENDS = {
+    'ftp_range': ('1.download_FTP.py', {'SEGMENTS': 8}),
+    'ftp_single': ('1.download_FTP.py', {'SEGMENTS': 1, 'FAILOVER': False}),
+    'curl': ('1.download_FTP_curl.py', {}),
+    'wget': ('1.download_FTP_linux.py', {}),
+    'async_https': ('1.download_async.py', {'PROTOCOL': 'https'}),
+    'async_ftp': ('1.download_async.py', {'PROTOCOL': 'ftp'}),
+    'ascp': ('1.download_ascp.py', {'ascp_cmd': f'"{sys.executable}" "{FAKE_ASCP}"'}),
+    'pipeline': ('0.pipeline.py', {}),
+    's3_sink': ('1.download_FTP.py', {'SINK': 's3://bench/fastq'}),
+}
+# 名称 -> (脚本, 命令行参数)
+CHECKERS = {
+    'md5check': ('2.md5check.py', ['--force']),
+    'md5check_HDD': ('2.md5check_HDD.py', ['--force']),
+    'md5check_validate': ('2.md5check.py', ['--force', '--validate-fastq']),
+}
+ORGANIZE_SCRIPT = '3.data_organize.py'
+ORGANIZE_MODES = ('copy', 'hardlink', 'symlink', 'move')
+SCRIPT_DEPS = {'2.md5check_HDD.py': ['2.md5check.py']}  # 按路径运行其他入口脚本的包装脚本
+# 各脚本顶部的路径配置 -> 替换为工作目录下的 清单 / 数据 / 输出 目录
+PATH_SETTINGS = {
+    'manifest_path': 'manifest', 'MANIFEST_PATH': 'manifest', 'DEFAULT_MANIFEST_PATH': 'manifest',
+    'download_dir': 'data', 'DOWNLOAD_DIR': 'data', 'DATA_DIR': 'data',
+    'OUTPUT_DIR': 'output',
+}
+RESULT_COLUMNS = ('time', 'commit', 'kind', 'name', 'seconds', 'mb_per_s', 'cpu_seconds', 'cpu_percent',
+                  'peak_rss_mb', 'ok', 'files', 'requests', 'drops', 'errors', 'corruptions', 'conditions')
+
+
+def patch_script(script, dest_dir, settings):
+    """复制脚本并替换顶部的配置行 (NAME = ...), 找不到配置项时报错"""
+    with open(os.path.join(SCRIPTS_DIR, script), 'r', encoding='utf-8') as f:
+        text = f.read()
+    for name, value in settings.items():
+        pattern = re.compile(rf"^{re.escape(name)} = .*$", re.MULTILINE)
+        if not pattern.search(text):
+            raise KeyError(f"{script} 中没有配置项 {name}")
+        text = pattern.sub(lambda _: f"{name} = {value!r}", text, count=1)
+    path = os.path.join(dest_dir, script)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    return path
+
+
+def prepare(script, workdir, paths, settings=None):
+    """在工作目录中准备脚本 (及其依赖的入口脚本), 返回脚本路径"""
+    for name in SCRIPT_DEPS.get(script, []) + [script]:
+        with open(os.path.join(SCRIPTS_DIR, name), 'r', encoding='utf-8') as f:
+            text = f.read()
+        values = {key: paths[role] for key, role in PATH_SETTINGS.items()
+                  if re.search(rf"^{re.escape(key)} = ", text, re.MULTILINE)}
+        values.update(settings or {})
+        path = patch_script(name, workdir, values)
+    return path
+
+
+def tree_rss(pid):
+    """进程及其全部子进程当前的 RSS 之和 (字节), 读取 /proc; 不支持时返回None"""
+    parents = {}
+    rss = {}
+    try:
+        entries = os.listdir('/proc')
+    except OSError:
+        return None
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", 'rb') as f:
+                fields = f.read().rsplit(b')', 1)[1].split()
+        except OSError:
+            continue
+        parents[int(entry)] = int(fields[1])
+        rss[int(entry)] = int(fields[21]) * PAGE_SIZE
+    tree = {pid}
+    changed = True
+    while changed:
+        children = {child for child, parent in parents.items() if parent in tree and child not in tree}
+        tree |= children
+        changed = bool(children)
+    return sum(rss.get(p, 0) for p in tree)
+
+
+def run_measured(command, env, log_path, timeout=TIMEOUT):
+    """
+    运行子进程并测量资源占用
+    CPU时间取自 wait4 (包含它等待过的子进程, 如 curl/wget/ascp 和校验的进程池);
+    峰值内存按 RSS_INTERVAL 采样整个进程树的 RSS 之和 (fork 出的子进程的 ru_maxrss 从父进程当时的 RSS 起算,
+    不能反映脚本本身的占用), 不支持 /proc 时退回 ru_maxrss
+    :return: {'seconds', 'cpu_seconds', 'peak_rss_mb', 'returncode'}
+    """
+    peak = [None]
+    with open(log_path, 'w', encoding='utf-8') as log:
+        start = time.perf_counter()
+        process = subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT, env=env,
+                                   cwd=os.path.dirname(command[1]))
+        finished = threading.Event()
+
+        def sample():
+            while not finished.wait(RSS_INTERVAL):
+                rss = tree_rss(process.pid)
+                if rss is not None:
+                    peak[0] = max(peak[0] or 0, rss)
+
+        sampler = threading.Thread(target=sample, daemon=True)
+        sampler.start()
+        timer = threading.Timer(timeout, process.kill)
+        timer.start()
+        try:
+            _, status, usage = os.wait4(process.pid, 0)
+        finally:
+            timer.cancel()
+            finished.set()
+            sampler.join()
+        seconds = time.perf_counter() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+    peak_rss = peak[0] / 1024 ** 2 if peak[0] else usage.ru_maxrss / 1024
+    return {'seconds': seconds, 'cpu_seconds': usage.ru_utime + usage.ru_stime,
+            'peak_rss_mb': peak_rss, 'returncode': process.returncode}
+
+
+def md5_of(path):
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        while chunk := f.read(8 * 1024 * 1024):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+def check_downloads(files, directories):
+    """在下载/整理目录中查找每个文件并核对MD5, 返回正确的文件数"""
+    found = {}
+    for directory in directories:
+        for dirpath, _, names in os.walk(directory):
+            for name in names:
+                found.setdefault(name, os.path.join(dirpath, name))
+    return sum(1 for item in files
+               if item['file_name'] in found and md5_of(found[item['file_name']]) == item['md5'])
+
+
+def check_results_csv(data_dir):
+    """校验结果CSV中 is_valid 为 True 的文件数"""
+    try:
+        with open(os.path.join(data_dir, "md5_verification_results.csv"), 'r', encoding='utf-8') as f:
+            return sum(1 for row in csv.DictReader(f) if row.get('is_valid') == 'True')
+    except OSError:
+        return 0
+
+
+def count_fastq(directory):
+    return sum(1 for _, _, names in os.walk(directory) for name in names if name.endswith('.fastq.gz'))
+
+
+def link_corpus(files, data_dir):
+    """把合成数据硬链接 (不支持时复制) 到数据目录, 作为校验/整理的输入"""
+    os.makedirs(data_dir, exist_ok=True)
+    for item in files:
+        dest = os.path.join(data_dir, item['file_name'])
+        try:
+            os.link(item['path'], dest)
+        except OSError:
+            shutil.copyfile(item['path'], dest)
+
+
+def drop_cache(files):
+    """丢弃合成数据的页缓存, 近似冷读 (硬链接共享同一份缓存)"""
+    for item in files:
+        with open(item['path'], 'rb') as f:
+            _advise(f.fileno(), 0, 0, 'POSIX_FADV_DONTNEED')
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=SCRIPTS_DIR, text=True,
+                              capture_output=True, timeout=10).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return ''
+
+
+def select(text, choices):
+    if text in (None, 'all'):
+        return list(choices)
+    names = [name.strip() for name in text.split(',') if name.strip() and name.strip() != 'none']
+    unknown = [name for name in names if name not in choices]
+    if unknown:
+        raise SystemExit(f"未知的名称: {', '.join(unknown)} (可选 {', '.join(choices)})")
+    return names
+
+
+class Bench:
+    def __init__(self, args, corpus, server, s3):
+        self.args = args
+        self.corpus = corpus
+        self.server = server
+        self.s3 = s3
+        self.files = corpus['files']
+        self.total_bytes = sum(item['bytes'] for item in self.files)
+        self.results = []
+        self.commit = git_commit()
+        self.env = dict(os.environ,
+                        PYTHONPATH=os.pathsep.join(filter(None, [SCRIPTS_DIR, os.environ.get('PYTHONPATH')])),
+                        PYTHONUNBUFFERED='1',
+                        SRA_HTTP_HOSTS=server.http_hosts(),
+                        FAKE_ASCP_ROOT=corpus['root'], **s3.env())
+
+    def workdir(self, kind, name):
+        workdir = os.path.join(self.args.work, 'runs', f"{kind}_{name}")
+        shutil.rmtree(workdir, ignore_errors=True)
+        os.makedirs(workdir)
+        paths = {'manifest': self.corpus['report_dir'], 'data': os.path.join(workdir, 'data'),
+                 'output': os.path.join(workdir, 'organized'), 'objects': self.s3.root}
+        return workdir, paths
+
+    def run(self, kind, name, script, paths, workdir, settings=None, arguments=(), setup=None, check=None):
+        """运行 repeat 次, 记录最快的一次"""
+        best = None
+        for _ in range(self.args.repeat):
+            for directory in (paths['data'], paths['output'], paths['objects']):
+                shutil.rmtree(directory, ignore_errors=True)
+            os.makedirs(paths['objects'])
+            if setup is not None:
+                setup()
+            if not self.args.warm:
+                drop_cache(self.files)
+            path = prepare(script, workdir, paths, settings)
+            env = dict(self.env, FAKE_ASCP_STATE=workdir)
+            self.server.conditions.reset()
+            measured = run_measured([sys.executable, path, *arguments], env,
+                                    os.path.join(workdir, 'log.txt'), self.args.timeout)
+            measured.update(self.server.conditions.stats)
+            if best is None or measured['seconds'] < best['seconds']:
+                best = measured
+                best['ok'] = check() if check is not None else 0
+        self.record(kind, name, best)
+        if not self.args.keep:
+            for directory in (paths['data'], paths['output'], paths['objects']):
+                shutil.rmtree(directory, ignore_errors=True)
+
+    def record(self, kind, name, measured):
+        seconds = measured['seconds']
+        row = {
+            'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'commit': self.commit,
+            'kind': kind,
+            'name': name,
+            'seconds': round(seconds, 3),
+            'mb_per_s': round(self.total_bytes / 1024 ** 2 / seconds, 2) if seconds else 0,
+            'cpu_seconds': round(measured['cpu_seconds'], 3),
+            'cpu_percent': round(measured['cpu_seconds'] * 100 / seconds, 1) if seconds else 0,
+            'peak_rss_mb': round(measured['peak_rss_mb'], 1),
+            'ok': measured['ok'],
+            'files': len(self.files),
+            'requests': measured.get('requests', 0) if kind == 'download' else '',
+            'drops': measured.get('drops', 0) if kind == 'download' else '',
+            'errors': measured.get('errors', 0) if kind == 'download' else '',
+            'corruptions': measured.get('corruptions', 0) if kind == 'download' else '',
+            'conditions': self.args.conditions,
+        }
+        self.results.append(row)
+        status = '' if measured['returncode'] == 0 else f" (退出码 {measured['returncode']})"
+        print(f"{kind:<10}{name:<20}{row['seconds']:>10.2f}{row['mb_per_s']:>10.1f}{row['cpu_seconds']:>10.2f}"
+              f"{row['cpu_percent']:>8.0f}%{row['peak_rss_mb']:>10.1f}{row['ok']:>6}/{row['files']}{status}",
+              flush=True)
+
+    def downloads(self, names):
+        for name in names:
+            script, settings = BACKENDS[name]
+            workdir, paths = self.workdir('download', name)
+            self.run('download', name, script, paths, workdir, settings,
+                     check=lambda: check_downloads(self.files, [paths['data'], paths['output'],
+                                                                paths['objects']]))
+
+    def checkers(self, names):
+        for name in names:
+            script, arguments = CHECKERS[name]
+            workdir, paths = self.workdir('check', name)
+            self.run('check', name, script, paths, workdir, arguments=arguments,
+                     setup=lambda: link_corpus(self.files, paths['data']),
+                     check=lambda: check_results_csv(paths['data']))
+
+    def organize(self, modes, layout):
+        for mode in modes:
+            workdir, paths = self.workdir('organize', mode)
+            self.run('organize', f"{mode}_{layout}", ORGANIZE_SCRIPT, paths, workdir,
+                     arguments=['--mode', mode, '--layout', layout],
+                     setup=lambda: link_corpus(self.files, paths['data']),
+                     check=lambda: count_fastq(paths['output']))
+
+    def save(self, output):
+        new = not os.path.exists(output)
+        with open(output, 'a', encoding='utf-8', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=RESULT_COLUMNS, delimiter='\t')
+            if new:
+                writer.writeheader()
+            writer.writerows(self.results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='下载/校验/整理脚本的端到端基准测试')
+    parser.add_argument('--work', type=str, required=True, help='工作目录 (合成数据、各次运行的目录和结果)')
+    parser.add_argument('--runs', type=int, default=make_corpus.RUNS, help='双端 run 数')
+    parser.add_argument('--single', type=int, default=make_corpus.SINGLE, help='单端 run 数')
+    parser.add_argument('--reads', type=int, default=make_corpus.READS, help='每个文件的平均reads数')
+    parser.add_argument('--seed', type=int, default=make_corpus.SEED, help='合成数据和故障注入的随机种子')
+    parser.add_argument('--backends', type=str, default='all',
+                        help=f"逗号分隔的下载方式, all / none (可选 {', '.join(BACKENDS)})")
+    parser.add_argument('--checkers', type=str, default='all',
+                        help=f"逗号分隔的校验方式, all / none (可选 {', '.join(CHECKERS)})")
+    parser.add_argument('--organize', type=str, default='all',
+                        help=f"逗号分隔的整理方式, all / none (可选 {', '.join(ORGANIZE_MODES)})")
+    parser.add_argument('--layout', type=str, default='run', help='整理的目录布局 (run / cellranger)')
+    parser.add_argument('--latency', type=float, default=0.0, help='服务器每次应答前的延迟 (秒)')
+    parser.add_argument('--rate', type=str, default=None, help='每个连接的带宽上限, 如 50m')
+    parser.add_argument('--total-rate', type=str, default=None, help='所有连接共享的带宽上限, 如 500m')
+    parser.add_argument('--drop-rate', type=float, default=0.0, help='传输中途断开的概率')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='服务器拒绝请求的概率')
+    parser.add_argument('--corrupt-rate', type=float, default=0.0, help='传输内容损坏的概率')
+    parser.add_argument('--repeat', type=int, default=1, help='每项重复次数 (取最快一次)')
+    parser.add_argument('--warm', action='store_true', help='不丢弃合成数据的页缓存')
+    parser.add_argument('--keep', action='store_true', help='保留每次运行的下载/整理结果')
+    parser.add_argument('--timeout', type=int, default=TIMEOUT, help=f'单个脚本的超时 (默认: {TIMEOUT}秒)')
+    parser.add_argument('--output', type=str, default=None, help='追加结果的TSV (默认: <work>/results.tsv)')
+    args = parser.parse_args()
+    backends = select(args.backends, BACKENDS)
+    checkers = select(args.checkers, CHECKERS)
+    modes = select(args.organize, ORGANIZE_MODES)
+    args.work = os.path.abspath(args.work)
+    args.conditions = (f"latency={args.latency} rate={args.rate} total_rate={args.total_rate} "
+                       f"drop={args.drop_rate} error={args.error_rate} corrupt={args.corrupt_rate}")
+
+    server = FakeENA(os.path.join(args.work, 'corpus'), HTTP_PORT, FTP_PORT, latency=args.latency,
+                     rate=args.rate, total_rate=args.total_rate, drop_rate=args.drop_rate,
+                     error_rate=args.error_rate, corrupt_rate=args.corrupt_rate, seed=args.seed)
+    corpus = make_corpus.generate(os.path.join(args.work, 'corpus'), args.runs, args.single, args.reads,
+                                  seed=args.seed, host=server.ftp_host)
+    total = sum(item['bytes'] for item in corpus['files'])
+    if shutil.disk_usage(args.work).free < RESERVE + 2 * total:
+        print(f"警告: {args.work} 剩余空间少于 disk_plan.RESERVE + 数据量, 下载脚本会推迟文件")
+    server.start()
+    s3 = FakeS3(os.path.join(args.work, 's3'), 0).start()
+    print(f"合成数据: {len(corpus['files'])} 个文件, {total / 1024 ** 2:.1f} MB | {args.conditions}")
+    print(f"\n{'类别':<8}{'名称':<18}{'耗时(秒)':>8}{'MB/s':>10}{'CPU(秒)':>8}{'CPU':>9}{'RSS(MB)':>9}{'正确':>8}")
+
+    bench = Bench(args, corpus, server, s3)
+    try:
+        bench.downloads(backends)
+        bench.checkers(checkers)
+        bench.organize(modes, args.layout)
+    finally:
+        server.stop()
+        s3.stop()
+        output = args.output or os.path.join(args.work, 'results.tsv')
+        bench.save(output)
+        print(f"\n结果已追加到: {output} (每次运行的日志在 {os.path.join(args.work, 'runs')})")
+
+
+if __name__ == '__main__':
+    main()
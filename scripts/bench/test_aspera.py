@@ -0,0 +1,121 @@
+"""
+aspera.py 的测试, 用 ascp 的替身 (bench/fake_ascp.py) 从本地合成数据 "下载", 不需要 Aspera 客户端和网络
+用法: python -m pytest bench/test_aspera.py  (或 python -m unittest bench/test_aspera.py)
+"""
+import os
+import sys
+import glob
+import hashlib
+import shutil
+import tempfile
+import unittest
+import contextlib
+import io
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import aspera  # noqa: E402
+from download_engine import make_tasks  # noqa: E402
+from manifest import load_manifest  # noqa: E402
+import make_corpus  # noqa: E402
+
+FAKE_ASCP = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake_ascp.py')
+ASCP_CMD = f'"{sys.executable}" "{FAKE_ASCP}"'
+RUNS = 2
+SINGLE = 1
+READS = 2000
+
+
+def file_md5(path):
+    with open(path, 'rb') as f:
+        return hashlib.md5(f.read()).hexdigest()
+
+
+class AsperaTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.root = tempfile.mkdtemp(prefix='aspera_')
+        corpus = make_corpus.generate(cls.root, runs=RUNS, single=SINGLE, reads=READS)
+        report = glob.glob(os.path.join(corpus['report_dir'], '*.txt'))[0]
+        cls.manifest = load_manifest(report, use_cache=False)
+        cls.files = {item['file_name']: item for item in corpus['files']}
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.root, ignore_errors=True)
+
+    def setUp(self):
+        self.work = tempfile.mkdtemp(prefix='aspera_dest_')
+        self.tasks = make_tasks(self.manifest.links('fastq_aspera'), self.work,
+                                sizes=self.manifest.sizes(), probe=False)
+
+    def tearDown(self):
+        shutil.rmtree(self.work, ignore_errors=True)
+
+    def download(self, fail=(), **kwargs):
+        """用 fake_ascp 下载全部任务; fail 中的文件第一次传输到一半时会话中断"""
+        env = {'FAKE_ASCP_ROOT': self.root, 'FAKE_ASCP_STATE': self.work, 'FAKE_ASCP_FAIL': ','.join(fail)}
+        events = []
+        with mock.patch.dict(os.environ, env), contextlib.redirect_stdout(io.StringIO()):
+            results = aspera.download_all(self.tasks, self.work, ascp_cmd=ASCP_CMD, key=None,
+                                          on_progress=events.append, **kwargs)
+        return {r['file_name']: r for r in results}, events
+
+    def assert_downloaded(self, names):
+        for name in names:
+            self.assertEqual(file_md5(os.path.join(self.work, name)), self.files[name]['md5'])
+
+    def test_split_link(self):
+        self.assertEqual(aspera.split_link('fasp.sra.ebi.ac.uk:/vol1/fastq/SRR1/SRR1_1.fastq.gz'),
+                         ('fasp.sra.ebi.ac.uk', '/vol1/fastq/SRR1/SRR1_1.fastq.gz'))
+        self.assertEqual(aspera.split_link('fasp.sra.ebi.ac.uk:vol1/a.fastq.gz')[1], '/vol1/a.fastq.gz')
+
+    def test_parse_progress(self):
+        event = aspera.parse_progress('SRR1_1.fastq.gz    45%   1.5MB  8.0Mb/s    00:03 ETA')
+        self.assertEqual(event['file_name'], 'SRR1_1.fastq.gz')
+        self.assertEqual(event['percent'], 45)
+        self.assertEqual(event['bytes'], int(1.5 * 1024 ** 2))
+        self.assertEqual(event['rate'], 1e6)
+        self.assertEqual((event['eta'], event['elapsed']), (3, None))
+        self.assertIsNone(aspera.parse_progress('Completed: 1536K bytes transferred in 2 seconds'))
+
+    def test_make_batches(self):
+        batches = aspera.make_batches(self.tasks, batch_size=2)
+        self.assertEqual(len(batches), 3)
+        self.assertEqual({host for host, _ in batches}, {'fasp.sra.ebi.ac.uk'})
+        names = [t['file_name'] for _, batch in batches for t in batch]
+        self.assertCountEqual(names, self.files)
+        # 最大的文件分到不同批次
+        self.assertEqual([batch[0] for _, batch in batches], self.tasks[:3])
+
+    def test_batch_download(self):
+        results, events = self.download(sessions=2, batch_size=2)
+        self.assertEqual(set(results), set(self.files))
+        self.assertTrue(all(r['success'] and r['attempts'] == 1 for r in results.values()))
+        self.assert_downloaded(self.files)
+        self.assertEqual({e['file_name'] for e in events if e['percent'] == 100}, set(self.files))
+
+    def test_retry_after_session_failure(self):
+        name = self.tasks[0]['file_name']
+        results, _ = self.download(fail=[name], sessions=len(self.tasks), batch_size=1)
+        self.assertTrue(all(r['success'] for r in results.values()))
+        self.assertEqual(results[name]['attempts'], 2)
+        self.assertTrue(all(r['attempts'] == 1 for n, r in results.items() if n != name))
+        self.assert_downloaded(self.files)
+        self.assertEqual(results[name]['bytes'], self.files[name]['bytes'])
+
+    def test_failure_after_last_round(self):
+        name = self.tasks[0]['file_name']
+        results, _ = self.download(fail=[name], sessions=len(self.tasks), batch_size=1, retries=1)
+        self.assertFalse(results[name]['success'])
+        self.assertTrue(results[name]['error'])
+        self.assertEqual(results[name]['attempts'], 1)
+        # 中断时留下的部分文件, 下次运行时从这里续传 (-k 1)
+        self.assertEqual(os.path.getsize(os.path.join(self.work, name)), self.files[name]['bytes'] // 2)
+        self.assertTrue(all(r['success'] for n, r in results.items() if n != name))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,148 @@
+"""
+download_engine.py 与 async_download.py 的测试, 下载发往本地的 ENA 替身 (bench/fake_ena.py), 不需要网络
+用法: python -m pytest bench/test_download_engine.py  (或 python -m unittest bench/test_download_engine.py)
+"""
+import os
+import sys
+import glob
+import time
+import asyncio
+import hashlib
+import shutil
+import tempfile
+import threading
+import unittest
+import contextlib
+import io
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import async_download  # noqa: E402
+import download_engine  # noqa: E402
+import range_download  # noqa: E402
+from job_store import JobStore  # noqa: E402
+from manifest import load_manifest  # noqa: E402
+import make_corpus  # noqa: E402
+from fake_ena import FakeENA  # noqa: E402
+
+RUNS = 2
+SINGLE = 1
+READS = 2000
+
+
+def file_md5(path):
+    with open(path, 'rb') as f:
+        return hashlib.md5(f.read()).hexdigest()
+
+
+class DownloadEngineTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.root = tempfile.mkdtemp(prefix='download_engine_')
+        cls.server = FakeENA(cls.root, http_port=0, ftp_port=0).start()
+        corpus = make_corpus.generate(cls.root, runs=RUNS, single=SINGLE, reads=READS, host=cls.server.ftp_host)
+        report = glob.glob(os.path.join(corpus['report_dir'], '*.txt'))[0]
+        cls.manifest = load_manifest(report, use_cache=False)
+        cls.files = {item['file_name']: item for item in corpus['files']}
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+        shutil.rmtree(cls.root, ignore_errors=True)
+
+    def setUp(self):
+        self.work = tempfile.mkdtemp(prefix='download_dest_')
+        self.server.conditions.reset()
+        self.addCleanup(self.restore_conditions)
+        patcher = mock.patch.dict(os.environ, {'SRA_HTTP_HOSTS': self.server.http_hosts()})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.tasks = download_engine.make_tasks(self.manifest.links('fastq_ftp'), self.work,
+                                                sizes=self.manifest.sizes(), probe=False)
+
+    def tearDown(self):
+        shutil.rmtree(self.work, ignore_errors=True)
+
+    def restore_conditions(self):
+        """去掉测试中注入的故障, 不影响后面的测试"""
+        self.server.conditions.drop_rate = 0
+        self.server.conditions.failures.clear()
+
+    def download(self, link):
+        name = os.path.basename(link)
+        return range_download.download_file(download_engine.http_url(link), os.path.join(self.work, name),
+                                            expected_md5=self.files[name]['md5'])
+
+    def run_quiet(self, *args, **kwargs):
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            results = download_engine.run_downloads(*args, **kwargs)
+        return results, out.getvalue()
+
+    def assert_downloaded(self, names):
+        for name in names:
+            self.assertEqual(file_md5(os.path.join(self.work, name)), self.files[name]['md5'])
+
+    def test_tasks_largest_first(self):
+        self.assertEqual(len(self.tasks), len(self.files))
+        sizes = [t['size'] for t in self.tasks]
+        self.assertEqual(sizes, sorted(sizes, reverse=True))
+        self.assertEqual({t['host'] for t in self.tasks}, {download_engine.link_host(self.tasks[0]['link'])})
+
+    def test_downloads_all_files(self):
+        results, out = self.run_quiet(self.tasks, self.download, max_workers=3, max_per_host=3)
+        self.assertEqual(len(results), len(self.files))
+        self.assertTrue(all(r['success'] for r in results))
+        self.assert_downloaded(self.files)
+        self.assertEqual(sum(r['bytes'] for r in results), sum(f['bytes'] for f in self.files.values()))
+        self.assertIn(f"成功: {len(self.files)} | 失败: 0", out)
+
+    def test_per_host_limit(self):
+        lock = threading.Lock()
+        active = [0, 0]  # 当前, 峰值
+
+        def download(link):
+            with lock:
+                active[0] += 1
+                active[1] = max(active)
+            time.sleep(0.1)  # 让任务重叠, 检查同时下载数
+            try:
+                return self.download(link)
+            finally:
+                with lock:
+                    active[0] -= 1
+        results, _ = self.run_quiet(self.tasks, download, max_workers=4, max_per_host=2)
+        self.assertTrue(all(r['success'] for r in results))
+        self.assertEqual(active[1], 2)  # 所有文件在同一主机上, 不超过单主机上限
+
+    def test_failure_is_reported(self):
+        self.server.conditions.fail_next(*[404] * 10)
+        results, out = self.run_quiet(self.tasks[:1], self.download, max_workers=1)
+        self.assertFalse(results[0]['success'])
+        self.assertIn("失败文件列表", out)
+
+    def test_job_store_skips_done_files(self):
+        store = JobStore(os.path.join(self.work, 'jobs.sqlite'))
+        self.addCleanup(store.close)
+        results, _ = self.run_quiet(self.tasks, self.download, max_workers=3, job_store=store)
+        self.assertTrue(all(r['success'] for r in results))
+        requests = self.server.conditions.stats['requests']
+        results, out = self.run_quiet(self.tasks, self.download, max_workers=3, job_store=store)
+        self.assertEqual(results, [])
+        self.assertIn(f"跳过 {len(self.files)} 个已完成的文件", out)
+        self.assertEqual(self.server.conditions.stats['requests'], requests)
+
+    def test_async_ftp_with_drops(self):
+        self.server.conditions.drop_rate = 0.2
+        md5_map = {name: item['md5'] for name, item in self.files.items()}
+        # 中断是随机的, 多给几次重试, 避免测试偶尔失败
+        with mock.patch.object(async_download, 'RETRIES', 10), contextlib.redirect_stdout(io.StringIO()):
+            results = asyncio.run(async_download.download_all(self.tasks, protocol='ftp', md5_map=md5_map,
+                                                              max_concurrency=4, max_per_host=2))
+        self.assertTrue(all(r['success'] for r in results))
+        self.assert_downloaded(self.files)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,172 @@
+"""
+ena_portal.py 的测试, 查询发往本地的 portal API 替身 (bench/fake_ena.py), 不需要网络
+用法: python -m pytest bench/test_ena_portal.py  (或 python -m unittest bench/test_ena_portal.py)
+"""
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import ena_portal  # noqa: E402
+from manifest import load_manifest  # noqa: E402
+from fake_ena import FakeENA, REPORT_DIR  # noqa: E402
+
+# (study, 旧study编号, sample, 旧sample编号, experiment, run)
+RUNS = [
+    ('PRJNA100', 'SRP100', 'SAMN101', 'SRS101', 'SRX101', 'SRR101'),
+    ('PRJNA100', 'SRP100', 'SAMN102', 'SRS102', 'SRX102', 'SRR102'),
+    ('PRJNA100', 'SRP100', 'SAMN102', 'SRS102', 'SRX103', 'SRR103'),
+    ('PRJNA200', 'SRP200', 'SAMN201', 'SRS201', 'SRX201', 'SRR201'),
+    ('PRJNA300', 'SRP300', 'SAMN301', 'SRS301', 'SRX301', 'SRR301'),
+]
+
+
+def write_corpus(root):
+    """在 root/data_report 写出替身服务器查询用的清单"""
+    rows = []
+    for study, srp, sample, srs, experiment, run in RUNS:
+        links = [f"ftp.sra.ebi.ac.uk/vol1/fastq/{run[:6]}/{run}/{run}_{i}.fastq.gz" for i in (1, 2)]
+        rows.append({
+            'study_accession': study, 'secondary_study_accession': srp,
+            'sample_accession': sample, 'secondary_sample_accession': srs,
+            'experiment_accession': experiment, 'run_accession': run, 'library_layout': 'PAIRED',
+            'read_count': '1000', 'fastq_bytes': '100;100', 'fastq_md5': f"{'a' * 32};{'b' * 32}",
+            'fastq_ftp': ";".join(links),
+            'fastq_aspera': ";".join(link.replace('ftp.sra.ebi.ac.uk/', 'fasp.sra.ebi.ac.uk:/')
+                                     for link in links),
+            'sra_ftp': '',
+        })
+    ena_portal.write_report(rows, os.path.join(root, REPORT_DIR), "corpus")
+
+
+class PortalTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.root = tempfile.mkdtemp(prefix='ena_portal_')
+        write_corpus(cls.root)
+        cls.server = FakeENA(cls.root, http_port=0, ftp_port=0).start()
+        cls.url = cls.server.portal_url
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+        shutil.rmtree(cls.root, ignore_errors=True)
+
+    def setUp(self):
+        self.work = tempfile.mkdtemp(prefix='ena_cache_')
+        self.cache_path = os.path.join(self.work, ena_portal.CACHE_FILE)
+        self.server.conditions.reset()
+        self.server.conditions.failures.clear()
+        # 重试的退避等待不计入测试时间
+        patcher = mock.patch.object(ena_portal.time, 'sleep')
+        self.sleep = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.work, ignore_errors=True)
+
+    def portal_requests(self):
+        return self.server.conditions.stats['portal_requests']
+
+    def resolve(self, accessions, **kwargs):
+        kwargs.setdefault('cache_path', self.cache_path)
+        return ena_portal.resolve(accessions, url=self.url, **kwargs)
+
+    def test_parse_accessions(self):
+        self.assertEqual(ena_portal.parse_accessions(["prjna100, SRR101;SRR101", "SRX201\tSAMN301"]),
+                         ['PRJNA100', 'SRR101', 'SRX201', 'SAMN301'])
+        with self.assertRaises(ValueError):
+            ena_portal.accession_field('GSE12345')
+
+    def test_query_batch_splits_per_accession(self):
+        results = ena_portal.query_batch(['PRJNA100', 'SRR102', 'SRS102', 'SRP200', 'SRR999'], url=self.url)
+        runs = {accession: [row['run_accession'] for row in rows] for accession, rows in results.items()}
+        self.assertEqual(runs, {
+            'PRJNA100': ['SRR101', 'SRR102', 'SRR103'],
+            'SRR102': ['SRR102'],  # 同一run同时属于输入的项目和run编号
+            'SRS102': ['SRR102', 'SRR103'],
+            'SRP200': ['SRR201'],
+            'SRR999': [],
+        })
+        self.assertEqual(self.portal_requests(), 1)
+        self.assertEqual(set(results['SRR102'][0]), set(ena_portal.FIELDS))
+
+    def test_resolve_batches_and_deduplicates(self):
+        accessions = ['PRJNA100', 'SRR101', 'SRX103', 'SAMN201', 'SRR301']
+        rows, stats = self.resolve(accessions, batch_size=2)
+        self.assertEqual([row['run_accession'] for row in rows],
+                         ['SRR101', 'SRR102', 'SRR103', 'SRR201', 'SRR301'])
+        self.assertEqual(stats['requests'], 3)
+        self.assertEqual(self.portal_requests(), 3)
+        self.assertEqual((stats['cached'], stats['fetched'], stats['missing']), (0, 5, []))
+
+    def test_cache_ttl_and_refresh(self):
+        accessions = ['PRJNA100', 'SRR201']
+        self.resolve(accessions)
+        self.assertEqual(self.portal_requests(), 1)
+
+        rows, stats = self.resolve(accessions)
+        self.assertEqual(self.portal_requests(), 1)  # 全部命中缓存
+        self.assertEqual((stats['cached'], stats['fetched'], stats['requests']), (2, 0, 0))
+        self.assertEqual(len(rows), 4)
+
+        _, stats = self.resolve(accessions + ['SRR301'])
+        self.assertEqual((stats['cached'], stats['fetched']), (2, 1))  # 只查询新的编号
+        self.assertEqual(self.portal_requests(), 2)
+
+        _, stats = self.resolve(accessions, refresh=True)
+        self.assertEqual((stats['cached'], stats['fetched']), (0, 2))
+        self.assertEqual(self.portal_requests(), 3)
+
+        _, stats = self.resolve(accessions, ttl=0)  # 缓存已过期
+        self.assertEqual((stats['cached'], stats['fetched']), (0, 2))
+        self.assertEqual(self.portal_requests(), 4)
+
+    def test_missing_accessions_are_cached(self):
+        rows, stats = self.resolve(['SRR999', 'SRR101'])
+        self.assertEqual(stats['missing'], ['SRR999'])
+        self.assertEqual(len(rows), 1)
+
+        rows, stats = self.resolve(['SRR999'])
+        self.assertEqual(self.portal_requests(), 1)  # 查不到的编号也不再请求
+        self.assertEqual((stats['cached'], stats['missing'], rows), (1, ['SRR999'], []))
+
+    def test_retries_429_and_5xx(self):
+        self.server.conditions.fail_next(429, 503, 500)
+        rows, stats = self.resolve(['SRR101'], cache_path=None)
+        self.assertEqual([row['run_accession'] for row in rows], ['SRR101'])
+        self.assertEqual(self.server.conditions.stats['errors'], 3)
+        self.assertEqual(self.portal_requests(), 1)
+        self.assertEqual(self.sleep.call_count, 3)
+
+    def test_gives_up_after_retries(self):
+        self.server.conditions.fail_next(*[503] * (ena_portal.RETRIES + 1))
+        with self.assertRaises(RuntimeError):
+            self.resolve(['SRR101'])
+        self.assertEqual(self.server.conditions.stats['errors'], ena_portal.RETRIES + 1)
+        # 失败的批次不写入缓存
+        _, stats = self.resolve(['SRR101'])
+        self.assertEqual((stats['cached'], stats['fetched']), (0, 1))
+
+    def test_client_error_is_not_retried(self):
+        self.server.conditions.fail_next(400)
+        with self.assertRaises(RuntimeError):
+            self.resolve(['SRR101'], cache_path=None)
+        self.assertEqual(self.server.conditions.stats['errors'], 1)
+        self.sleep.assert_not_called()
+
+    def test_report_is_a_manifest(self):
+        rows, _ = self.resolve(['PRJNA100'])
+        path = ena_portal.write_report(rows, self.work, 'PRJNA100')
+        manifest = load_manifest(path, use_cache=False)
+        self.assertEqual(len(manifest.files), 6)
+        self.assertEqual(manifest.md5s()['SRR101_2.fastq.gz'], 'b' * 32)
+
+
+if __name__ == '__main__':
+    unittest.main()
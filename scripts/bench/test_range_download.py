@@ -0,0 +1,120 @@
+"""
+range_download.py 的测试, 下载发往本地的 ENA 替身 (bench/fake_ena.py), 不需要网络
+用法: python -m pytest bench/test_range_download.py  (或 python -m unittest bench/test_range_download.py)
+"""
+import os
+import sys
+import hashlib
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import range_download  # noqa: E402
+from fake_ena import FakeENA  # noqa: E402
+
+FILE_SIZE = 3 * 1024 * 1024
+INTERRUPT_AT = 1024 * 1024  # 第一次下载写入这么多字节后中断
+
+
+class Interrupted(Exception):
+    """模拟进程在分段下载中途被杀掉"""
+
+
+def interrupt_after(limit):
+    """让分段写入在写满 limit 字节后抛出 Interrupted (不经过正常的错误处理, 只留下已保存的状态)"""
+    original = range_download._PositionalWriter.write_at
+    lock = threading.Lock()
+    written = [0]
+
+    def write_at(self, offset, data):
+        with lock:
+            if written[0] >= limit:
+                raise Interrupted()
+            written[0] += len(data)
+        original(self, offset, data)
+    return mock.patch.object(range_download._PositionalWriter, 'write_at', write_at)
+
+
+class SegmentedResumeTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.root = tempfile.mkdtemp(prefix='range_download_')
+        cls.data = os.urandom(FILE_SIZE)
+        cls.md5 = hashlib.md5(cls.data).hexdigest()
+        os.makedirs(os.path.join(cls.root, 'vol1', 'fastq'))
+        with open(os.path.join(cls.root, 'vol1', 'fastq', 'SRR1_1.fastq.gz'), 'wb') as f:
+            f.write(cls.data)
+        cls.server = FakeENA(cls.root, http_port=0, ftp_port=0).start()
+        cls.url = cls.server.http_base + '/vol1/fastq/SRR1_1.fastq.gz'
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+        shutil.rmtree(cls.root, ignore_errors=True)
+
+    def setUp(self):
+        self.work = tempfile.mkdtemp(prefix='range_dest_')
+        self.dest = os.path.join(self.work, 'SRR1_1.fastq.gz')
+        self.server.conditions.reset()
+        for name, value in (('MIN_SEGMENT_SIZE', 256 * 1024), ('CHECKPOINT_BYTES', 64 * 1024),
+                            ('CHUNK_SIZE', 64 * 1024)):
+            patcher = mock.patch.object(range_download, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.work, ignore_errors=True)
+
+    def interrupted_download(self, expected_md5):
+        """分段下载到一半中断: 留下预分配的全长文件和未完成的状态文件"""
+        with interrupt_after(INTERRUPT_AT), self.assertRaises(Interrupted):
+            range_download.download_file(self.url, self.dest, segments=4, expected_md5=expected_md5)
+        self.assertEqual(os.path.getsize(self.dest), FILE_SIZE)
+        self.assertTrue(os.path.exists(range_download.state_path(self.dest)))
+
+    def read_dest(self):
+        with open(self.dest, 'rb') as f:
+            return f.read()
+
+    def resume_after_failed_probe(self, expected_md5):
+        self.interrupted_download(expected_md5)
+        sent = self.server.conditions.stats['bytes']
+        # 探测失败 (如网络暂时出错): 退回单连接续传
+        with mock.patch.object(range_download, 'probe', return_value=(None, False)):
+            ok = range_download.download_file(self.url, self.dest, segments=4, expected_md5=expected_md5)
+        self.assertTrue(ok)
+        self.assertEqual(self.read_dest(), self.data)  # 没有把带空洞的全长文件当作完整
+        self.assertFalse(os.path.exists(range_download.state_path(self.dest)))
+        resent = self.server.conditions.stats['bytes'] - sent
+        self.assertLess(resent, FILE_SIZE)  # 从连续完成的位置续传, 没有删除重下
+
+    def test_resume_without_md5(self):
+        self.resume_after_failed_probe(None)
+
+    def test_resume_with_md5(self):
+        self.resume_after_failed_probe(self.md5)
+
+    def test_segmented_resume(self):
+        self.interrupted_download(self.md5)
+        sent = self.server.conditions.stats['bytes']
+        self.assertTrue(range_download.download_file(self.url, self.dest, segments=4, expected_md5=self.md5))
+        self.assertEqual(self.read_dest(), self.data)
+        self.assertLess(self.server.conditions.stats['bytes'] - sent, FILE_SIZE)
+
+    def test_complete_state_is_kept(self):
+        self.assertTrue(range_download.download_file(self.url, self.dest, segments=4))
+        self.assertTrue(os.path.exists(range_download.state_path(self.dest)))  # 不核对MD5时作为完整的凭据
+        sent = self.server.conditions.stats['bytes']
+        with mock.patch.object(range_download, 'probe', return_value=(None, False)):
+            self.assertTrue(range_download.download_file(self.url, self.dest, segments=4))
+        self.assertEqual(self.server.conditions.stats['bytes'], sent)
+        self.assertEqual(self.read_dest(), self.data)
+
+
+if __name__ == '__main__':
+    unittest.main()
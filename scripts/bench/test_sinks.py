@@ -0,0 +1,134 @@
+"""
+sinks.py 的测试, 从本地的 ENA 替身 (bench/fake_ena.py) 下载并写入本地目录或 S3 替身 (bench/fake_s3.py), 不需要网络
+用法: python -m pytest bench/test_sinks.py  (或 python -m unittest bench/test_sinks.py)
+"""
+import os
+import sys
+import hashlib
+import shutil
+import tempfile
+import unittest
+import contextlib
+import io
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import sinks  # noqa: E402
+from fake_ena import FakeENA  # noqa: E402
+from fake_s3 import FakeS3, UPLOADS_DIR  # noqa: E402
+
+FILE_NAME = 'SRR1_1.fastq.gz'
+FILE_SIZE = 4 * 1024 * 1024
+PART_SIZE = 1024 * 1024  # 每个文件4个分片 (已知大小时分片按1MB取整)
+BUCKET = 'bench'
+PREFIX = 'fastq/'
+
+
+class StreamDownloadTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.root = tempfile.mkdtemp(prefix='sinks_')
+        cls.data = os.urandom(FILE_SIZE)
+        cls.md5 = hashlib.md5(cls.data).hexdigest()
+        os.makedirs(os.path.join(cls.root, 'vol1', 'fastq'))
+        with open(os.path.join(cls.root, 'vol1', 'fastq', FILE_NAME), 'wb') as f:
+            f.write(cls.data)
+        cls.server = FakeENA(cls.root, http_port=0, ftp_port=0).start()
+        cls.url = cls.server.http_base + '/vol1/fastq/' + FILE_NAME
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+        shutil.rmtree(cls.root, ignore_errors=True)
+
+    def setUp(self):
+        self.work = tempfile.mkdtemp(prefix='sinks_dest_')
+        self.server.conditions.reset()
+        self.s3 = FakeS3(os.path.join(self.work, 's3'), port=0, seed=1).start()
+        self.addCleanup(self.s3.stop)
+        patcher = mock.patch.dict(os.environ, self.s3.env())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.work, ignore_errors=True)
+
+    def s3_sink(self):
+        # 一次只上传一个分片, 注入的错误按固定顺序落到各分片上
+        return sinks.S3Sink(BUCKET, PREFIX, part_size=PART_SIZE, concurrency=1)
+
+    def stream(self, sink, expected_md5):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return sinks.stream_download(self.url, sink, FILE_NAME, expected_md5, FILE_SIZE)
+
+    def object_path(self):
+        return os.path.join(self.s3.root, BUCKET, PREFIX + FILE_NAME)
+
+    def read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def pending_uploads(self):
+        return os.listdir(os.path.join(self.s3.root, UPLOADS_DIR))
+
+    def test_open_sink(self):
+        sink = sinks.open_sink('s3://bucket/some/prefix')
+        self.assertIsInstance(sink, sinks.S3Sink)
+        self.assertEqual(sink.describe('a.fastq.gz'), 's3://bucket/some/prefix/a.fastq.gz')
+        self.assertIsInstance(sinks.open_sink(self.work), sinks.LocalSink)
+
+    def test_upload_to_s3(self):
+        self.assertTrue(self.stream(self.s3_sink(), self.md5))
+        self.assertEqual(self.read(self.object_path()), self.data)
+        self.assertEqual(self.s3.stats['parts'], FILE_SIZE // PART_SIZE)
+        self.assertEqual((self.s3.stats['completes'], self.s3.stats['aborts']), (1, 0))
+        # 对象已存在且元数据中的MD5一致: 不再下载
+        requests = self.server.conditions.stats['requests']
+        self.assertTrue(self.stream(self.s3_sink(), self.md5))
+        self.assertEqual(self.server.conditions.stats['requests'], requests)
+        self.assertEqual(self.s3.stats['completes'], 1)
+
+    def test_md5_mismatch_aborts_upload(self):
+        self.assertFalse(self.stream(self.s3_sink(), '0' * 32))
+        self.assertEqual((self.s3.stats['completes'], self.s3.stats['aborts']), (0, 1))
+        self.assertFalse(os.path.exists(self.object_path()))
+        self.assertEqual(self.pending_uploads(), [])
+
+    def test_part_retry_on_503(self):
+        self.s3.error_rate = 0.3
+        self.assertTrue(self.stream(self.s3_sink(), self.md5))
+        self.assertGreater(self.s3.stats['errors'], 0)
+        self.assertEqual(self.s3.stats['parts'], FILE_SIZE // PART_SIZE)
+        self.assertEqual(self.read(self.object_path()), self.data)
+
+    def test_failed_part_aborts_upload(self):
+        self.s3.error_rate = 1.0
+        with mock.patch.object(sinks, 'UPLOAD_RETRIES', 0):
+            self.assertFalse(self.stream(self.s3_sink(), self.md5))
+        self.assertEqual((self.s3.stats['completes'], self.s3.stats['aborts']), (0, 1))
+        self.assertEqual(self.pending_uploads(), [])
+
+    def test_download_retry_after_503(self):
+        self.server.conditions.fail_next(503)
+        self.assertTrue(self.stream(self.s3_sink(), self.md5))
+        self.assertEqual(self.read(self.object_path()), self.data)
+        self.assertEqual(self.s3.stats['completes'], 1)
+
+    def test_local_sink(self):
+        sink = sinks.LocalSink(os.path.join(self.work, 'local'))
+        self.assertTrue(self.stream(sink, self.md5))
+        self.assertEqual(self.read(sink.describe(FILE_NAME)), self.data)
+        requests = self.server.conditions.stats['requests']
+        self.assertTrue(self.stream(sink, self.md5))  # 已存在并校验, 跳过
+        self.assertEqual(self.server.conditions.stats['requests'], requests)
+
+    def test_local_md5_mismatch(self):
+        sink = sinks.LocalSink(os.path.join(self.work, 'local'))
+        self.assertFalse(self.stream(sink, '0' * 32))
+        self.assertFalse(os.path.exists(sink.describe(FILE_NAME)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,193 @@
+"""
+块级修复: MD5不一致时只重新下载损坏的区域, 而不是删除整个文件从头下载
+
+ENA 只提供整文件MD5, 没有分块哈希, 所以坏块只能通过与服务器上的数据比较来确认:
+1. 读取一遍本地文件, 计算每个 BLOCK_SIZE 块的MD5 (保存在 <文件名>.blocks.json, 文件签名不变时复用),
+   同时找出可疑的块: 全零块 (预分配后没写入的空洞)、与服务器大小不符的尾部、gzip解压首次出错位置附近的块
+2. 先用 HTTP Range 取回可疑块, 与本地块哈希比较, 不一致的块原地覆盖, 然后确认整文件MD5;
+   中断/分段写入失败/续传写坏尾部等常见损坏, 只需要传输几个块
+3. 仍不一致时逐块取回其余部分比较替换, 同时计算整文件MD5 (不再额外读取本地文件);
+   最坏情况的流量与重新下载相同, 但只改写坏块
+"""
+import os
+import json
+import hashlib
+import bandwidth
+from md5_cache import file_signature
+from md5_stream import record_md5
+from hash_engine import md5_file
+from fastq_check import FastqValidator
+from range_download import thread_session, probe, TIMEOUT
+from download_engine import http_url
+
+# 配置参数
+BLOCK_SIZE = 8 * 1024 * 1024  # 比较与替换的块大小
+GZIP_LOOKBEHIND = 2  # gzip 解压出错时, 出错块之前再检查几个块 (损坏往往在出错位置之前不远)
+SUFFIX = ".blocks.json"
+
+_ZERO = bytes(BLOCK_SIZE)
+
+
+class RepairError(Exception):
+    """无法进行块级修复 (服务器不支持Range等), 调用方应退回重新下载"""
+
+
+def blocks_path(file_path):
+    return file_path + SUFFIX
+
+
+def scan_local(file_path, block_size=BLOCK_SIZE):
+    """
+    读取本地文件, 计算块哈希并找出可疑块 (结果缓存在旁路文件中)
+    :return: {'blocks': [块MD5], 'md5': 整文件MD5, 'suspects': [块序号]}
+    """
+    signature = list(file_signature(file_path))
+    try:
+        with open(blocks_path(file_path), 'r', encoding='utf-8') as f:
+            cached = json.load(f)
+        if cached['signature'] == signature and cached['block_size'] == block_size:
+            return cached
+    except (OSError, ValueError, KeyError):
+        pass
+
+    whole = hashlib.md5()
+    validator = FastqValidator() if file_path.endswith('.gz') else None
+    blocks, suspects = [], []
+    zero = _ZERO if block_size == BLOCK_SIZE else bytes(block_size)
+    with open(file_path, 'rb') as f:
+        while block := f.read(block_size):
+            index = len(blocks)
+            blocks.append(hashlib.md5(block).hexdigest())
+            whole.update(block)
+            if block == zero[:len(block)]:
+                suspects.append(index)
+            if validator is not None and not validator.error:
+                validator.update(block)
+                if validator.error:
+                    suspects.extend(range(max(0, index - GZIP_LOOKBEHIND), index + 1))
+    if validator is not None and not validator.error:
+        validator.finish()
+        if validator.error and blocks:  # 截断或结尾不完整: 怀疑最后一块
+            suspects.append(len(blocks) - 1)
+
+    result = {'signature': signature, 'block_size': block_size, 'blocks': blocks,
+              'md5': whole.hexdigest(), 'suspects': sorted(set(suspects))}
+    save_blocks(file_path, result)
+    return result
+
+
+def save_blocks(file_path, result):
+    tmp = blocks_path(file_path) + ".tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(result, f)
+    os.replace(tmp, blocks_path(file_path))
+
+
+def fetch_block(session, url, start, length):
+    """用 Range 取回 [start, start+length) 的服务器数据"""
+    headers = {"Range": f"bytes={start}-{start + length - 1}"}
+    response = session.get(url, headers=headers, timeout=TIMEOUT)
+    if response.status_code != 206:
+        raise RepairError(f"服务器未返回分段内容 (HTTP {response.status_code})")
+    data = response.content
+    if len(data) != length:
+        raise RepairError(f"分段长度不符: {len(data)}/{length}")
+    bandwidth.throttle(len(data))
+    return data
+
+
+class _BlockFile:
+    """按块比较、覆盖本地文件并记录流量"""
+
+    def __init__(self, file_path, url, total_size, scan, session):
+        self.file_path = file_path
+        self.url = url
+        self.total_size = total_size
+        self.block_size = scan['block_size']
+        self.blocks = scan['blocks']
+        self.session = session
+        self.fetched = 0
+        self.repaired = 0
+        self.count = -(-total_size // self.block_size)
+
+    def length(self, index):
+        return min(self.block_size, self.total_size - index * self.block_size)
+
+    def check(self, index):
+        """取回一块与本地比较, 不一致时覆盖; 返回服务器数据"""
+        start = index * self.block_size
+        data = fetch_block(self.session, self.url, start, self.length(index))
+        self.fetched += len(data)
+        digest = hashlib.md5(data).hexdigest()
+        local = self.blocks[index] if index < len(self.blocks) else None
+        if digest != local:
+            with open(self.file_path, 'r+b') as f:
+                f.seek(start)
+                f.write(data)
+            if index < len(self.blocks):
+                self.blocks[index] = digest
+            else:
+                self.blocks.extend([None] * (index - len(self.blocks)) + [digest])
+            self.repaired += 1
+        return data
+
+
+def repair(url, file_path, expected_md5, size=None, block_size=BLOCK_SIZE, session=None):
+    """
+    块级修复一个MD5不一致的文件
+    :param url: 清单中的链接 (FTP链接会换成同路径的HTTPS)
+    :param size: 清单中的文件大小, 未知时通过HEAD查询
+    :return: {'ok', 'md5', 'repaired' (替换的块数), 'fetched' (传输字节数)}
+    :raises RepairError: 服务器不支持Range等, 需要退回整文件重新下载
+    """
+    url = http_url(url) if url.startswith('ftp://') or '://' not in url else url
+    session = session or thread_session()
+    total_size, accept_ranges = probe(url, session)
+    if not accept_ranges or not total_size:
+        raise RepairError("服务器不支持Range或无法获取文件大小")
+    if size and size != total_size:
+        raise RepairError(f"服务器文件大小 {total_size} 与清单 {size} 不一致")
+
+    if os.path.getsize(file_path) > total_size:
+        with open(file_path, 'r+b') as f:
+            f.truncate(total_size)
+    scan = scan_local(file_path, block_size)
+    target = _BlockFile(file_path, url, total_size, scan, session)
+    # 本地缺少的尾部 (包括不完整的最后一块) 也是可疑块
+    local_size = os.path.getsize(file_path)
+    missing = range(local_size // target.block_size, target.count) if local_size < total_size else ()
+    suspects = sorted(set(scan['suspects']) | set(missing))
+    suspects = [i for i in suspects if i < target.count]
+
+    # 第一轮: 只比较可疑块
+    for index in suspects:
+        target.check(index)
+    md5 = scan['md5']
+    if target.repaired:
+        md5 = md5_file(file_path)
+    print(f"{os.path.basename(file_path)}: 检查可疑块 {len(suspects)} 个, 替换 {target.repaired} 个")
+
+    # 第二轮: 逐块比较其余部分, 用服务器数据同时计算整文件MD5
+    if md5 != expected_md5:
+        checked = set(suspects)
+        whole = hashlib.md5()
+        with open(file_path, 'rb') as f:
+            for index in range(target.count):
+                if index in checked:
+                    f.seek(index * target.block_size)
+                    whole.update(f.read(target.length(index)))
+                else:
+                    whole.update(target.check(index))
+        md5 = whole.hexdigest()
+
+    scan.update(signature=list(file_signature(file_path)), blocks=target.blocks, md5=md5,
+                suspects=[])
+    save_blocks(file_path, scan)
+    record_md5(file_path, md5)
+    ok = md5 == expected_md5
+    if ok:
+        os.remove(blocks_path(file_path))
+    print(f"{os.path.basename(file_path)}: 块级修复{'成功' if ok else '后MD5仍不一致'}, "
+          f"替换 {target.repaired} 个块, 传输 {target.fetched / 1024 ** 2:.1f} MB "
+          f"(文件 {total_size / 1024 ** 2:.1f} MB)")
+    return {'ok': ok, 'md5': md5, 'repaired': target.repaired, 'fetched': target.fetched}
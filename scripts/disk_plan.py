@@ -0,0 +1,177 @@
+"""
+下载前的磁盘空间规划与预分配
+
+- 按清单/远程查询到的大小 (download_engine.make_tasks, 已缓存) 计算每个待下载文件还需要的空间:
+  文件大小减去本地已分配的块 (已下载的部分和之前预分配的空间都不重复计算)
+- 与下载目录所在卷的剩余空间比较 (保留 RESERVE), 空间不足时开始前就提示, 放不下的文件推迟到下次运行,
+  不会下载几个小时后才发现磁盘满了、留下一堆不完整的文件
+- 给了多个下载目录 (多块盘) 时, 按run分组 (同一run的 _1/_2 放在同一个目录), 优先放回已有部分文件的目录,
+  其余按剩余空间最多的卷分配
+- Linux 上用 fallocate(FALLOC_FL_KEEP_SIZE) 预先分配连续的空间: 文件长度不变 (wget -c / curl -C - 续传不受影响),
+  并发写入多个文件时机械盘上不会产生碎片, 之后的顺序校验 (2.md5check) 更快; 不支持的文件系统 (如WSL的 /mnt/d) 自动跳过
+用法:
+    tasks = make_tasks(...)
+    tasks = disk_plan.prepare(tasks, [download_dir, "/mnt/e/NCBI_ascp/data"])
+"""
+import os
+import sys
+import shutil
+import ctypes
+import ctypes.util
+from collections import defaultdict
+from organizer import parse_name
+
+# 配置参数
+RESERVE = 10 * 1024 ** 3  # 每个卷至少保留的剩余空间
+PREALLOCATE = True  # 下载前预分配空间 (Linux fallocate)
+FALLOC_FL_KEEP_SIZE = 0x01  # linux/falloc.h
+
+_fallocate = None
+_unsupported = set()  # 不支持 fallocate 的设备
+
+
+def allocated_bytes(path):
+    """文件已占用的磁盘空间 (稀疏文件按实际分配的块计算), 不存在时为0"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return 0
+    if hasattr(st, 'st_blocks'):
+        return st.st_blocks * 512
+    return st.st_size
+
+
+def needed_bytes(task):
+    """任务还需要的空间, 大小未知时返回None"""
+    if task['size'] is None:
+        return None
+    return max(task['size'] - allocated_bytes(task['dest_path']), 0)
+
+
+def _run_key(task):
+    parsed = parse_name(task['file_name'])
+    return parsed[0] if parsed else task['file_name']
+
+
+def _gb(size):
+    return f"{size / 1024 ** 3:.1f} GB"
+
+
+def plan(tasks, volumes, reserve=RESERVE):
+    """
+    把任务分配到各下载目录
+    :param volumes: 下载目录列表, 第一个为主目录 (同一设备上的多个目录共用剩余空间)
+    :return: (可以开始的任务, 空间不足推迟的任务); 任务的 dest_path 改为分配到的目录
+    """
+    devices = {}  # 设备 -> 该设备上的第一个目录
+    for directory in volumes:
+        os.makedirs(directory, exist_ok=True)
+        devices.setdefault(os.stat(directory).st_dev, directory)
+    free = {directory: shutil.disk_usage(directory).free - reserve for directory in devices.values()}
+    directory_of = {directory: devices[os.stat(directory).st_dev] for directory in volumes}
+
+    groups = defaultdict(list)  # 保持任务原有的顺序 (大文件优先)
+    for task in tasks:
+        groups[_run_key(task)].append(task)
+
+    accepted, deferred = [], []
+    assigned = defaultdict(lambda: [0, 0])  # 目录 -> [文件数, 字节数]
+    unknown = 0
+    for group in groups.values():
+        # 已有部分文件的目录优先 (续传), 否则按剩余空间从多到少尝试
+        existing = [directory_of[d] for d in volumes for t in group
+                    if os.path.exists(os.path.join(d, t['file_name']))]
+        choices = list(dict.fromkeys(existing + sorted(free, key=free.get, reverse=True)))
+        for task in group:
+            task['dest_path'] = os.path.join(choices[0], task['file_name'])  # 计算已分配的空间
+        need = 0
+        for task in group:
+            size = needed_bytes(task)
+            if size is None:
+                unknown += 1
+            else:
+                need += size
+        target = next((d for d in choices if free[d] >= need), None)
+        if target is None:
+            deferred.extend(group)
+            continue
+        free[target] -= need
+        for task in group:
+            task['dest_path'] = os.path.join(target, task['file_name'])
+            assigned[target][0] += 1
+        assigned[target][1] += need
+        accepted.extend(group)
+
+    for directory in free:
+        count, need = assigned[directory]
+        print(f"磁盘规划 {directory}: {count} 个文件, 还需 {_gb(need)}, "
+              f"剩余 {_gb(free[directory] + need + reserve)} (保留 {_gb(reserve)})")
+    if unknown:
+        print(f"警告: {unknown} 个文件大小未知, 未计入空间规划")
+    if deferred:
+        total = sum(t['size'] or 0 for t in deferred)
+        print(f"警告: 空间不足, 推迟 {len(deferred)} 个文件 (共 {_gb(total)}), 腾出空间或增加下载目录后重新运行:")
+        for task in deferred:
+            print(f" - {task['file_name']}")
+    return accepted, deferred
+
+
+def _load_fallocate():
+    global _fallocate
+    if _fallocate is None:
+        _fallocate = False
+        if sys.platform.startswith('linux'):
+            try:
+                libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+                libc.fallocate.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_int64, ctypes.c_int64]
+                _fallocate = libc.fallocate
+            except (OSError, AttributeError):
+                pass
+    return _fallocate
+
+
+def preallocate(path, size):
+    """
+    预分配 size 字节但不改变文件长度 (FALLOC_FL_KEEP_SIZE)
+    :return: 是否分配成功 (不支持的平台/文件系统返回False)
+    """
+    fallocate = _load_fallocate()
+    directory = os.path.dirname(path) or '.'
+    device = os.stat(directory).st_dev
+    if not fallocate or device in _unsupported or allocated_bytes(path) >= size:
+        return False
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT, 0o644)
+    try:
+        if fallocate(fd, FALLOC_FL_KEEP_SIZE, 0, size) == 0:
+            return True
+    finally:
+        os.close(fd)
+    _unsupported.add(device)  # EOPNOTSUPP 等, 该设备上不再尝试
+    if os.path.getsize(path) == 0:
+        os.remove(path)
+    return False
+
+
+def prepare(tasks, volumes, reserve=RESERVE, allocate=PREALLOCATE, job_store=None):
+    """
+    下载前的规划: 分配目录、检查空间, 并预分配可以开始的文件
+    :param job_store: 任务状态库, 已完成 (含已整理到其他目录) 的文件不参与规划
+    :return: 可以开始的任务 (空间不足的任务已去掉, 顺序不变)
+    """
+    done = [t for t in tasks if job_store is not None and job_store.is_done(t['file_name'])]
+    done_names = {t['file_name'] for t in done}
+    recorded = job_store.locations(volumes[0], done_names) if done else {}
+    for task in done:  # 已完成的文件留在上次分配的目录
+        task['dest_path'] = recorded[task['file_name']]
+    accepted, _ = plan([t for t in tasks if t['file_name'] not in done_names], volumes, reserve)
+    if allocate:
+        count = total = 0
+        for task in accepted:
+            need = needed_bytes(task)
+            if need and preallocate(task['dest_path'], task['size']):
+                count += 1
+                total += need
+        if count:
+            print(f"预分配 {count} 个文件 ({_gb(total)})")
+    keep = done_names | {t['file_name'] for t in accepted}
+    return [t for t in tasks if t['file_name'] in keep]
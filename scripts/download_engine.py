@@ -0,0 +1,340 @@
+"""
+并发下载调度引擎 (供所有 1.download_* 脚本共用)
+
+- 有界线程池: 全局同时下载的文件数由 MAX_WORKERS 控制
+- 按主机限流: ftp.sra.ebi.ac.uk / fasp.sra.ebi.ac.uk 各自最多 MAX_PER_HOST 个
+- 大文件优先: 避免最后只剩一个大的 R2 文件单独下载拖尾
+- 远程查询到的文件大小缓存在下载目录的 remote_sizes.json 中, 重新运行时不再查询
+- 剩余文件数告知看门狗 (transfer_watch), 最后几个文件中明显偏慢的连接会被重新发起
+- 结束时汇总总字节数与聚合吞吐; 运行中的进度、队列与吞吐由 metrics 定期汇总输出
+- 传入 job_store 时记录每个文件的状态, 重新运行时跳过已完成的文件
+"""
+import os
+import json
+import time
+import ftplib
+import urllib.request
+from collections import Counter
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import metrics
+import transfer_watch
+from job_store import DOWNLOADING, DOWNLOADED, FAILED
+
+# 配置参数
+MAX_WORKERS = 8  # 全局同时下载的文件数
+MAX_PER_HOST = 4  # 单个主机同时下载的文件数
+PROBE_WORKERS = 16  # 查询文件大小的并发数
+PROBE_TIMEOUT = 30  # 查询文件大小的超时(秒)
+SIZE_CACHE_FILE = "remote_sizes.json"  # 远程文件大小缓存 (位于下载目录)
+SIZE_CACHE_TTL = 30 * 24 * 3600  # 缓存有效期(秒), ENA的文件发布后不会改变
+
+# Aspera 主机与同路径 FTP 主机的对应关系 (用于查询文件大小)
+ASPERA_FTP_MIRRORS = {
+    'fasp.sra.ebi.ac.uk': 'ftp.sra.ebi.ac.uk',
+}
+# FTP 主机 -> 提供同路径HTTP(S)访问的地址前缀, 未列出的主机使用 https://<主机>
+# 也可用环境变量 SRA_HTTP_HOSTS="主机=前缀,..." 指定 (如 bench/fake_ena.py 等本地测试服务器)
+HTTP_HOSTS = {}
+
+
+def split_links(links):
+    """把Excel中以;拼接的链接拆分为单个链接列表"""
+    result = []
+    for link in links:
+        for sublink in str(link).split(';'):
+            sublink = sublink.strip()
+            if sublink:  # 确保不是空字符串
+                result.append(sublink)
+    return result
+
+
+def link_host(link):
+    """
+    提取链接的主机 (兼容 ftp.sra.ebi.ac.uk/... 与 fasp.sra.ebi.ac.uk:/... 两种写法)
+    带端口的本地测试地址会保留端口, 以便区分不同的服务
+    """
+    if '://' in link:
+        return urlparse(link).netloc
+    return link.split('/')[0].split(':')[0]
+
+
+def parse_hosts(text):
+    """"主机=前缀,主机=前缀" -> 字典"""
+    return dict(item.strip().split('=', 1) for item in (text or '').split(',') if '=' in item)
+
+
+def http_url(link):
+    """把清单中的FTP链接转换为HTTPS链接 (ENA的FTP目录同时提供HTTPS访问)"""
+    link = link.split('://', 1)[-1]
+    host, _, path = link.partition('/')
+    base = HTTP_HOSTS.get(host) or parse_hosts(os.environ.get('SRA_HTTP_HOSTS')).get(host)
+    if base:
+        return f"{base.rstrip('/')}/{path}"
+    return "https://" + link
+
+
+def probe_url(link):
+    """把清单中的链接转换为可查询大小的URL (Aspera链接映射到同路径FTP)"""
+    if '://' in link:
+        return link
+    if ':/' in link:
+        host, path = link.split(':', 1)
+        host = ASPERA_FTP_MIRRORS.get(host, host)
+        return f"ftp://{host}{path}"
+    return "ftp://" + link
+
+
+def probe_size(link, timeout=PROBE_TIMEOUT):
+    """查询远程文件大小 (FTP使用SIZE命令, HTTP使用HEAD请求), 失败返回None"""
+    url = probe_url(link)
+    parsed = urlparse(url)
+    try:
+        if parsed.scheme == 'ftp':
+            with ftplib.FTP(timeout=timeout) as ftp:
+                ftp.connect(parsed.hostname, parsed.port or 21)
+                ftp.login()
+                ftp.voidcmd('TYPE I')
+                return ftp.size(parsed.path)
+        request = urllib.request.Request(url, method='HEAD')
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            length = response.headers.get('Content-Length')
+            return int(length) if length is not None else None
+    except (OSError, ftplib.Error, ValueError):
+        return None
+
+
+def load_size_cache(cache_path):
+    """读取远程文件大小缓存, 返回 链接 -> 字节数 (过期的条目忽略)"""
+    try:
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            entries = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    now = time.time()
+    return {link: size for link, (size, checked) in entries.items() if now - checked < SIZE_CACHE_TTL}
+
+
+def save_size_cache(cache_path, sizes):
+    """把新查询到的 链接 -> 字节数 合并写入缓存"""
+    try:
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            entries = json.load(f)
+    except (OSError, ValueError):
+        entries = {}
+    now = time.time()
+    entries.update({link: [size, now] for link, size in sizes.items()})
+    tmp = cache_path + ".tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(entries, f)
+    os.replace(tmp, cache_path)
+
+
+def make_tasks(links, download_dir, sizes=None, probe=True):
+    """
+    构建下载任务列表并按文件大小从大到小排序
+    :param links: 清单中的链接 (可包含;拼接的多个链接)
+    :param download_dir: 下载目录
+    :param sizes: 已知的 文件名->字节数 映射 (如 Manifest.sizes() 的结果)
+    :param probe: 是否远程查询未知文件的大小 (结果缓存在下载目录的 SIZE_CACHE_FILE 中)
+    """
+    sizes = sizes or {}
+    tasks = []
+    for link in split_links(links):
+        file_name = link.split('/')[-1]
+        tasks.append({
+            'link': link,
+            'file_name': file_name,
+            'dest_path': os.path.join(download_dir, file_name),
+            'host': link_host(link),
+            'size': sizes.get(file_name),
+        })
+
+    unknown = [t for t in tasks if t['size'] is None]
+    if probe and unknown:
+        cache_path = os.path.join(download_dir, SIZE_CACHE_FILE)
+        cached = load_size_cache(cache_path)
+        for task in unknown:
+            task['size'] = cached.get(task['link'])
+        unknown = [t for t in unknown if t['size'] is None]
+    if probe and unknown:
+        print(f"正在查询 {len(unknown)} 个文件的大小...")
+        probed = {}
+        with ThreadPoolExecutor(max_workers=PROBE_WORKERS) as executor:
+            for task, size in zip(unknown, executor.map(lambda t: probe_size(t['link']), unknown)):
+                task['size'] = size
+                if size is not None:
+                    probed[task['link']] = size
+        if probed:
+            save_size_cache(cache_path, probed)
+
+    # 大文件优先, 大小未知的排在最后
+    tasks.sort(key=lambda t: -1 if t['size'] is None else t['size'], reverse=True)
+    return tasks
+
+
+def _local_size(path):
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+
+def _run_task(task, download_func, job_store=None):
+    """执行单个任务并记录耗时与本次传输的字节数"""
+    if job_store is not None:
+        job_store.transition(task['file_name'], DOWNLOADING)
+    before = _local_size(task['dest_path'])
+    metrics.start(task['file_name'], total=task['size'], done=before)
+    start = time.time()
+    error = None
+    try:
+        success = bool(download_func(task['link']))
+    except Exception as e:
+        success = False
+        error = str(e)
+    # 租约被其他节点接手时传输已被取消 (transfer_watch.Cancelled), 不记为失败
+    lost = transfer_watch.is_cancelled(task['file_name'])
+    streamed = metrics.progress(task['file_name']) or 0
+    metrics.finish(task['file_name'], success, error)
+    result = {
+        'file_name': task['file_name'],
+        'link': task['link'],
+        'success': success,
+        # 不落地的下载 (sinks.S3Sink) 按流过的字节数计
+        'bytes': max(_local_size(task['dest_path']) - before, 0) or max(streamed - before, 0),
+        'seconds': time.time() - start,
+        'error': error,
+        'lost': lost,
+    }
+    if job_store is not None and not lost:
+        job_store.transition(task['file_name'], DOWNLOADED if success else FAILED,
+                             record_signature=success,
+                             bytes_done=_local_size(task['dest_path']),
+                             download_seconds=result['seconds'],
+                             error=None if success else (error or "下载失败"))
+    return result
+
+
+def run_downloads(tasks, download_func, max_workers=MAX_WORKERS, max_per_host=MAX_PER_HOST,
+                  job_store=None, on_done=None, concurrency=None, leases=None):
+    """
+    并发执行下载任务
+    :param tasks: make_tasks 返回的任务列表 (按优先级排序)
+    :param download_func: 单文件下载函数, 参数为链接, 返回是否成功
+    :param job_store: 任务状态库 (job_store.JobStore), 记录每个文件的状态并跳过已完成的文件
+    :param on_done: 每个文件结束时在调度线程中调用 on_done(task, result), 如把文件交给校验阶段
+    :param concurrency: 自适应并发控制 (bandwidth.adaptive), 同时下载的文件数在 1..max_workers 之间自动调整
+    :param leases: 多节点共享下载目录时的租约 (leases.LeaseStore), 每个文件开始前认领,
+                   其他节点正在下载的文件稍后再看, 已完成的跳过
+    :return: 每个文件的结果列表
+    """
+    if job_store is not None:
+        tasks = resume_tasks(tasks, job_store)
+    pending = list(tasks)
+    waiting = []  # 其他节点正在下载的文件
+    running = {}
+    host_running = Counter()
+    results = []
+    skipped = 0  # 其他节点已完成的文件
+    start_time = time.time()
+    next_poll = 0
+    plan_metrics(tasks)
+    metrics.gauge('download_pending', lambda: len(pending))
+    metrics.gauge('download_running', lambda: len(running))
+    if leases is not None:
+        metrics.gauge('download_waiting', lambda: len(waiting))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running or waiting:
+            # 本节点没有其他任务时, 定期重新认领其他节点持有的文件 (完成的跳过, 崩溃的接手)
+            if waiting and not pending and time.time() >= next_poll:
+                pending, waiting = waiting, []
+                next_poll = time.time() + leases.poll_interval
+
+            # 按优先级填满空闲槽位, 跳过已达到并发上限的主机
+            limit = concurrency.limit() if concurrency is not None else max_workers
+            i = 0
+            while len(running) < limit and i < len(pending):
+                task = pending[i]
+                if host_running[task['host']] < max_per_host:
+                    pending.pop(i)
+                    if leases is not None:
+                        claimed = leases.acquire(task['file_name'], task['dest_path'])
+                        if claimed is None:
+                            waiting.append(task)
+                        elif not claimed:
+                            skipped += 1
+                            print(f"[{len(results) + skipped}/{len(tasks)}] 其他节点已完成: {task['file_name']}")
+                        if not claimed:
+                            continue
+                    host_running[task['host']] += 1
+                    running[executor.submit(_run_task, task, download_func, job_store)] = task
+                else:
+                    i += 1
+
+            transfer_watch.set_remaining(len(pending) + len(running) + len(waiting))
+            if not running:
+                if waiting and not pending:
+                    print(f"等待其他节点: {len(waiting)} 个文件")
+                    time.sleep(max(next_poll - time.time(), 0))
+                continue
+
+            # 自适应模式 / 等待其他节点时定期醒来, 并发上限提高时及时派发
+            done, _ = wait(running, timeout=1 if concurrency is not None or waiting else None,
+                           return_when=FIRST_COMPLETED)
+            for future in done:
+                task = running.pop(future)
+                host_running[task['host']] -= 1
+                result = future.result()
+                if result['lost']:
+                    # 对方完成则跳过, 对方崩溃则再接手
+                    print(f"租约已被其他节点接手, 停止: {result['file_name']}")
+                    waiting.append(task)
+                    continue
+                results.append(result)
+                if leases is not None:
+                    leases.release(task['file_name'], done=result['success'], path=task['dest_path'])
+                if concurrency is not None:
+                    concurrency.record(result['success'])
+                status = "完成" if result['success'] else "失败"
+                print(f"[{len(results) + skipped}/{len(tasks)}] {status}: {result['file_name']}")
+                if on_done is not None:
+                    on_done(task, result)
+
+    metrics.flush()
+    print_summary(results, time.time() - start_time)
+    if leases is not None:
+        print(leases.summary_line())
+    return results
+
+
+def plan_metrics(tasks):
+    """登记本次需要下载的文件数和剩余字节数 (用于整体ETA)"""
+    remaining = sum(max((t['size'] or 0) - _local_size(t['dest_path']), 0) for t in tasks)
+    metrics.plan('download', len(tasks), remaining)
+
+
+def resume_tasks(tasks, job_store):
+    """登记任务, 恢复上次中断的下载, 去掉已经下载完成 (或已校验/整理) 的文件"""
+    job_store.add([{'file_name': t['file_name'], 'url': t['link'], 'dest_path': t['dest_path'],
+                    'size': t['size']} for t in tasks])
+    recovered = job_store.recover()
+    if recovered:
+        print(f"恢复 {recovered} 个上次中断的下载")
+    remaining = [t for t in tasks if not job_store.is_done(t['file_name'])]
+    if len(remaining) < len(tasks):
+        print(f"跳过 {len(tasks) - len(remaining)} 个已完成的文件")
+    return remaining
+
+
+def print_summary(results, elapsed):
+    """输出下载汇总与聚合吞吐"""
+    ok = sum(1 for r in results if r['success'])
+    total_bytes = sum(r['bytes'] for r in results)
+    rate = total_bytes / elapsed / 1024 ** 2 if elapsed > 0 else 0.0
+    print(f"\n下载结束! 耗时: {elapsed:.2f}秒")
+    print(f"总计: {len(results)} 个文件 | 成功: {ok} | 失败: {len(results) - ok}")
+    print(f"传输: {total_bytes / 1024 ** 3:.2f} GB | 聚合吞吐: {rate:.2f} MB/s")
+    failed = [r for r in results if not r['success']]
+    if failed:
+        print("\n失败文件列表:")
+        for r in failed:
+            print(f" - {r['file_name']}" + (f" ({r['error']})" if r['error'] else ""))
@@ -0,0 +1,226 @@
+"""
+从编号直接查询 ENA 的文件清单 (代替在ENA网页上手工导出 filereport tsv)
+
+支持 study (PRJNA/PRJEB/PRJDB, SRP/ERP/DRP)、sample (SAMN/SAMEA/SAMD, SRS/ERS/DRS)、
+experiment (SRX/ERX/DRX) 和 run (SRR/ERR/DRR) 编号, 混合输入也可以:
+- 每 BATCH_SIZE 个编号合并成一个 portal API 查询 (POST /search, result=read_run,
+  query=run_accession="SRR1" OR study_accession="PRJNA2" ...), MAX_CONCURRENCY 个请求并发
+- 每个编号的查询结果缓存在 SQLite (默认在清单目录的 ena_cache.sqlite3), CACHE_TTL 内不再请求;
+  查不到结果的编号也缓存 (避免反复查询写错的编号)
+- 429/5xx/网络错误按指数退避重试
+- 结果写成与网页导出相同列的 filereport_read_run_<编号>_tsv.txt, manifest.load_manifest 直接读取
+portal 地址可用环境变量 ENA_PORTAL_URL 改为本地替身 (bench/fake_ena.py 同时提供 /ena/portal/api)
+用法:
+    rows, stats = resolve(["PRJNA889248", "SRX17918111"], cache_path)
+    write_report(rows, report_dir, "PRJNA889248")
+"""
+import os
+import re
+import json
+import time
+import sqlite3
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from md5_cache import journal_mode
+
+# 配置参数
+PORTAL_URL = "https://www.ebi.ac.uk/ena/portal/api"
+BATCH_SIZE = 100  # 每个查询合并的编号数
+MAX_CONCURRENCY = 4  # 同时进行的查询数 (ENA 限制每秒约50个请求)
+CACHE_FILE = "ena_cache.sqlite3"  # 默认放在清单目录中
+CACHE_TTL = 7 * 24 * 3600  # 缓存有效期 (秒)
+TIMEOUT = 120  # 单个查询的超时 (秒), 大项目的结果可能有几万行
+RETRIES = 4
+# 清单的列 (与网页导出时勾选的列一致)
+FIELDS = ('study_accession', 'secondary_study_accession', 'sample_accession',
+          'secondary_sample_accession', 'experiment_accession', 'run_accession', 'library_layout',
+          'read_count', 'fastq_bytes', 'fastq_md5', 'fastq_ftp', 'fastq_aspera', 'sra_ftp')
+# 编号格式 -> 查询字段
+ACCESSION_TYPES = (
+    (re.compile(r'PRJ[EDN][A-Z]\d+$'), 'study_accession'),
+    (re.compile(r'[SED]RP\d+$'), 'secondary_study_accession'),
+    (re.compile(r'SAM(N|EA|D)\d+$'), 'sample_accession'),
+    (re.compile(r'[SED]RS\d+$'), 'secondary_sample_accession'),
+    (re.compile(r'[SED]RX\d+$'), 'experiment_accession'),
+    (re.compile(r'[SED]RR\d+$'), 'run_accession'),
+)
+
+
+def portal_url():
+    return os.environ.get('ENA_PORTAL_URL') or PORTAL_URL
+
+
+def default_cache_path(report_dir):
+    return os.path.join(report_dir, CACHE_FILE)
+
+
+def accession_field(accession):
+    """编号对应的查询字段, 无法识别时抛出 ValueError"""
+    for pattern, field in ACCESSION_TYPES:
+        if pattern.match(accession):
+            return field
+    raise ValueError(f"无法识别的编号: {accession}")
+
+
+def parse_accessions(values):
+    """拆分逗号/空白分隔的编号, 去重并保持顺序; '@文件' 从文件读取 (每行一个或多个, # 开头为注释)"""
+    accessions = []
+    for value in values:
+        if value.startswith('@'):
+            with open(value[1:], 'r', encoding='utf-8') as f:
+                value = " ".join(line.split('#', 1)[0] for line in f)
+        accessions += re.split(r'[\s,;]+', value.strip().upper())
+    return list(dict.fromkeys(a for a in accessions if a))
+
+
+class PortalCache:
+    """编号 -> 查询结果 的磁盘缓存 (SQLite), 线程安全"""
+
+    def __init__(self, db_path, ttl=CACHE_TTL):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, timeout=60, check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.execute(f"PRAGMA journal_mode={journal_mode(db_path)}")
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS portal_cache (
+                    accession TEXT PRIMARY KEY,
+                    fields TEXT NOT NULL,
+                    fetched_at REAL NOT NULL,
+                    rows TEXT NOT NULL
+                )""")
+
+    def get_many(self, accessions, fields):
+        """返回 编号 -> 行列表, 只包含未过期且包含所需列的缓存"""
+        found = {}
+        now = time.time()
+        with self.lock:
+            for accession in accessions:
+                row = self.conn.execute(
+                    "SELECT fields, fetched_at, rows FROM portal_cache WHERE accession = ?",
+                    (accession,)).fetchone()
+                if row and now - row[1] <= self.ttl and set(fields) <= set(json.loads(row[0])):
+                    found[accession] = json.loads(row[2])
+        return found
+
+    def put_many(self, results, fields):
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO portal_cache (accession, fields, fetched_at, rows) VALUES (?, ?, ?, ?)",
+                [(accession, json.dumps(list(fields)), now, json.dumps(rows))
+                 for accession, rows in results.items()])
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+def _post(url, params, timeout=TIMEOUT, retries=RETRIES):
+    """POST 表单并返回文本, 429/5xx/网络错误时退避重试"""
+    data = urllib.parse.urlencode(params).encode()
+    for attempt in range(retries + 1):
+        request = urllib.request.Request(url, data=data, headers={
+            'Content-Type': 'application/x-www-form-urlencoded'})
+        try:
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                return response.read().decode('utf-8')
+        except urllib.error.HTTPError as e:
+            if e.code != 429 and e.code < 500 or attempt == retries:
+                detail = e.read().decode('utf-8', 'replace')[:200]
+                raise RuntimeError(f"ENA portal 返回 {e.code}: {detail}") from e
+        except (urllib.error.URLError, OSError) as e:
+            if attempt == retries:
+                raise RuntimeError(f"无法访问 ENA portal: {e}") from e
+        time.sleep(min(2 ** attempt, 30))
+
+
+def query_batch(accessions, fields=FIELDS, url=None):
+    """
+    一次查询多个编号
+    :return: 编号 -> 行列表 (每行为 列名 -> 字符串); 没有结果的编号对应空列表
+    """
+    by_field = {accession: accession_field(accession) for accession in accessions}
+    request_fields = list(dict.fromkeys(list(fields) + list(by_field.values())))
+    query = " OR ".join(f'{field}="{accession}"' for accession, field in by_field.items())
+    text = _post((url or portal_url()).rstrip('/') + "/search", {
+        'result': 'read_run', 'query': query, 'fields': ",".join(request_fields),
+        'format': 'tsv', 'limit': 0})
+    lines = [line for line in text.split('\n') if line.strip()]
+    results = {accession: [] for accession in accessions}
+    if not lines:
+        return results
+    header = lines[0].rstrip('\r').split('\t')
+    for line in lines[1:]:
+        values = dict(zip(header, line.rstrip('\r').split('\t')))
+        row = {field: values.get(field, '').strip() for field in fields}
+        # 结果按各自匹配的编号分开缓存 (同一run可能同时属于输入的项目和run编号)
+        for accession, field in by_field.items():
+            if values.get(field, '').strip().upper() == accession:
+                results[accession].append(row)
+    return results
+
+
+def resolve(accessions, cache_path=None, fields=FIELDS, ttl=CACHE_TTL, refresh=False,
+            batch_size=BATCH_SIZE, max_concurrency=MAX_CONCURRENCY, url=None):
+    """
+    查询一组编号对应的全部 run
+    :param cache_path: 缓存库路径, None 时不缓存
+    :param refresh: 忽略缓存重新查询 (结果仍写入缓存)
+    :return: (按输入顺序去重后的run行列表, 统计 {'cached', 'fetched', 'requests', 'missing'})
+    """
+    for accession in accessions:
+        accession_field(accession)  # 先检查格式, 写错的编号不发请求
+    cache = PortalCache(cache_path, ttl) if cache_path else None
+    found = cache.get_many(accessions, fields) if cache is not None and not refresh else {}
+    misses = [a for a in accessions if a not in found]
+    stats = {'cached': len(found), 'fetched': len(misses), 'requests': 0, 'missing': []}
+    batches = [misses[i:i + batch_size] for i in range(0, len(misses), batch_size)]
+    try:
+        if batches:
+            print(f"查询 ENA: {len(misses)} 个编号, {len(batches)} 个请求 (缓存命中 {len(found)})")
+            with ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(batches)))) as executor:
+                futures = [executor.submit(query_batch, batch, fields, url) for batch in batches]
+                for future in as_completed(futures):
+                    results = future.result()
+                    stats['requests'] += 1
+                    found.update(results)
+                    if cache is not None:
+                        cache.put_many(results, fields)  # 每完成一个请求就写入, 中断后已查的不用重查
+    finally:
+        if cache is not None:
+            cache.close()
+
+    rows = []
+    seen = set()
+    for accession in accessions:
+        if not found.get(accession):
+            stats['missing'].append(accession)
+            continue
+        for row in found[accession]:
+            run = row.get('run_accession')
+            if run in seen:
+                continue
+            seen.add(run)
+            rows.append(row)
+    return rows, stats
+
+
+def report_path(report_dir, name):
+    return os.path.join(report_dir, f"filereport_read_run_{name}_tsv.txt")
+
+
+def write_report(rows, report_dir, name, fields=FIELDS):
+    """写出与ENA网页导出相同格式的清单 (manifest.TSV_PATTERN), 返回文件路径"""
+    os.makedirs(report_dir, exist_ok=True)
+    path = report_path(report_dir, name)
+    tmp = path + ".tmp"
+    with open(tmp, 'w', encoding='utf-8', newline='') as f:
+        f.write("\t".join(fields) + "\n")
+        for row in rows:
+            f.write("\t".join(row.get(field, '') for field in fields) + "\n")
+    os.replace(tmp, path)
+    return path
@@ -0,0 +1,137 @@
+"""
+fastq.gz 流式完整性校验
+
+MD5只能说明文件与ENA一致, 无法发现ENA上本身就被截断的上传; 这里边解压边检查:
+- gzip 多成员 (multi-member) 文件逐个成员解压, 检查最后一个成员是否完整
+- FASTQ 记录格式: 每4行一条, 第1行以@开头, 第3行以+开头, 序列与质量长度相同
+- 统计 reads 数, 供 R1/R2 配对检查
+内存占用与读取块大小成正比, 不随文件大小增长。
+有 python-isal 或 zlib-ng 时自动使用更快的解压实现 (pip install isal / zlib-ng)
+"""
+import re
+import zlib
+
+try:
+    from isal import isal_zlib as zlib_backend
+except ImportError:
+    try:
+        from zlib_ng import zlib_ng as zlib_backend
+    except ImportError:
+        zlib_backend = zlib
+
+GZIP_WBITS = 31  # 只接受gzip格式
+FEED_SIZE = 1024 * 1024  # 每次送入解压器的数据量 (限制多成员文件在成员边界处的 unused_data 复制)
+PAIR_PATTERN = re.compile(r'^([SED]RR\d+)_([12])\.fastq\.gz$')  # 与 3.data_organize.py 的配对规则一致
+
+
+class FastqValidator:
+    """
+    以压缩数据块为输入的流式校验器, 接口与 hashlib 对象相同 (update),
+    可以和MD5共用同一次文件读取
+    """
+
+    def __init__(self):
+        self.decompressor = None
+        self.at_boundary = True  # 处于两个gzip成员之间 (包括文件开头)
+        self.members = 0
+        self.reads = 0
+        self.lines = 0
+        self.tail = b''  # 上一块末尾不完整的行
+        self.pending = []  # 上一块末尾不足一条记录的行
+        self.error = None
+
+    def update(self, data):
+        if self.error:
+            return
+        try:
+            self._parse(self._decompress(data))
+        except Exception as e:  # zlib.error; isal / zlib-ng 的异常类型不同
+            self.error = f"gzip数据损坏: {e}"
+
+    def _decompress(self, data):
+        """解压一块数据, 遇到成员结尾时继续解压下一个成员"""
+        parts = []
+        view = memoryview(data)
+        for start in range(0, len(view), FEED_SIZE):
+            piece = view[start:start + FEED_SIZE]
+            while piece:
+                if self.at_boundary:
+                    if piece[0] == 0:  # 文件末尾的填充零
+                        if bytes(piece).strip(b'\x00'):
+                            raise ValueError("gzip成员之间有无法识别的数据")
+                        break
+                    self.decompressor = zlib_backend.decompressobj(GZIP_WBITS)
+                    self.at_boundary = False
+                parts.append(self.decompressor.decompress(piece))
+                if not self.decompressor.eof:
+                    break
+                self.members += 1
+                self.at_boundary = True
+                piece = self.decompressor.unused_data
+        view.release()
+        return b''.join(parts)
+
+    def _parse(self, text):
+        if not text:
+            return
+        lines = (self.tail + text).split(b'\n')
+        self.tail = lines.pop()
+        if self.pending:
+            lines = self.pending + lines
+        complete = len(lines) - len(lines) % 4
+        self._check_records(lines[:complete])
+        self.pending = lines[complete:]
+
+    def _check_records(self, records):
+        if not records:
+            return
+        headers, seqs, pluses, quals = records[0::4], records[1::4], records[2::4], records[3::4]
+        ok = (all(h[:1] == b'@' for h in headers)
+              and all(p[:1] == b'+' for p in pluses)
+              and list(map(len, seqs)) == list(map(len, quals)))
+        if not ok:
+            for i, (h, s, p, q) in enumerate(zip(headers, seqs, pluses, quals)):
+                if h[:1] != b'@' or p[:1] != b'+' or len(s) != len(q):
+                    line = self.lines + i * 4 + 1
+                    self.error = f"第{self.reads + i + 1}条记录格式错误 (第{line}行附近): {h[:60]!r}"
+                    return
+        self.reads += len(headers)
+        self.lines += len(records)
+
+    def finish(self):
+        """
+        结束校验
+        :return: (reads数, 错误信息或None)
+        """
+        if not self.error:
+            if not self.at_boundary:
+                self.error = "gzip数据被截断 (最后一个成员不完整)"
+            elif self.members == 0:
+                self.error = "文件为空"
+            elif self.tail:
+                self.pending.append(self.tail)  # 最后一行没有换行符
+                self.tail = b''
+            if not self.error and self.pending:
+                if len(self.pending) == 4:
+                    self._check_records(self.pending)
+                else:
+                    self.error = f"文件结尾的记录不完整 ({len(self.pending)}行)"
+        return self.reads, self.error
+
+
+def check_pairs(read_counts):
+    """
+    检查 R1/R2 的 reads 数是否一致
+    :param read_counts: 文件名 -> reads数
+    :return: 不一致的配对列表 [(run, r1_reads, r2_reads)] (只比较两端都已校验的配对)
+    """
+    pairs = {}
+    for file_name, reads in read_counts.items():
+        match = PAIR_PATTERN.match(file_name)
+        if match:
+            pairs.setdefault(match.group(1), {})[match.group(2)] = reads
+    mismatched = []
+    for run, mates in sorted(pairs.items()):
+        if '1' in mates and '2' in mates and mates['1'] != mates['2']:
+            mismatched.append((run, mates.get('1'), mates.get('2')))
+    return mismatched
@@ -0,0 +1,132 @@
+"""
+按块设备调度的并发读取 (MD5校验用)
+
+把文件按所在块设备 (st_dev) 分组, 每个设备限制同时读取的文件数:
+机械盘 1-2 个 (避免磁头来回寻道), SSD/NVMe 可以多个;
+设备类型从 /sys/block/*/queue/rotational 自动识别, 各设备之间并行
+"""
+import os
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+# 配置参数
+HDD_READERS = 1  # 机械盘同时读取的文件数
+SSD_READERS = os.cpu_count() or 4  # SSD/NVMe 同时读取的文件数
+UNKNOWN_READERS = 2  # 无法识别类型的设备 (如 Windows、网络文件系统)
+MAX_WORKERS = os.cpu_count() or 4  # 进程总数上限
+POLL_INTERVAL = 15  # claim 返回 None (其他节点正在处理) 的任务重新尝试的间隔 (秒)
+
+
+def _sysfs_kind(sys_dir):
+    """根据 sysfs 设备目录判断类型, 返回 'hdd' / 'ssd' / None"""
+    # 分区的 queue 目录在父设备下
+    for candidate in (sys_dir, os.path.dirname(sys_dir)):
+        rotational = os.path.join(candidate, 'queue', 'rotational')
+        if os.path.exists(rotational):
+            with open(rotational) as f:
+                return 'hdd' if f.read().strip() == '1' else 'ssd'
+    # device-mapper / md RAID: 任一底层盘是机械盘即按机械盘处理
+    slaves_dir = os.path.join(sys_dir, 'slaves')
+    if os.path.isdir(slaves_dir):
+        kinds = {_sysfs_kind(os.path.realpath(os.path.join(slaves_dir, s)))
+                 for s in os.listdir(slaves_dir)}
+        if 'hdd' in kinds:
+            return 'hdd'
+        if 'ssd' in kinds:
+            return 'ssd'
+    return None
+
+
+def device_kind(dev):
+    """识别 st_dev 对应设备的类型, 返回 'hdd' / 'ssd' / None"""
+    if not hasattr(os, 'major'):
+        return None
+    sys_path = f"/sys/dev/block/{os.major(dev)}:{os.minor(dev)}"
+    if not os.path.exists(sys_path):
+        return None
+    try:
+        return _sysfs_kind(os.path.realpath(sys_path))
+    except OSError:
+        return None
+
+
+def readers_for(kind, hdd_readers=HDD_READERS, ssd_readers=SSD_READERS,
+                unknown_readers=UNKNOWN_READERS):
+    return {'hdd': hdd_readers, 'ssd': ssd_readers}.get(kind, unknown_readers)
+
+
+def group_by_device(paths):
+    """返回 st_dev -> 文件路径列表"""
+    groups = defaultdict(list)
+    for path in paths:
+        groups[os.stat(path).st_dev].append(path)
+    return groups
+
+
+def describe_devices(limits, counts):
+    """生成设备调度说明, 例如 ['8:16 hdd 读者=1 文件=120']"""
+    lines = []
+    for dev, (kind, readers) in limits.items():
+        dev_name = f"{os.major(dev)}:{os.minor(dev)}" if hasattr(os, 'major') else str(dev)
+        lines.append(f"{dev_name} {kind or 'unknown'} 读者={readers} 文件={counts[dev]}")
+    return lines
+
+
+def run_by_device(tasks, worker, hdd_readers=HDD_READERS, ssd_readers=SSD_READERS,
+                  unknown_readers=UNKNOWN_READERS, max_workers=MAX_WORKERS, verbose=True,
+                  claim=None, poll_interval=POLL_INTERVAL):
+    """
+    按设备限流地并行执行任务, 完成一个产出一个结果
+    :param tasks: 参数元组列表, 第一个元素为文件路径
+    :param worker: 可被子进程调用的函数 worker(*task)
+    :param claim: 提交前调用 claim(task) (多节点共享时认领文件, 如 leases.LeaseStore.acquire):
+                  True 执行; False 跳过; None 稍后再试 (每 poll_interval 秒)
+    """
+    if not tasks:
+        return
+    devices = {task[0]: os.stat(task[0]).st_dev for task in tasks}
+    counts = Counter(devices.values())
+    limits = {}
+    for dev in counts:
+        kind = device_kind(dev)
+        limits[dev] = (kind, readers_for(kind, hdd_readers, ssd_readers, unknown_readers))
+    if verbose:
+        for line in describe_devices(limits, counts):
+            print(f"设备 {line}")
+
+    # 进程数: 各设备读者数之和, 不超过上限
+    pool_size = max(1, min(max_workers, sum(readers for _, readers in limits.values())))
+    pending = list(tasks)
+    waiting = []  # 其他节点正在处理的任务
+    next_poll = 0
+    running = {}
+    device_running = Counter()
+    with ProcessPoolExecutor(max_workers=pool_size) as executor:
+        while pending or running or waiting:
+            if waiting and not pending and time.time() >= next_poll:
+                pending, waiting = waiting, []
+                next_poll = time.time() + poll_interval
+            i = 0
+            while len(running) < pool_size and i < len(pending):
+                dev = devices[pending[i][0]]
+                if device_running[dev] < limits[dev][1]:
+                    task = pending.pop(i)
+                    claimed = claim(task) if claim is not None else True
+                    if not claimed:
+                        if claimed is None:
+                            waiting.append(task)
+                        continue
+                    device_running[dev] += 1
+                    running[executor.submit(worker, *task)] = dev
+                else:
+                    i += 1
+
+            if not running:
+                if waiting and not pending:
+                    time.sleep(max(0, next_poll - time.time()))
+                continue
+            done, _ = wait(running, timeout=1 if waiting else None, return_when=FIRST_COMPLETED)
+            for future in done:
+                device_running[running.pop(future)] -= 1
+                yield future.result()
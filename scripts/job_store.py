@@ -0,0 +1,189 @@
+"""
+任务状态库 (SQLite)
+
+记录每个文件在 下载 -> 校验 -> 整理 流程中的状态、已完成字节数、尝试次数和耗时,
+默认放在下载目录的 jobs.sqlite3, 下载脚本 / 2.md5check.py / 2.1修复脚本 / 3.data_organize.py 共用:
+    pending -> downloading -> downloaded -> verified -> organized
+    任一步出错为 failed, 修复脚本从 failed 重新开始
+状态迁移是带条件的 UPDATE (单个事务, 原子); 进程在任意时刻被杀掉后重新运行,
+停留在 downloading 的任务回到 pending 并断点续传, 已完成的步骤只核对文件签名 (一次stat), 不再重复下载或哈希
+"""
+import os
+import time
+import sqlite3
+import threading
+from md5_cache import file_signature, journal_mode
+
+JOB_FILE = "jobs.sqlite3"  # 默认放在下载目录中
+
+# 文件状态
+PENDING = 'pending'
+DOWNLOADING = 'downloading'
+DOWNLOADED = 'downloaded'
+VERIFIED = 'verified'
+FAILED = 'failed'
+ORGANIZED = 'organized'
+STATES = (PENDING, DOWNLOADING, DOWNLOADED, VERIFIED, FAILED, ORGANIZED)
+DONE_STATES = (DOWNLOADED, VERIFIED, ORGANIZED)  # 已下载完成, 不需要再下载
+
+# transition 可以顺带更新的列
+FIELDS = ('run_accession', 'url', 'dest_path', 'expected_md5', 'size', 'bytes_done', 'md5',
+          'error', 'download_seconds', 'verify_seconds')
+
+
+def default_job_path(download_dir):
+    return os.path.join(download_dir, JOB_FILE)
+
+
+class JobStore:
+    """线程安全的任务状态库"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, timeout=60, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        with self.lock, self.conn:
+            self.conn.execute(f"PRAGMA journal_mode={journal_mode(db_path)}")
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    file_name TEXT PRIMARY KEY,
+                    run_accession TEXT,
+                    url TEXT,
+                    dest_path TEXT,
+                    expected_md5 TEXT,
+                    size INTEGER,
+                    state TEXT NOT NULL,
+                    bytes_done INTEGER NOT NULL DEFAULT 0,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    md5 TEXT,
+                    error TEXT,
+                    file_size INTEGER,
+                    mtime_ns INTEGER,
+                    inode INTEGER,
+                    download_seconds REAL,
+                    verify_seconds REAL,
+                    started_at REAL,
+                    updated_at REAL NOT NULL
+                )""")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state)")
+
+    def add(self, jobs):
+        """
+        登记任务, 已存在的任务保留状态, 只补充链接/路径/预期MD5等信息
+        :param jobs: 字典列表, 至少包含 file_name
+        """
+        now = time.time()
+        with self.lock, self.conn:
+            for job in jobs:
+                self.conn.execute("""
+                    INSERT INTO jobs (file_name, run_accession, url, dest_path, expected_md5, size,
+                                      state, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(file_name) DO UPDATE SET
+                        run_accession = COALESCE(excluded.run_accession, run_accession),
+                        url = COALESCE(excluded.url, url),
+                        dest_path = CASE WHEN state = 'organized' THEN dest_path
+                                         ELSE COALESCE(excluded.dest_path, dest_path) END,
+                        expected_md5 = COALESCE(excluded.expected_md5, expected_md5),
+                        size = COALESCE(excluded.size, size)""",
+                    (job['file_name'], job.get('run_accession'), job.get('url'), job.get('dest_path'),
+                     job.get('expected_md5'), job.get('size'), PENDING, now))
+
+    def recover(self):
+        """把上次被中断时停留在 downloading 的任务放回 pending, 返回数量"""
+        with self.lock, self.conn:
+            return self.conn.execute(
+                "UPDATE jobs SET state = ?, updated_at = ? WHERE state = ?",
+                (PENDING, time.time(), DOWNLOADING)).rowcount
+
+    def transition(self, file_name, state, from_states=None, record_signature=False, **fields):
+        """
+        原子地迁移任务状态
+        :param from_states: 只有当前状态在其中时才迁移 (None 表示不限)
+        :param record_signature: 记录文件当前的签名, 之后用来确认已完成的文件没有被改动
+        :param fields: 同时更新的列, 见 FIELDS
+        :return: 是否迁移成功
+        """
+        assert state in STATES, state
+        unknown = set(fields) - set(FIELDS)
+        if unknown:
+            raise ValueError(f"未知的任务字段: {', '.join(sorted(unknown))}")
+        now = time.time()
+        sets = {**fields, 'state': state, 'updated_at': now}
+        if state == DOWNLOADING:
+            sets['started_at'] = now
+        if record_signature:
+            path = fields.get('dest_path') or (self.get(file_name) or {}).get('dest_path')
+            try:
+                sets['file_size'], sets['mtime_ns'], sets['inode'] = file_signature(path)
+            except (OSError, TypeError):
+                sets['file_size'] = sets['mtime_ns'] = sets['inode'] = None
+        sql = "UPDATE jobs SET " + ", ".join(f"{k} = ?" for k in sets)
+        if state == DOWNLOADING:
+            sql += ", attempts = attempts + 1"
+        params = list(sets.values()) + [file_name]
+        sql += " WHERE file_name = ?"
+        if from_states:
+            sql += f" AND state IN ({', '.join('?' * len(from_states))})"
+            params += list(from_states)
+        with self.lock, self.conn:
+            return self.conn.execute(sql, params).rowcount == 1
+
+    def get(self, file_name):
+        with self.lock:
+            row = self.conn.execute("SELECT * FROM jobs WHERE file_name = ?", (file_name,)).fetchone()
+        return dict(row) if row else None
+
+    def by_state(self, *states):
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT * FROM jobs WHERE state IN ({', '.join('?' * len(states))}) ORDER BY file_name",
+                states).fetchall()
+        return [dict(row) for row in rows]
+
+    def locations(self, directory, file_names=None):
+        """
+        文件的下载位置: 未整理的任务用记录的 dest_path (disk_plan 可能把文件放到其他下载目录),
+        没有记录时为 directory 下的同名文件
+        :param file_names: None 时返回所有记录了位置的未整理任务
+        :return: 文件名 -> 路径
+        """
+        with self.lock:
+            recorded = dict(self.conn.execute(
+                "SELECT file_name, dest_path FROM jobs WHERE state != ? AND dest_path IS NOT NULL",
+                (ORGANIZED,)).fetchall())
+        if file_names is None:
+            return recorded
+        return {name: recorded.get(name) or os.path.join(directory, name) for name in file_names}
+
+    def is_done(self, file_name, states=DONE_STATES):
+        """
+        任务处于给定状态之一, 且文件签名与完成时一致 (只stat, 不读取内容)
+        文件已被改动或删除时任务退回 pending, 返回False
+        """
+        job = self.get(file_name)
+        if not job or job['state'] not in states:
+            return False
+        try:
+            signature = file_signature(job['dest_path'])
+        except (OSError, TypeError):
+            signature = None
+        if job['file_size'] is None or signature == (job['file_size'], job['mtime_ns'], job['inode']):
+            return True
+        self.transition(file_name, PENDING, from_states=(job['state'],), error="文件已被改动或删除")
+        return False
+
+    def counts(self):
+        """返回 状态 -> 文件数"""
+        with self.lock:
+            rows = self.conn.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall()
+        return {state: count for state, count in rows}
+
+    def summary_line(self):
+        counts = self.counts()
+        return "任务状态: " + " | ".join(f"{state}: {counts.get(state, 0)}" for state in STATES)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,290 @@
+"""
+多节点分摊下载/校验: 在共享文件系统上用租约文件认领文件
+
+几台节点共享同一个下载目录 (并行文件系统), 对同一份清单各运行一个实例, 每个文件开始前先认领:
+- 租约文件 <下载目录>/.leases/<阶段>/<文件名>.lease 用 O_CREAT|O_EXCL 创建 (NFSv3+/Lustre/GPFS 上是原子的),
+  只有一个节点能拿到; 所有节点按相同的优先级顺序 (大文件优先) 随用随认领, 不需要预先分配, 节点可以随时增减
+- 持有期间后台线程每 RENEW_INTERVAL 秒更新租约文件的mtime (续约); 超过 LEASE_TTL 秒没有续约视为节点已崩溃,
+  其他节点把租约改名 (原子, 只有一个节点成功) 后重新认领, 从已下载的部分续传
+- 续约时发现租约已被接手 (本节点停顿过久), 通过 transfer_watch.cancel 立即停止本节点对该文件的传输
+  (下一块数据写入前抛出 Cancelled, ascp 等子进程被结束), 不会与接手的节点同时写同一个文件;
+  租约文件读写出错 (如NFS暂时不可用) 时先重试, 确认不属于本节点后才放弃; 一直无法续约、
+  快到 LEASE_TTL 时也主动停止 (其他节点即将接手)
+- 完成后写 <文件名>.done 标记 (记录文件签名, 文件之后被改写则失效), 其他节点直接跳过;
+  失败时只释放租约, 还没有尝试过的节点会接着重试
+- 其他节点正在处理的文件先跳过, 本节点的任务做完后定期再看: 对方完成则跳过, 对方崩溃则接手
+节点之间的时钟误差应远小于 LEASE_TTL (续约时间取文件服务器的时间, 判断过期用本机时间)。
+单机上多个进程指向同一个本地目录即可测试 (本地目录就是协调存储的替身)
+用法:
+    leases = LeaseStore(download_dir, 'download')
+    run_downloads(tasks, download_func, leases=leases)
+    leases.close()
+"""
+import os
+import json
+import time
+import uuid
+import socket
+import threading
+import metrics
+import transfer_watch
+from md5_cache import file_signature
+
+# 配置参数
+LEASE_DIR = ".leases"  # 位于下载目录
+LEASE_TTL = 180  # 租约有效期 (秒), 超过未续约视为持有的节点已崩溃
+RENEW_INTERVAL = 30  # 续约间隔 (秒)
+POLL_INTERVAL = 15  # 等待其他节点时重新查看的间隔 (秒)
+NODE_ID = None  # 节点名, None 时使用 主机名-进程号
+READ_RETRIES = 3  # 续约时租约文件读写出错的重试次数
+READ_RETRY_DELAY = 2  # 重试间隔 (秒)
+
+
+def default_node():
+    return NODE_ID or f"{socket.gethostname()}-{os.getpid()}"
+
+
+class LeaseStore:
+    """一个阶段 (download / verify) 的租约, 线程安全"""
+
+    def __init__(self, directory, stage='download', node=None, ttl=LEASE_TTL,
+                 renew_interval=RENEW_INTERVAL, poll_interval=POLL_INTERVAL):
+        self.directory = os.path.join(directory, LEASE_DIR, stage)
+        os.makedirs(self.directory, exist_ok=True)
+        self.node = node or default_node()
+        self.ttl = ttl
+        self.renew_interval = renew_interval
+        self.poll_interval = poll_interval
+        self.lock = threading.Lock()
+        self.held = {}  # 文件名 -> 本节点的令牌
+        self.lost = set()  # 租约被其他节点接手的文件 (重新认领后移除)
+        self.renewed = {}  # 文件名 -> 最后一次成功续约的时间
+        self.stopped = threading.Event()
+        self.thread = None
+        self.stats = {'claimed': 0, 'reclaimed': 0, 'skipped': 0, 'lost': 0}
+
+    def _lease_path(self, name):
+        return os.path.join(self.directory, name + ".lease")
+
+    def _done_path(self, name):
+        return os.path.join(self.directory, name + ".done")
+
+    @staticmethod
+    def _read(path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def is_done(self, name, path=None):
+        """
+        其他节点 (或之前的运行) 已完成
+        :param path: 文件存在时要求签名与完成时一致 (之后被改写则需要重新处理); 已被整理移走时仍视为完成
+        """
+        marker = self._read(self._done_path(name))
+        if marker is None:
+            return False
+        if path is not None and marker.get('signature') and os.path.exists(path):
+            return marker['signature'] == list(file_signature(path))
+        return True
+
+    def holder(self, name):
+        """当前持有租约的节点, 没有租约时返回None"""
+        lease = self._read(self._lease_path(name))
+        return lease.get('node') if lease else None
+
+    def _create(self, name):
+        token = uuid.uuid4().hex
+        try:
+            fd = os.open(self._lease_path(name), os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump({'node': self.node, 'token': token, 'since': time.time()}, f)
+        with self.lock:
+            self.held[name] = token
+            self.renewed[name] = time.time()
+            self.lost.discard(name)
+            self.stats['claimed'] += 1
+            self._ensure_thread()
+        transfer_watch.resume(name)
+        return True
+
+    def _expired(self, path):
+        """返回过期租约的 (令牌, mtime), 租约有效或不存在时返回None"""
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            return None
+        if time.time() - mtime <= self.ttl:
+            return None
+        lease = self._read(path) or {}
+        return lease.get('token'), mtime
+
+    def _reclaim(self, name):
+        """接手过期的租约: 改名 (原子) 后确认改走的正是看到的那份过期租约, 再重新创建"""
+        path = self._lease_path(name)
+        expired = self._expired(path)
+        if expired is None:
+            return False
+        tomb = f"{path}.{uuid.uuid4().hex}.stale"
+        try:
+            os.rename(path, tomb)
+        except OSError:
+            return False  # 其他节点先接手了
+        lease = self._read(tomb) or {}
+        if lease.get('token') != expired[0] or os.stat(tomb).st_mtime != expired[1]:
+            # 改名前租约已被续约或换成了新的: 放回去 (已有新租约时放弃)
+            try:
+                os.link(tomb, path)
+            except OSError:
+                pass
+            os.remove(tomb)
+            return False
+        os.remove(tomb)
+        print(f"接手过期的租约: {name} (原节点 {lease.get('node')})")
+        if not self._create(name):
+            return False
+        with self.lock:
+            self.stats['reclaimed'] += 1
+        metrics.inc('lease_reclaims')
+        return True
+
+    def acquire(self, name, path=None):
+        """
+        认领一个文件
+        :param path: 文件路径, 用于确认完成标记仍然有效
+        :return: True 已认领 (由本节点处理); False 其他节点已完成 (跳过); None 其他节点正在处理 (稍后再试)
+        """
+        with self.lock:
+            if name in self.held:
+                return True
+        if self.is_done(name, path):
+            with self.lock:
+                self.stats['skipped'] += 1
+            return False
+        if self._create(name) or self._reclaim(name):
+            if self.is_done(name, path):  # 认领前刚好完成
+                self.release(name)
+                return False
+            return True
+        return None
+
+    def partition(self, tasks):
+        """
+        认领一批任务 (含 file_name / dest_path 的字典)
+        :return: (本节点认领的任务, 其他节点正在处理的任务); 其他节点已完成的任务被丢弃
+        """
+        claimed, waiting = [], []
+        for task in tasks:
+            result = self.acquire(task['file_name'], task['dest_path'])
+            if result:
+                claimed.append(task)
+            elif result is None:
+                waiting.append(task)
+        return claimed, waiting
+
+    def release(self, name, done=False, path=None):
+        """释放租约; done 时写完成标记 (path 给出时记录文件签名)"""
+        with self.lock:
+            token = self.held.pop(name, None)
+            self.renewed.pop(name, None)
+        if token is None:
+            return
+        if done:
+            marker = {'node': self.node, 'time': time.time()}
+            if path is not None and os.path.exists(path):
+                marker['signature'] = list(file_signature(path))
+            tmp = f"{self._done_path(name)}.{token}.tmp"
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(marker, f)
+            os.replace(tmp, self._done_path(name))
+        lease = self._read(self._lease_path(name))
+        if lease and lease.get('token') == token:
+            try:
+                os.remove(self._lease_path(name))
+            except OSError:
+                pass
+
+    def _ensure_thread(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._renew_loop, daemon=True)
+            self.thread.start()
+
+    def _renew_loop(self):
+        while not self.stopped.wait(self.renew_interval):
+            self.renew()
+
+    def _renew_one(self, name, token):
+        """
+        续约一个租约, 读写出错时重试
+        :return: True 已续约; False 租约已被删除或换成其他节点的; None 多次出错仍无法确定
+        """
+        path = self._lease_path(name)
+        missing = False
+        for attempt in range(READ_RETRIES):
+            if attempt:
+                time.sleep(READ_RETRY_DELAY)
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    lease = json.load(f)
+                if lease.get('token') != token:
+                    return False
+                os.utime(path)  # 不指定时间: NFS 上使用服务器时间
+                return True
+            except FileNotFoundError:
+                missing = True
+            except (OSError, ValueError):
+                missing = False
+        return False if missing else None
+
+    def renew(self):
+        """续约本节点持有的全部租约, 发现已被其他节点接手 (本节点停顿过久) 时停止该文件的传输"""
+        with self.lock:
+            held = dict(self.held)
+        for name, token in held.items():
+            renewed = self._renew_one(name, token)
+            if renewed:
+                with self.lock:
+                    if self.held.get(name) == token:
+                        self.renewed[name] = time.time()
+            elif renewed is False:
+                self._lose(name, token, "租约已被其他节点接手")
+            elif time.time() - self.renewed.get(name, 0) >= self.ttl - self.renew_interval:
+                self._lose(name, token, "长时间无法续约, 租约即将过期")
+            else:
+                metrics.inc('lease_renew_errors')
+                print(f"警告: 无法续约 {name} (租约文件读写出错), 稍后再试")
+
+    def _lose(self, name, token, reason):
+        with self.lock:
+            if self.held.get(name) != token:
+                return
+            del self.held[name]
+            self.renewed.pop(name, None)
+            self.lost.add(name)
+            self.stats['lost'] += 1
+        metrics.inc('lease_lost')
+        print(f"警告: {name}: {reason}, 停止本节点的传输")
+        transfer_watch.cancel(name, reason)
+
+    def is_lost(self, name):
+        """本节点对该文件的租约已丢失 (传输已被取消, 不应记为失败)"""
+        with self.lock:
+            return name in self.lost
+
+    def close(self):
+        """停止续约并释放未完成的租约 (其他节点可以立即接手)"""
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        with self.lock:
+            names = list(self.held)
+        for name in names:
+            self.release(name)
+
+    def summary_line(self):
+        s = self.stats
+        return (f"节点 {self.node}: 认领 {s['claimed']} (接手过期 {s['reclaimed']}) | "
+                f"其他节点已完成 {s['skipped']}" + (f" | 租约丢失 {s['lost']}" if s['lost'] else ""))
@@ -0,0 +1,177 @@
+"""
+统一的样本清单读取
+
+直接读取ENA导出的 filereport_read_run_*_tsv.txt (不需要pandas/openpyxl), 没有tsv时退回读取xlsx;
+把每行 ;拼接 的 fastq_ftp / fastq_md5 / fastq_aspera / fastq_bytes 展开成逐文件的记录,
+按文件名和run编号建立索引; 解析结果缓存为pickle, 源文件不变时再次运行直接加载
+用法:
+    manifest = load_manifest(r"D:\\NCBI_ascp\\data_report")  # 目录 / 单个tsv / xlsx
+    manifest.by_name["SRR21934201_1.fastq.gz"]["md5"]
+"""
+import os
+import csv
+import glob
+import pickle
+
+CACHE_VERSION = 1
+TSV_PATTERN = "filereport_read_run_*_tsv.txt"
+# 逐文件展开的列: 清单列名 -> 记录中的键
+FILE_COLUMNS = {
+    'fastq_ftp': 'ftp',
+    'fastq_md5': 'md5',
+    'fastq_aspera': 'aspera',
+    'fastq_bytes': 'bytes',
+}
+# 每个文件记录附带的run级别信息
+RUN_COLUMNS = ('run_accession', 'sample_accession', 'experiment_accession',
+               'study_accession', 'sra_ftp')
+
+
+class Manifest:
+    """逐文件的清单表, 按文件名和run编号索引"""
+
+    def __init__(self, runs, sources=()):
+        self.runs = runs  # run行的原始内容 (列名 -> 字符串)
+        self.sources = list(sources)
+        self.files = []
+        self.by_name = {}
+        self.by_run = {}
+        for row in runs:
+            for record in explode_row(row):
+                self.files.append(record)
+                self.by_name[record['file_name']] = record
+                self.by_run.setdefault(record['run_accession'], []).append(record)
+
+    def links(self, column='fastq_ftp'):
+        """某一列的全部链接 (已拆分)"""
+        key = FILE_COLUMNS[column]
+        return [f[key] for f in self.files if f[key]]
+
+    def md5s(self):
+        """文件名 -> 预期MD5"""
+        return {f['file_name']: f['md5'] for f in self.files if f['md5']}
+
+    def sizes(self):
+        """文件名 -> 字节数 (清单中有 fastq_bytes 列时)"""
+        return {f['file_name']: f['bytes'] for f in self.files if f['bytes'] is not None}
+
+
+def _split(value):
+    return [v.strip() for v in value.split(';')] if value else []
+
+
+def explode_row(row):
+    """把一行run展开为逐文件记录"""
+    columns = {key: _split(row.get(column, '')) for column, key in FILE_COLUMNS.items()}
+    count = max(len(values) for values in columns.values())
+    records = []
+    for i in range(count):
+        record = {key: (values[i] if i < len(values) else '') for key, values in columns.items()}
+        link = record['ftp'] or record['aspera']
+        if not link:
+            continue
+        record['file_name'] = link.split('/')[-1]
+        record['index'] = i
+        try:
+            record['bytes'] = int(float(record['bytes']))
+        except ValueError:
+            record['bytes'] = None
+        for column in RUN_COLUMNS:
+            record[column] = row.get(column, '')
+        records.append(record)
+    return records
+
+
+def _cell(value):
+    """把xlsx单元格转换为与tsv一致的字符串"""
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value).strip()
+
+
+def read_tsv(path):
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        return [{k: (v or '').strip() for k, v in row.items() if k}
+                for row in csv.DictReader(f, delimiter='\t')]
+
+
+def read_xlsx(path):
+    from openpyxl import load_workbook  # 只有退回读取xlsx时才需要
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = [_cell(h) for h in next(rows, ())]
+        return [{h: _cell(v) for h, v in zip(header, values) if h} for values in rows]
+    finally:
+        workbook.close()
+
+
+def find_sources(path):
+    """确定要读取的清单文件: 目录中优先使用ENA的tsv, 没有时使用xlsx"""
+    if os.path.isdir(path):
+        sources = sorted(glob.glob(os.path.join(path, TSV_PATTERN)))
+        if not sources:
+            sources = sorted(p for p in glob.glob(os.path.join(path, "*.xlsx"))
+                             if not os.path.basename(p).startswith('~$'))
+        return sources
+    if os.path.exists(path):
+        return [path]
+    return []
+
+
+def _cache_path(path):
+    if os.path.isdir(path):
+        return os.path.join(path, ".manifest_cache.pkl")
+    return path + ".manifest_cache.pkl"
+
+
+def _signature(sources):
+    return [(os.path.abspath(p), os.stat(p).st_size, os.stat(p).st_mtime_ns) for p in sources]
+
+
+def load_manifest(path, use_cache=True):
+    """
+    读取清单
+    :param path: data_report目录、单个filereport tsv或xlsx
+    :param use_cache: 源文件未变化时使用缓存的解析结果
+    """
+    sources = find_sources(path)
+    if not sources:
+        raise FileNotFoundError(f"找不到清单文件: {path}")
+    signature = _signature(sources)
+
+    cache_file = _cache_path(path)
+    if use_cache and os.path.exists(cache_file):
+        try:
+            with open(cache_file, 'rb') as f:
+                cached = pickle.load(f)
+            if cached.get('version') == CACHE_VERSION and cached.get('signature') == signature:
+                return cached['manifest']
+        except Exception:
+            pass  # 缓存损坏时重新解析
+
+    runs = []
+    seen = set()
+    for source in sources:
+        rows = read_xlsx(source) if source.lower().endswith('.xlsx') else read_tsv(source)
+        for row in rows:
+            run = row.get('run_accession', '')
+            if run in seen:
+                continue  # 多个报告中重复出现的run只保留一次
+            if run:
+                seen.add(run)
+            runs.append(row)
+    manifest = Manifest(runs, sources)
+
+    if use_cache:
+        try:
+            tmp = cache_file + ".tmp"
+            with open(tmp, 'wb') as f:
+                pickle.dump({'version': CACHE_VERSION, 'signature': signature,
+                             'manifest': manifest}, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, cache_file)
+        except OSError:
+            pass  # 目录不可写时不缓存
+    return manifest
@@ -0,0 +1,144 @@
+"""
+MD5校验缓存 (SQLite)
+
+以 (路径, 大小, mtime_ns, inode) 作为文件签名缓存MD5 (以及 sha256 等附加摘要),
+签名不变的文件不再重复计算;
+2.md5check.py / 2.md5check_HDD.py / 2.1.md5check_loop_fix.py 以及边下载边校验的下载脚本共用
+"""
+import os
+import json
+import time
+import sqlite3
+import threading
+
+CACHE_FILE = "md5_cache.sqlite3"  # 默认放在下载目录中
+# 网络/并行文件系统: WAL 依赖共享内存, 多个节点同时访问会损坏数据库, 改用 DELETE 日志
+NETWORK_FS = {'nfs', 'nfs4', 'cifs', 'smb3', 'smbfs', 'lustre', 'gpfs', 'beegfs', 'ceph', 'fuse.ceph',
+              'glusterfs', 'fuse.glusterfs', 'panfs', 'fuse.sshfs', 'wekafs'}
+
+
+def default_cache_path(download_dir):
+    return os.path.join(download_dir, CACHE_FILE)
+
+
+def filesystem_type(path):
+    """path 所在挂载点的文件系统类型 (读取 /proc/mounts, 取最长的挂载点前缀), 未知时返回None"""
+    path = os.path.realpath(path)
+    best, fs_type = "", None
+    try:
+        with open("/proc/mounts", 'r', encoding='utf-8') as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) < 3:
+                    continue
+                mount = fields[1].replace("\\040", " ")
+                if (path == mount or path.startswith(mount.rstrip("/") + "/")) and len(mount) > len(best):
+                    best, fs_type = mount, fields[2]
+    except OSError:
+        return None
+    return fs_type
+
+
+def journal_mode(db_path):
+    """SQLite日志模式: 本地磁盘用 WAL, 网络/并行文件系统 (多节点共享下载目录) 用 DELETE"""
+    fs_type = filesystem_type(os.path.dirname(os.path.abspath(db_path)))
+    return "DELETE" if fs_type in NETWORK_FS else "WAL"
+
+
+def file_signature(file_path):
+    """返回文件签名 (size, mtime_ns, inode)"""
+    st = os.stat(file_path)
+    return st.st_size, st.st_mtime_ns, st.st_ino
+
+
+class MD5Cache:
+    """线程安全的MD5缓存, 并统计命中情况"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.conn = sqlite3.connect(db_path, timeout=60, check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.execute(f"PRAGMA journal_mode={journal_mode(db_path)}")
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS md5_cache (
+                    path TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    inode INTEGER NOT NULL,
+                    md5 TEXT NOT NULL,
+                    updated_at REAL NOT NULL,
+                    extra_digests TEXT
+                )""")
+            # 旧版本的缓存库没有附加摘要列
+            columns = {row[1] for row in self.conn.execute("PRAGMA table_info(md5_cache)")}
+            if 'extra_digests' not in columns:
+                self.conn.execute("ALTER TABLE md5_cache ADD COLUMN extra_digests TEXT")
+
+    @staticmethod
+    def _key(file_path):
+        return os.path.realpath(file_path)
+
+    def get(self, file_path, signature=None, force=False):
+        """
+        查询缓存, 文件签名与缓存一致时返回MD5, 否则返回None
+        :param signature: 已取得的文件签名 (省去一次stat)
+        :param force: 为True时忽略缓存 (计为未命中)
+        """
+        digests = self.get_digests(file_path, ('md5',), signature, force)
+        return digests['md5'] if digests else None
+
+    def get_digests(self, file_path, names, signature=None, force=False):
+        """
+        查询多种摘要, 签名一致且所需摘要都已缓存时返回 名称->摘要, 否则返回None
+        """
+        if force:
+            self.misses += 1
+            return None
+        try:
+            signature = signature or file_signature(file_path)
+        except OSError:
+            return None
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT size, mtime_ns, inode, md5, extra_digests FROM md5_cache WHERE path = ?",
+                (self._key(file_path),)).fetchone()
+        if row and tuple(row[:3]) == tuple(signature):
+            digests = json.loads(row[4]) if row[4] else {}
+            digests['md5'] = row[3]
+            if all(name in digests for name in names):
+                self.hits += 1
+                return {name: digests[name] for name in names}
+        self.misses += 1
+        return None
+
+    def put(self, file_path, md5, signature=None, extra=None):
+        """
+        写入缓存
+        :param signature: 计算MD5之前取得的签名, 避免把计算期间被修改的文件记为有效
+        :param extra: 同一次读取算出的其他摘要, 如 {'sha256': ...}
+        """
+        signature = signature or file_signature(file_path)
+        extra = {k: v for k, v in (extra or {}).items() if k != 'md5'}
+        with self.lock, self.conn:
+            # 同一文件版本之前算过的其他摘要保留下来
+            row = self.conn.execute(
+                "SELECT size, mtime_ns, inode, md5, extra_digests FROM md5_cache WHERE path = ?",
+                (self._key(file_path),)).fetchone()
+            if row and row[4] and tuple(row[:4]) == (*signature, md5):
+                extra = {**json.loads(row[4]), **extra}
+            self.conn.execute(
+                "INSERT OR REPLACE INTO md5_cache VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (self._key(file_path), *signature, md5, time.time(),
+                 json.dumps(extra) if extra else None))
+
+    def stats_line(self):
+        total = self.hits + self.misses
+        rate = self.hits / total * 100 if total else 0.0
+        return f"缓存命中: {self.hits} | 重新计算: {self.misses} | 命中率: {rate:.1f}%"
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,194 @@
+"""
+边下载边计算MD5 (省去下载后的第二遍整文件读取)
+
+- ResumableMD5: 增量MD5, 状态以 <文件名>.md5state 保存在下载文件旁边
+  hashlib 对象无法序列化, 因此检查点记录的是已哈希的偏移和该前缀的MD5;
+  续传时从磁盘上已有的前缀重建一次哈希, 并用检查点的前缀MD5确认本地部分文件未损坏
+- HashingWriter: 单连接下载的写入器, 写入的同时更新哈希
+- 下载时已校验通过的文件写入MD5缓存 (md5_cache.py), 2.md5check*.py 不再重复计算
+"""
+import os
+import json
+import hashlib
+import subprocess
+import bandwidth
+import metrics
+import transfer_watch
+from transfer_watch import Stalled, Cancelled
+from md5_cache import MD5Cache, default_cache_path
+
+# 配置参数
+READ_CHUNK_SIZE = 8 * 1024 * 1024  # 续传时重建哈希的读取块大小
+PIPE_CHUNK_SIZE = 1024 * 1024  # 从curl/wget管道读取的块大小
+CHECKPOINT_BYTES = 64 * 1024 * 1024  # 每写入64MB保存一次哈希检查点
+STATE_SUFFIX = ".md5state"
+
+
+class ResumableMD5:
+    """可续传的增量MD5"""
+
+    def __init__(self, path):
+        self.path = path
+        self.md5 = hashlib.md5()
+        self.offset = 0
+
+    def update(self, data):
+        self.md5.update(data)
+        self.offset += len(data)
+
+    def catch_up(self, limit):
+        """从磁盘读取 [offset, limit) 补齐哈希 (分段下载时用于推进哈希前沿)"""
+        if limit <= self.offset:
+            return
+        with open(self.path, "rb") as f:
+            f.seek(self.offset)
+            while self.offset < limit:
+                chunk = f.read(min(READ_CHUNK_SIZE, limit - self.offset))
+                if not chunk:
+                    break
+                self.update(chunk)
+
+    def hexdigest(self):
+        return self.md5.hexdigest()
+
+    def state(self):
+        return {"offset": self.offset, "prefix_md5": self.md5.hexdigest()}
+
+    def save(self):
+        """原子地保存检查点"""
+        tmp = self.path + STATE_SUFFIX + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.state(), f)
+        os.replace(tmp, self.path + STATE_SUFFIX)
+
+    def discard(self):
+        if os.path.exists(self.path + STATE_SUFFIX):
+            os.remove(self.path + STATE_SUFFIX)
+
+    @classmethod
+    def resume(cls, path, limit=None):
+        """
+        为已有的部分文件重建哈希
+        :param limit: 只哈希前 limit 字节 (默认整个现有文件)
+        :return: ResumableMD5; 若检查点与本地文件不一致则返回 None (调用方应从头下载)
+        """
+        hasher = cls(path)
+        if not os.path.exists(path):
+            hasher.discard()
+            return hasher
+        size = os.path.getsize(path) if limit is None else limit
+        try:
+            with open(path + STATE_SUFFIX, "r", encoding="utf-8") as f:
+                checkpoint = json.load(f)
+        except (OSError, ValueError):
+            checkpoint = None
+
+        if checkpoint and checkpoint["offset"] <= size:
+            hasher.catch_up(checkpoint["offset"])
+            if hasher.hexdigest() != checkpoint["prefix_md5"]:
+                print(f"警告: 部分文件与哈希检查点不一致, 将重新下载 {path}")
+                return None
+        hasher.catch_up(size)
+        return hasher
+
+
+class HashingWriter:
+    """以追加方式写入下载文件, 同时增量计算MD5并定期保存检查点"""
+
+    def __init__(self, dest_path):
+        self.dest_path = dest_path
+        self.hasher = ResumableMD5.resume(dest_path)
+        if self.hasher is None:
+            os.remove(dest_path)
+            self.hasher = ResumableMD5(dest_path)
+        self.file = open(dest_path, "ab")
+        self.name = os.path.basename(dest_path)
+        self._unsaved = 0
+
+    @property
+    def offset(self):
+        return self.hasher.offset
+
+    def write(self, chunk):
+        self.file.write(chunk)
+        self.hasher.update(chunk)
+        metrics.add(self.name, len(chunk))
+        self._unsaved += len(chunk)
+        if self._unsaved >= CHECKPOINT_BYTES:
+            self.file.flush()
+            self.hasher.save()
+            self._unsaved = 0
+
+    def close(self):
+        """关闭文件并保存检查点, 返回当前MD5"""
+        self.file.close()
+        self.hasher.save()
+        return self.hasher.hexdigest()
+
+
+def stream_command(cmd, writer, name=None):
+    """
+    运行curl/wget等命令, 把其标准输出经由Python写入文件并计算哈希
+    :param cmd: 参数列表, 命令需把文件内容输出到stdout
+    :param name: 看门狗中显示的传输名 (默认为输出文件名)
+    :return: 命令的退出码; 吞吐低于下限被看门狗结束时抛出 Stalled (已写入的部分保留, 可续传),
+             被取消 (租约被其他节点接手) 时抛出 Cancelled
+    """
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+    monitor = transfer_watch.watch(name or os.path.basename(writer.dest_path), abort=process.kill)
+    try:
+        while chunk := process.stdout.read1(PIPE_CHUNK_SIZE):  # 有多少读多少, 看门狗能看到涓流
+            monitor.update(len(chunk))  # 被取消 (租约被接手) 后不再写入
+            writer.write(chunk)
+            bandwidth.throttle(len(chunk))  # 读得慢时curl/wget被管道反压, 受全局带宽预算约束
+    finally:
+        monitor.watchdog.unwatch(monitor)
+        process.stdout.close()
+        if monitor.stalled:
+            process.kill()
+        returncode = process.wait()
+    if monitor.cancelled:
+        raise Cancelled(monitor.reason)
+    if monitor.stalled:
+        raise Stalled(monitor.reason)
+    return returncode
+
+
+def finish_download(dest_path, actual_md5, expected_md5):
+    """
+    下载结束后把算出的MD5写入缓存并与预期值比对
+    不一致时删除文件: 长度已完整的文件保留下来, 之后续传请求 Range: bytes=<大小>- 只会得到416,
+    每次都被当作已完成再次校验失败; 删除后下次从头下载
+    :return: 是否通过 (没有预期MD5时视为通过)
+    """
+    ResumableMD5(dest_path).discard()
+    if not expected_md5:
+        return True
+    if actual_md5 != expected_md5:
+        print(f"MD5校验失败 {os.path.basename(dest_path)}: 预期 {expected_md5}, 实际 {actual_md5}, "
+              f"删除后下次从头下载")
+        if os.path.exists(dest_path):
+            os.remove(dest_path)
+        return False
+    record_md5(dest_path, actual_md5)
+    return True
+
+
+def record_md5(file_path, md5):
+    """把下载时算出的MD5写入缓存 (文件签名变化后自动失效)"""
+    cache = MD5Cache(default_cache_path(os.path.dirname(file_path)))
+    try:
+        cache.put(file_path, md5)
+    finally:
+        cache.close()
+
+
+def is_verified(file_path, expected_md5):
+    """判断文件是否已校验通过且之后未被修改"""
+    if not os.path.exists(file_path):
+        return False
+    cache = MD5Cache(default_cache_path(os.path.dirname(file_path)))
+    try:
+        return cache.get(file_path) == expected_md5
+    finally:
+        cache.close()
@@ -0,0 +1,357 @@
+"""
+进度与指标 (代替逐块打印的 \\r 进度行)
+
+- 写入下载文件的地方 (HashingWriter / 分段下载的定位写入) 调用 add(文件名, 字节数), 只做计数;
+  调度器用 start / finish 登记每个文件 (阶段: download / hash), 队列长度用 gauge 登记取值函数
+- 后台线程每 INTERVAL 秒汇总一次: 各阶段的聚合吞吐与ETA、每个传输的吞吐与ETA、队列长度、重试/卡住等计数
+  - 控制台: 每 CONSOLE_INTERVAL 秒一行汇总 (无头的集群节点上日志也可读)
+  - JSON-lines: 每个文件开始/结束一条事件, 每次汇总一条 snapshot 事件 (METRICS_FILE)
+  - Prometheus 文本格式: 写入文件 (node_exporter textfile collector) 或在 PROM_PORT 提供 /metrics
+用法:
+    metrics.configure(jsonl="metrics.jsonl", prom_file="sra.prom", prom_port=9108)  # 可选, 脚本启动时调用
+    metrics.start(file_name, total=size)   # 调度器
+    metrics.add(file_name, len(chunk))     # 写入数据时
+    metrics.finish(file_name, ok)
+"""
+import os
+import json
+import time
+import threading
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 配置参数
+INTERVAL = 5  # 汇总间隔 (秒)
+CONSOLE_INTERVAL = 30  # 控制台汇总行的间隔 (秒), 0 表示不输出
+METRICS_FILE = None  # JSON-lines 事件文件, 如 "metrics.jsonl"
+PROM_FILE = None  # Prometheus 文本格式文件, 如 "/var/lib/node_exporter/textfile/sra.prom"
+PROM_PORT = None  # 提供 http://<host>:<port>/metrics, 如 9108
+PREFIX = "sra"  # Prometheus 指标名前缀
+
+
+class Transfer:
+    """单个文件在某个阶段的进度"""
+
+    def __init__(self, name, stage, total, done):
+        self.name = name
+        self.stage = stage
+        self.total = total
+        self.done = done
+        self.started = time.time()
+        self.last = (self.started, done)  # 上次汇总时的 (时间, 字节数)
+        self.rate = None
+
+    def sample(self, now):
+        """计算自上次汇总以来的吞吐"""
+        last_time, last_done = self.last
+        if now > last_time:
+            self.rate = (self.done - last_done) / (now - last_time)
+        self.last = (now, self.done)
+        return self.rate
+
+    @property
+    def eta(self):
+        if not self.total or not self.rate:
+            return None
+        return max(self.total - self.done, 0) / self.rate
+
+    def as_dict(self):
+        return {'file': self.name, 'stage': self.stage, 'done': self.done, 'total': self.total,
+                'rate': round(self.rate, 1) if self.rate is not None else None,
+                'eta': round(self.eta) if self.eta is not None else None}
+
+
+class Metrics:
+    """线程安全的计数与定期汇总"""
+
+    def __init__(self, jsonl=METRICS_FILE, prom_file=PROM_FILE, prom_port=PROM_PORT,
+                 interval=INTERVAL, console_interval=CONSOLE_INTERVAL):
+        self.jsonl = jsonl
+        self.prom_file = prom_file
+        self.interval = interval
+        self.console_interval = console_interval
+        self.lock = threading.Lock()
+        self.transfers = {}  # 文件名 -> 正在进行的 Transfer
+        self.bytes = defaultdict(int)  # 阶段 -> 累计字节数
+        self.files = defaultdict(int)  # (阶段, ok/failed) -> 文件数
+        self.planned = {}  # 阶段 -> (文件数, 字节数), 用于计算整体ETA
+        self.counters = defaultdict(int)  # 名称 -> 次数 (retries / stalls / failovers ...)
+        self.gauges = {}  # 名称 -> 取值函数
+        self.rates = {}  # 阶段 -> 最近一次汇总的吞吐
+        self.last_bytes = {}
+        self.last_time = time.time()
+        self.last_console = 0
+        self.started = time.time()
+        self.prom_text = ""
+        self.thread = None
+        self.server = None
+        if prom_port:
+            self._serve(prom_port)
+
+    # ---- 记录 ----
+    def start(self, name, total=None, done=0, stage='download'):
+        with self.lock:
+            self.transfers[name] = Transfer(name, stage, total, done)
+            self._ensure_thread()
+        self.event('file_start', file=name, stage=stage, total=total, done=done)
+
+    def add(self, name, amount):
+        with self.lock:
+            transfer = self.transfers.get(name)
+            if transfer is not None:
+                transfer.done += amount
+                self.bytes[transfer.stage] += amount
+            else:
+                self.bytes['download'] += amount
+
+    def set_done(self, name, done):
+        """进度由外部给出 (如ascp的进度行) 或续传时校正已完成的字节数"""
+        with self.lock:
+            transfer = self.transfers.get(name)
+            if transfer is not None:
+                if done > transfer.done:
+                    self.bytes[transfer.stage] += done - transfer.done
+                transfer.done = done
+                transfer.last = (transfer.last[0], min(transfer.last[1], done))
+
+    def finish(self, name, ok, error=None, nbytes=None, stage=None):
+        """
+        结束一个文件
+        :param nbytes: 该阶段处理的字节数 (校验阶段在子进程中计算, 完成时一次计入)
+        :param stage: 没有调用 start 登记时指定阶段 (默认 download)
+        """
+        with self.lock:
+            transfer = self.transfers.pop(name, None)
+            stage = transfer.stage if transfer else (stage or 'download')
+            if nbytes is not None:
+                self.bytes[stage] += nbytes - (transfer.done if transfer else 0)
+            self.files[(stage, 'ok' if ok else 'failed')] += 1
+        seconds = time.time() - transfer.started if transfer else None
+        self.event('file_done', file=name, stage=stage, ok=bool(ok), error=error,
+                   bytes=nbytes if nbytes is not None else (transfer.done if transfer else None),
+                   seconds=round(seconds, 3) if seconds is not None else None)
+
+    def plan(self, stage, files, nbytes):
+        """登记某阶段本次运行需要处理的文件数和字节数"""
+        with self.lock:
+            self.planned[stage] = (files, nbytes)
+            self.last_bytes.setdefault(stage, self.bytes[stage])
+            self._ensure_thread()
+
+    def inc(self, name, value=1):
+        with self.lock:
+            self.counters[name] += value
+
+    def gauge(self, name, func):
+        """登记一个取值函数, 如 lambda: queue.qsize()"""
+        with self.lock:
+            self.gauges[name] = func
+            self._ensure_thread()
+
+    def event(self, kind, **fields):
+        if not self.jsonl:
+            return
+        line = json.dumps({'ts': round(time.time(), 3), 'event': kind, **fields}, ensure_ascii=False)
+        with self.lock:
+            with open(self.jsonl, 'a', encoding='utf-8') as f:
+                f.write(line + "\n")
+
+    # ---- 汇总 ----
+    def _ensure_thread(self):
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self._loop, daemon=True)
+            self.thread.start()
+
+    def _loop(self):
+        while True:
+            time.sleep(self.interval)
+            self.flush()
+
+    def snapshot(self):
+        now = time.time()
+        with self.lock:
+            elapsed = max(now - self.last_time, 1e-6)
+            self.last_time = now
+            transfers = [t for t in self.transfers.values()]
+            for transfer in transfers:
+                transfer.sample(now)
+            stages = {}
+            for stage in set(self.bytes) | set(self.planned) | {t.stage for t in transfers}:
+                total = self.bytes[stage]
+                rate = (total - self.last_bytes.get(stage, total)) / elapsed
+                self.last_bytes[stage] = total
+                self.rates[stage] = rate
+                planned_files, planned_bytes = self.planned.get(stage, (None, None))
+                eta = None
+                if planned_bytes and rate > 0:
+                    eta = max(planned_bytes - total, 0) / rate
+                stages[stage] = {
+                    'bytes': total, 'rate': round(rate, 1),
+                    'active': sum(1 for t in transfers if t.stage == stage),
+                    'ok': self.files[(stage, 'ok')], 'failed': self.files[(stage, 'failed')],
+                    'planned_files': planned_files, 'planned_bytes': planned_bytes,
+                    'eta': round(eta) if eta is not None else None,
+                }
+            counters = dict(self.counters)
+            gauges = self.gauges.copy()
+        values = {}
+        for name, func in gauges.items():
+            try:
+                values[name] = func()
+            except Exception:
+                values[name] = None
+        return {'elapsed': round(now - self.started, 1), 'stages': stages,
+                'transfers': [t.as_dict() for t in transfers], 'counters': counters, 'gauges': values}
+
+    def flush(self):
+        """汇总一次并输出到各目标"""
+        snap = self.snapshot()
+        if not snap['stages'] and not snap['transfers']:
+            return snap
+        self.event('snapshot', **snap)
+        self.prom_text = prometheus_text(snap)
+        if self.prom_file:
+            tmp = self.prom_file + ".tmp"
+            with open(tmp, 'w', encoding='utf-8') as f:
+                f.write(self.prom_text)
+            os.replace(tmp, self.prom_file)
+        now = time.time()
+        if self.console_interval and now - self.last_console >= self.console_interval and \
+                (snap['transfers'] or any(s['active'] or s['rate'] for s in snap['stages'].values())):
+            self.last_console = now
+            print(console_line(snap))
+        return snap
+
+    def _serve(self, port):
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = (metrics.prom_text or prometheus_text(metrics.snapshot())).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('0.0.0.0', port), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        print(f"指标: http://0.0.0.0:{port}/metrics")
+
+
+STAGE_NAMES = {'download': '下载', 'hash': '校验', 'organize': '整理'}
+
+
+def _clock(seconds):
+    seconds = int(seconds)
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+def console_line(snap):
+    """控制台汇总行, 如: [00:12:30] 下载 4个进行中 85.3 MB/s 完成 12/40 ETA 00:41:10 | queue_verify=3"""
+    parts = []
+    for stage, s in sorted(snap['stages'].items()):
+        text = f"{STAGE_NAMES.get(stage, stage)} {s['active']}个进行中 {s['rate'] / 1024 ** 2:.1f} MB/s"
+        if s['planned_files'] is not None:
+            text += f" 完成 {s['ok']}/{s['planned_files']}"
+        if s['failed']:
+            text += f" 失败 {s['failed']}"
+        if s['eta'] is not None:
+            text += f" ETA {_clock(s['eta'])}"
+        parts.append(text)
+    parts += [f"{name}={value}" for name, value in sorted(snap['gauges'].items())]
+    parts += [f"{name}={value}" for name, value in sorted(snap['counters'].items())]
+    return f"[{_clock(snap['elapsed'])}] " + " | ".join(parts)
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', ' ')
+
+
+def prometheus_text(snap):
+    """Prometheus 文本格式"""
+    p = PREFIX
+    lines = [f"# TYPE {p}_bytes_total counter", f"# TYPE {p}_rate_bytes gauge",
+             f"# TYPE {p}_files_total counter", f"# TYPE {p}_eta_seconds gauge",
+             f"# TYPE {p}_active gauge"]
+    for stage, s in sorted(snap['stages'].items()):
+        lines.append(f'{p}_bytes_total{{stage="{stage}"}} {s["bytes"]}')
+        lines.append(f'{p}_rate_bytes{{stage="{stage}"}} {s["rate"]}')
+        lines.append(f'{p}_active{{stage="{stage}"}} {s["active"]}')
+        for status in ('ok', 'failed'):
+            lines.append(f'{p}_files_total{{stage="{stage}",status="{status}"}} {s[status]}')
+        if s['eta'] is not None:
+            lines.append(f'{p}_eta_seconds{{stage="{stage}"}} {s["eta"]}')
+    lines += [f"# TYPE {p}_transfer_bytes gauge", f"# TYPE {p}_transfer_rate_bytes gauge",
+              f"# TYPE {p}_transfer_eta_seconds gauge"]
+    for t in snap['transfers']:
+        labels = f'file="{_label(t["file"])}",stage="{t["stage"]}"'
+        lines.append(f'{p}_transfer_bytes{{{labels}}} {t["done"]}')
+        if t['rate'] is not None:
+            lines.append(f'{p}_transfer_rate_bytes{{{labels}}} {t["rate"]}')
+        if t['eta'] is not None:
+            lines.append(f'{p}_transfer_eta_seconds{{{labels}}} {t["eta"]}')
+    for name, value in sorted(snap['gauges'].items()):
+        if isinstance(value, (int, float)):
+            lines.append(f'{p}_{name} {value}')
+    lines.append(f"# TYPE {p}_events_total counter")
+    for name, value in sorted(snap['counters'].items()):
+        lines.append(f'{p}_events_total{{name="{_label(name)}"}} {value}')
+    return "\n".join(lines) + "\n"
+
+
+_metrics = Metrics()
+
+
+def configure(jsonl=METRICS_FILE, prom_file=PROM_FILE, prom_port=PROM_PORT, interval=INTERVAL,
+              console_interval=CONSOLE_INTERVAL):
+    """设置输出目标 (脚本启动时调用, 不调用时只输出控制台汇总行)"""
+    global _metrics
+    _metrics = Metrics(jsonl, prom_file, prom_port, interval, console_interval)
+    return _metrics
+
+
+def metrics():
+    return _metrics
+
+
+def start(name, total=None, done=0, stage='download'):
+    _metrics.start(name, total, done, stage)
+
+
+def add(name, amount):
+    _metrics.add(name, amount)
+
+
+def set_done(name, done):
+    _metrics.set_done(name, done)
+
+
+def progress(name):
+    """正在进行的传输已完成的字节数, 未登记时返回None"""
+    with _metrics.lock:
+        transfer = _metrics.transfers.get(name)
+        return transfer.done if transfer is not None else None
+
+
+def finish(name, ok, error=None, nbytes=None, stage=None):
+    _metrics.finish(name, ok, error, nbytes, stage)
+
+
+def plan(stage, files, nbytes):
+    _metrics.plan(stage, files, nbytes)
+
+
+def inc(name, value=1):
+    _metrics.inc(name, value)
+
+
+def gauge(name, func):
+    _metrics.gauge(name, func)
+
+
+def flush():
+    return _metrics.flush()
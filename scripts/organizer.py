@@ -0,0 +1,233 @@
+"""
+把下载目录中的fastq整理到样本目录 (3.data_organize.py 和 0.pipeline.py 共用)
+
+放置方式 (MODE):
+- move: 同一文件系统内 rename (不复制数据), 跨文件系统时复制后删除源文件
+- hardlink: 同一文件系统内硬链接, 下载目录中的文件保留 (跨文件系统时退回复制)
+- reflink: 写时复制克隆 (btrfs/xfs等支持时不复制数据), 不支持时退回复制
+- symlink: 创建指向下载目录的符号链接
+- copy: 复制
+跨文件系统的复制用 copy_file_range / sendfile 在内核中完成, 多个文件并行 (COPY_WORKERS)
+
+目录布局 (LAYOUT):
+- run: OUTPUT_DIR/<run>/<原文件名>
+- cellranger: OUTPUT_DIR/<sample_accession>/<sample>_S1_L00<n>_<R1/R2/I1>_001.fastq.gz,
+  同一样本的多个run依次作为不同的lane, 可直接用于 cellranger count --fastqs=... --sample=<sample_accession>
+文件名支持 SRR/ERR/DRR, 单端 (<run>.fastq.gz) 以及带index read的 _3 文件
+"""
+import os
+import re
+import shutil
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+# 配置参数
+MODE = "move"  # move / hardlink / reflink / symlink / copy
+LAYOUT = "run"  # run / cellranger
+COPY_WORKERS = 4  # 跨文件系统时同时复制的文件数
+COPY_CHUNK = 64 * 1024 * 1024  # copy_file_range / sendfile 每次调用传输的字节数
+# cellranger布局下 run的文件后缀组合 -> 各后缀对应的read类型 (10x数据上传了index read时ENA拆成 _1/_2/_3,
+# _1/_2 为 R1 (barcode+UMI) / R2, _3 为 index read)
+# 有 _1/_2 时同时存在的未配对reads文件 (<run>.fastq.gz) 不参与判断, 保留原文件名
+CELLRANGER_READS = {
+    frozenset(['']): {'': 'R1'},
+    frozenset(['1', '2']): {'1': 'R1', '2': 'R2'},
+    frozenset(['1', '2', '3']): {'1': 'R1', '2': 'R2', '3': 'I1'},
+}
+
+MODES = ('move', 'hardlink', 'reflink', 'symlink', 'copy')
+LAYOUTS = ('run', 'cellranger')
+FASTQ_PATTERN = re.compile(r'^([SED]RR\d+)(?:_([123]))?\.fastq\.gz$')
+FICLONE = 0x40049409  # linux/fs.h
+
+
+def parse_name(file_name):
+    """
+    解析ENA的fastq文件名
+    :return: (run编号, 后缀 '1'/'2'/'3', 单端时为''), 不是fastq文件时返回None
+    """
+    match = FASTQ_PATTERN.match(file_name)
+    if not match:
+        return None
+    return match.group(1), match.group(2) or ''
+
+
+def same_device(src, dst_dir):
+    return os.stat(src).st_dev == os.stat(dst_dir).st_dev
+
+
+def _kernel_copy(src_fd, dst_fd, size):
+    """在内核中复制 (copy_file_range, 不支持时 sendfile), 都不可用时返回False"""
+    copied = 0
+    for func in (getattr(os, 'copy_file_range', None), getattr(os, 'sendfile', None)):
+        if func is None:
+            continue
+        try:
+            while copied < size:
+                if func is os.sendfile:
+                    sent = func(dst_fd, src_fd, copied, min(COPY_CHUNK, size - copied))
+                else:
+                    sent = func(src_fd, dst_fd, min(COPY_CHUNK, size - copied), copied, copied)
+                if sent == 0:
+                    break
+                copied += sent
+            return copied == size
+        except OSError:
+            if copied:
+                raise  # 复制到一半出错 (磁盘满等), 不换方法重来
+    return False
+
+
+def _reflink(src_fd, dst_fd):
+    try:
+        import fcntl
+        fcntl.ioctl(dst_fd, FICLONE, src_fd)
+        return True
+    except (ImportError, OSError):
+        return False
+
+
+def copy_file(src, dst, reflink=False):
+    """
+    复制文件: 先写到 .part 再改名, 中断后不会留下不完整的目标文件
+    :param reflink: 先尝试写时复制克隆
+    :return: 实际使用的方式
+    """
+    tmp = dst + ".part"
+    size = os.path.getsize(src)
+    method = None
+    try:
+        with open(src, 'rb') as fsrc, open(tmp, 'wb') as fdst:
+            if reflink and _reflink(fsrc.fileno(), fdst.fileno()):
+                method = 'reflink'
+            elif _kernel_copy(fsrc.fileno(), fdst.fileno(), size):
+                method = 'copy'
+        if method is None:
+            shutil.copyfile(src, tmp)
+            method = 'copy'
+        if os.path.getsize(tmp) != size:
+            raise OSError(f"复制不完整: {src}")
+        shutil.copystat(src, tmp)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    os.replace(tmp, dst)
+    return method
+
+
+def place(src, dst, mode=MODE):
+    """
+    按 mode 把 src 放到 dst (已存在时覆盖)
+    先放到同目录的临时名再 os.replace 覆盖, 放置失败 (空间不足、权限等) 时原来的 dst 保留
+    :return: 实际使用的方式 (rename / hardlink / reflink / symlink / copy)
+    """
+    dst_dir = os.path.dirname(dst)
+    os.makedirs(dst_dir, exist_ok=True)
+    tmp = dst + ".part"
+    if os.path.lexists(tmp):
+        os.remove(tmp)
+    if mode == 'symlink':
+        os.symlink(os.path.abspath(src), tmp)
+        os.replace(tmp, dst)
+        return 'symlink'
+    local = same_device(src, dst_dir)
+    if mode == 'move' and local:
+        os.replace(src, dst)
+        return 'rename'
+    if mode == 'hardlink' and local:
+        try:
+            os.link(src, tmp)
+            os.replace(tmp, dst)
+            return 'hardlink'
+        except OSError:
+            if os.path.lexists(tmp):
+                os.remove(tmp)  # 文件系统不支持硬链接 (如 FAT/exFAT)
+    method = copy_file(src, dst, reflink=(mode == 'reflink'))
+    if mode == 'move':
+        os.remove(src)
+    return method
+
+
+def plan(file_names, samples=None, layout=LAYOUT):
+    """
+    计算每个文件的目标相对路径
+    :param samples: 文件名 -> sample_accession (cellranger布局需要, 缺少时用run编号)
+    :return: 文件名 -> 相对 OUTPUT_DIR 的路径; 无法识别的文件名不出现在结果中
+    """
+    runs = defaultdict(dict)
+    for file_name in file_names:
+        parsed = parse_name(file_name)
+        if parsed:
+            runs[parsed[0]][parsed[1]] = file_name
+    targets = {}
+    if layout == 'run':
+        for run, files in runs.items():
+            for file_name in files.values():
+                targets[file_name] = os.path.join(run, file_name)
+        return targets
+
+    # cellranger: 同一样本的run按编号排序后依次编为 L001, L002 ...
+    samples = samples or {}
+    by_sample = defaultdict(list)
+    for run, files in runs.items():
+        sample = samples.get(next(iter(files.values()))) or run
+        by_sample[sample].append(run)
+    for sample, sample_runs in by_sample.items():
+        for lane, run in enumerate(sorted(sample_runs), 1):
+            files = runs[run]
+            paired = frozenset(files) - {''}
+            reads = CELLRANGER_READS.get(paired or frozenset(files), {})
+            for suffix, file_name in files.items():
+                read = reads.get(suffix)
+                if read is None:  # 文件组合不常见 (如只有 _1 和 _3), 保留原文件名
+                    targets[file_name] = os.path.join(sample, file_name)
+                else:
+                    targets[file_name] = os.path.join(sample, f"{sample}_S1_L{lane:03d}_{read}_001.fastq.gz")
+    return targets
+
+
+class Organizer:
+    """并行放置文件并更新任务状态, 可多次调用 submit (流水线中逐个run提交)"""
+
+    def __init__(self, output_dir, mode=MODE, workers=COPY_WORKERS, on_done=None):
+        if mode not in MODES:
+            raise ValueError(f"不支持的整理方式: {mode} (可选 {', '.join(MODES)})")
+        self.output_dir = output_dir
+        self.mode = mode
+        self.on_done = on_done  # on_done(文件名, 目标路径, 方式), 在工作线程中调用
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.futures = []
+        self.lock = threading.Lock()
+        self.methods = defaultdict(int)
+        self.errors = []
+
+    def submit(self, src, file_name, rel_path):
+        dst = os.path.join(self.output_dir, rel_path)
+        self.futures.append(self.executor.submit(self._place, src, file_name, dst))
+
+    def _place(self, src, file_name, dst):
+        try:
+            method = place(src, dst, self.mode)
+        except OSError as e:
+            with self.lock:
+                self.errors.append((file_name, str(e)))
+            print(f"整理失败: {file_name}: {e}")
+            return
+        with self.lock:
+            self.methods[method] += 1
+        if self.on_done is not None:
+            self.on_done(file_name, dst, method)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        for future in self.futures:
+            future.result()
+
+    def summary_line(self):
+        done = ", ".join(f"{method} {count}" for method, count in sorted(self.methods.items()))
+        line = f"整理方式: {done or '无'}"
+        if self.errors:
+            line += f" | 失败 {len(self.errors)}"
+        return line
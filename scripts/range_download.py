@@ -0,0 +1,400 @@
+"""
+单文件分段并行下载 (HTTP Range)
+
+先用 HEAD 获取文件大小, 把文件切成 N 段并发拉取, 写入预分配文件的对应位置;
+每段的进度记录在旁路状态文件 <文件名>.segments.json 中, 中断后各段独立续传 (状态文件先于预分配写入,
+预分配后长度等于总大小的文件只有状态文件记录全部完成或MD5核对通过才算完整);
+先完成的连接接手剩余最多的分段的后半部分, 避免最后只剩一两个慢连接拖尾;
+吞吐低于下限的连接由 transfer_watch 判定为卡住后重新连接续传;
+需要MD5时由后台线程沿"从文件开头连续已完成的位置"推进哈希 (数据刚写入, 读取命中页缓存)
+download_file: 单文件下载入口, 服务器不支持Range、探测失败或文件较小时退回单连接续传
+(未完成的分段下载先截断到从开头连续完成的位置, 见 drop_segment_state)
+"""
+import os
+import json
+import threading
+import requests
+from concurrent.futures import ThreadPoolExecutor
+import bandwidth
+import metrics
+import transfer_watch
+from transfer_watch import Stalled, Cancelled
+from md5_stream import ResumableMD5, HashingWriter, finish_download, is_verified
+
+# 配置参数
+SEGMENTS = 8  # 默认分段数
+MIN_SEGMENT_SIZE = 64 * 1024 * 1024  # 每段至少64MB, 小文件不分段
+CHUNK_SIZE = 1024 * 1024  # 每次读取1MB
+SEGMENT_RETRIES = 3  # 每段的重试次数
+STALL_RETRIES = 3  # 单连接下载卡住后重新连接的次数
+MIN_SPLIT_BYTES = 16 * 1024 * 1024  # 剩余不少于该值两倍的分段才会被拆分给空闲连接
+CHECKPOINT_BYTES = 16 * 1024 * 1024  # 每段每写入16MB保存一次状态
+TIMEOUT = 30
+STATE_SUFFIX = ".segments.json"
+
+
+_sessions = threading.local()
+
+
+def thread_session():
+    """每个下载线程复用一个 Session (keep-alive连接池), 同一主机的后续文件不再重新握手"""
+    session = getattr(_sessions, 'session', None)
+    if session is None:
+        session = _sessions.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=max(SEGMENTS, 10))
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+    return session
+
+
+def state_path(dest_path):
+    return dest_path + STATE_SUFFIX
+
+
+def probe(url, session=None, timeout=TIMEOUT):
+    """
+    HEAD请求获取文件大小与是否支持Range
+    :return: (总字节数, 是否支持Range), 失败时总字节数为None
+    """
+    session = session or requests
+    try:
+        response = session.head(url, allow_redirects=True, timeout=timeout)
+        response.raise_for_status()
+    except requests.exceptions.RequestException:
+        return None, False
+    length = response.headers.get("content-length")
+    accept_ranges = response.headers.get("accept-ranges", "").lower() == "bytes"
+    return (int(length) if length else None), accept_ranges
+
+
+def plan_segments(total_size, segments, existing_size=0):
+    """
+    把 [0, total_size) 切分为若干段 [start, end, done]
+    已有的部分文件 (旧的单连接续传) 视为前缀已完成
+    """
+    count = max(1, min(segments, total_size // MIN_SEGMENT_SIZE or 1))
+    step = -(-total_size // count)  # 向上取整
+    plan = []
+    for start in range(0, total_size, step):
+        end = min(start + step, total_size)
+        done = min(max(existing_size - start, 0), end - start)
+        plan.append([start, end, done])
+    return plan
+
+
+def load_state(dest_path, url, total_size):
+    """读取旁路状态文件, 与当前文件不匹配时返回None"""
+    try:
+        with open(state_path(dest_path), "r", encoding="utf-8") as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if state.get("size") != total_size or state.get("url") != url:
+        return None
+    return state
+
+
+def save_state(dest_path, state):
+    """原子地写入状态文件"""
+    tmp = state_path(dest_path) + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(tmp, state_path(dest_path))
+
+
+def preallocate(dest_path, total_size):
+    """预分配目标文件 (保留已下载内容)"""
+    mode = "r+b" if os.path.exists(dest_path) else "wb"
+    with open(dest_path, mode) as f:
+        f.truncate(total_size)
+    if hasattr(os, "posix_fallocate"):
+        fd = os.open(dest_path, os.O_RDWR)
+        try:
+            os.posix_fallocate(fd, 0, total_size)
+        except OSError:
+            pass  # 部分文件系统不支持, 退化为稀疏文件
+        finally:
+            os.close(fd)
+
+
+class _PositionalWriter:
+    """线程安全的定位写入 (POSIX 使用 pwrite, Windows 使用加锁的 seek+write)"""
+
+    def __init__(self, path):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.fd = os.open(path, os.O_RDWR | getattr(os, "O_BINARY", 0))
+        self.lock = threading.Lock()
+
+    def write_at(self, offset, data):
+        metrics.add(self.name, len(data))
+        if hasattr(os, "pwrite"):
+            while data:
+                written = os.pwrite(self.fd, data, offset)
+                data = data[written:]
+                offset += written
+        else:
+            with self.lock:
+                os.lseek(self.fd, offset, os.SEEK_SET)
+                while data:
+                    written = os.write(self.fd, data)
+                    data = data[written:]
+
+    def close(self):
+        os.close(self.fd)
+
+
+def contiguous_done(segments):
+    """从文件开头起连续已下载的字节数"""
+    done = 0
+    for start, end, seg_done in segments:
+        done = start + seg_done
+        if seg_done < end - start:
+            break
+    return done
+
+
+def drop_segment_state(dest_path):
+    """
+    退回单连接续传前处理分段下载留下的状态: 预分配后文件长度已等于总大小, 直接续传会请求
+    Range: bytes=<总大小>- 得到416而被当作完整; 截断到从开头连续完成的位置 (之后可能是空洞) 并删除状态文件。
+    状态记录全部完成时保留 (文件确实完整); 状态文件无法读取时从头下载
+    """
+    path = state_path(dest_path)
+    if not os.path.exists(path):
+        return
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            segments = json.load(f)["segments"]
+        if all(seg[2] >= seg[1] - seg[0] for seg in segments):
+            return
+        done = contiguous_done(segments)
+    except (OSError, ValueError, KeyError, TypeError, IndexError):
+        done = 0
+    if os.path.exists(dest_path):
+        with open(dest_path, "r+b") as f:
+            f.truncate(min(done, os.path.getsize(dest_path)))
+    os.remove(path)
+
+
+def _hash_frontier(hasher, segments, wakeup, stop):
+    """后台推进哈希前沿, 每次被唤醒时补齐新增的连续前缀"""
+    while not stop.is_set():
+        wakeup.wait(timeout=1)
+        wakeup.clear()
+        hasher.catch_up(contiguous_done(list(segments)))  # 复制一份, 其他线程可能正在拆分分段
+        hasher.save()
+
+
+def _split_largest(segments, lock):
+    """
+    把剩余字节最多的分段的后半部分拆成新分段, 交给空闲的连接
+    原连接读到新的结束位置后自行停止; 没有值得拆分的分段时返回None
+    """
+    with lock:
+        largest, remaining = None, 0
+        for segment in segments:
+            left = segment[1] - segment[0] - segment[2]
+            if left > remaining:
+                largest, remaining = segment, left
+        if largest is None or remaining < 2 * MIN_SPLIT_BYTES:
+            return None
+        split = largest[0] + largest[2] + remaining // 2
+        new = [split, largest[1], 0]
+        segments.insert(segments.index(largest) + 1, new)  # 先插入再缩短, 保证哈希前沿看到的前缀始终正确
+        largest[1] = split
+        return new
+
+
+def _fetch_segment(session, url, segment, writer, checkpoint, lock):
+    """下载单个分段, 从该段已完成的位置续传; 分段的结束位置可能被 _split_largest 提前"""
+    start = segment[0]
+    for attempt in range(SEGMENT_RETRIES):
+        if segment[2] >= segment[1] - start:
+            return True
+        offset = start + segment[2]
+        headers = {"Range": f"bytes={offset}-{segment[1] - 1}"}
+        try:
+            with transfer_watch.watch(f"{os.path.basename(writer.path)} [{start}-]") as monitor, \
+                    session.get(url, headers=headers, stream=True, timeout=TIMEOUT) as response:
+                if response.status_code != 206:
+                    raise requests.exceptions.RequestException(
+                        f"服务器未返回分段内容 (HTTP {response.status_code})")
+                unsaved = 0
+                for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                    if not chunk:
+                        continue
+                    with lock:
+                        chunk = chunk[:max(segment[1] - start - segment[2], 0)]
+                    monitor.update(len(chunk))  # 卡住时抛出 Stalled 重新连接续传; 被取消时抛出 Cancelled, 不再写入
+                    writer.write_at(start + segment[2], chunk)
+                    bandwidth.throttle(len(chunk))
+                    segment[2] += len(chunk)
+                    unsaved += len(chunk)
+                    if unsaved >= CHECKPOINT_BYTES:
+                        checkpoint()
+                        unsaved = 0
+                    if segment[2] >= segment[1] - start:
+                        break
+            checkpoint()
+        except (requests.exceptions.RequestException, Stalled) as e:
+            checkpoint()
+            metrics.inc('segment_retries')
+            print(f"分段 {start}-{segment[1]} 下载出错 (第{attempt + 1}次): {e}")
+    return segment[2] >= segment[1] - start
+
+
+def download_segmented(url, dest_path, segments=SEGMENTS, session=None, hash_md5=False):
+    """
+    分段并行下载单个文件, 支持各段独立断点续传
+    :param hash_md5: 是否在下载过程中计算整文件MD5
+    :return: (结果, MD5) 结果为 True 成功, False 失败, None 服务器不支持分段 (调用方应退回单连接下载);
+             未计算或未完成时MD5为None
+    """
+    session = session or thread_session()
+
+    total_size, accept_ranges = probe(url, session)
+    if not total_size or not accept_ranges:
+        return None, None
+
+    state = load_state(dest_path, url, total_size)
+    hasher = None
+    if state is not None and hash_md5:
+        hasher = ResumableMD5.resume(dest_path, limit=contiguous_done(state["segments"]))
+        if hasher is None:  # 本地部分文件已损坏, 从头下载
+            os.remove(state_path(dest_path))
+            os.remove(dest_path)
+            state = None
+    if state is None:
+        existing = os.path.getsize(dest_path) if os.path.exists(dest_path) else 0
+        if existing == total_size and hash_md5:
+            # 没有状态文件但长度已完整: 可能是预分配后中断的空洞文件, 交给调用方核对MD5
+            hasher = ResumableMD5.resume(dest_path)
+            return (True, hasher.hexdigest()) if hasher else (False, None)
+        if existing >= total_size:
+            # 无法确认内容 (不计算MD5时), 从头下载
+            existing = 0
+            if os.path.exists(dest_path):
+                os.remove(dest_path)
+        state = {"url": url, "size": total_size,
+                 "segments": plan_segments(total_size, segments, existing)}
+        if hash_md5:
+            hasher = ResumableMD5.resume(dest_path, limit=existing)
+            if hasher is None:
+                os.remove(dest_path)
+                hasher = ResumableMD5(dest_path)
+                state["segments"] = plan_segments(total_size, segments)
+        save_state(dest_path, state)  # 先记录进度再预分配, 中断后不会留下没有状态文件的全长文件
+        preallocate(dest_path, total_size)
+
+    state_lock = threading.Lock()
+    wakeup = threading.Event()
+    stop = threading.Event()
+
+    def checkpoint():
+        with state_lock:
+            save_state(dest_path, state)
+        wakeup.set()
+
+    frontier = None
+    if hasher is not None:
+        frontier = threading.Thread(target=_hash_frontier,
+                                    args=(hasher, state["segments"], wakeup, stop), daemon=True)
+        frontier.start()
+
+    def worker(segment):
+        # 完成自己的分段后继续接手其他分段剩余部分的后半段
+        while segment is not None:
+            if not _fetch_segment(session, url, segment, writer, checkpoint, state_lock):
+                return
+            segment = _split_largest(state["segments"], state_lock)
+
+    # 续传时进度从各段已完成的字节数算起 (预分配的文件长度不代表已下载)
+    metrics.set_done(os.path.basename(dest_path), sum(seg[2] for seg in state["segments"]))
+    writer = _PositionalWriter(dest_path)
+    try:
+        with ThreadPoolExecutor(max_workers=len(state["segments"])) as executor:
+            list(executor.map(worker, list(state["segments"])))
+        ok = all(seg[2] >= seg[1] - seg[0] for seg in state["segments"])
+    finally:
+        writer.close()
+        if frontier is not None:
+            stop.set()
+            wakeup.set()
+            frontier.join()
+
+    if not ok:
+        return False, None
+    if hasher is None:
+        return True, None  # 没有MD5可核对, 保留全部完成的状态文件作为完整的凭据
+    os.remove(state_path(dest_path))
+    hasher.catch_up(total_size)
+    return True, hasher.hexdigest()
+
+
+def download_file(url, dest_path, segments=SEGMENTS, expected_md5=None, chunk_size=CHUNK_SIZE,
+                  session=None):
+    """
+    下载文件，支持断点续传，下载的同时计算MD5并与清单中的fastq_md5比对
+    :param url: 文件下载链接
+    :param dest_path: 文件保存路径
+    :param segments: 分段并行连接数，服务器支持Range时大文件分段下载
+    :param expected_md5: 预期MD5，为None时只下载不校验
+    :param chunk_size: 单连接下载的读取块大小
+    :param session: requests.Session, 默认使用当前线程复用的 Session
+    """
+    session = session or thread_session()
+    if expected_md5 and is_verified(dest_path, expected_md5):
+        print(f"文件已下载并校验, 跳过: {dest_path}")
+        return True
+
+    if segments > 1:
+        result, actual_md5 = download_segmented(url, dest_path, segments=segments, session=session,
+                                                hash_md5=bool(expected_md5))
+        if result is not None:
+            if result:
+                result = finish_download(dest_path, actual_md5, expected_md5)
+            print(f"文件下载{'完成' if result else '失败'}: {dest_path}")
+            return result
+
+    drop_segment_state(dest_path)  # 之前的分段下载未完成 (如这次探测失败): 从连续完成的位置续传
+    for attempt in range(1, STALL_RETRIES + 2):
+        # 检查文件是否已部分下载 (同时从已有部分重建MD5)
+        writer = HashingWriter(dest_path)
+        file_size = writer.offset
+
+        # 设置请求头，支持断点续传
+        headers = {"Range": f"bytes={file_size}-"} if file_size else {}
+
+        try:
+            # 发起请求
+            with transfer_watch.watch(os.path.basename(dest_path)) as monitor:
+                response = session.get(url, headers=headers, stream=True, timeout=TIMEOUT)
+                if response.status_code == 416 and file_size:
+                    response.close()  # 本地文件已完整
+                else:
+                    response.raise_for_status()
+
+                    # 以追加模式写入文件 (进度由 HashingWriter 计入 metrics, 定期汇总输出)
+                    for chunk in response.iter_content(chunk_size=chunk_size):
+                        if chunk:  # 过滤掉空的chunk
+                            monitor.update(len(chunk))  # 先检查是否卡住/被取消, 被取消后不再写入
+                            writer.write(chunk)
+                            bandwidth.throttle(len(chunk))
+
+            actual_md5 = writer.close()
+            print(f"文件下载完成: {dest_path}")
+            return finish_download(dest_path, actual_md5, expected_md5)
+
+        except Stalled as e:
+            response.close()
+            writer.close()
+            print(f"下载过慢 {url} (第{attempt}次): {e}")
+        except Cancelled:
+            writer.close()
+            raise
+        except requests.exceptions.RequestException as e:
+            writer.close()
+            print(f"下载失败 {url}: {e}")
+            return False
+    return False
@@ -0,0 +1,383 @@
+"""
+下载目标 (sink): 本地磁盘或 S3 兼容的对象存储
+
+下载数据按顺序交给 sink 的写入器, 写入的同时计算MD5:
+- LocalSink: 写入本地目录 (md5_stream.HashingWriter, 断点续传, 通过后写入MD5缓存), 与原来的下载方式相同
+- S3Sink: 不落地, 直接流式写入 multipart upload: 数据攒满一个分片 (PART_SIZE) 就交给后台线程上传,
+  同时上传 UPLOAD_CONCURRENCY 个分片 (内存中最多 UPLOAD_CONCURRENCY + 1 个分片);
+  全部数据的MD5与清单的 fastq_md5 一致才 CompleteMultipartUpload, 否则 Abort (不会留下损坏的对象),
+  对象的元数据 x-amz-meta-md5 记录MD5, 再次运行时已存在且MD5一致的对象直接跳过
+  每个分片带 Content-MD5 由服务端核对; 连接中断时从已接收的位置用 Range 继续 (已上传的分片保留),
+  进程退出后未完成的上传被放弃, 下次从头开始
+S3 使用 SigV4 签名 (只依赖 requests), 凭据取自环境变量 AWS_ACCESS_KEY_ID / AWS_SECRET_ACCESS_KEY
+(/ AWS_SESSION_TOKEN), 地址取自 S3_ENDPOINT 或环境变量 AWS_ENDPOINT_URL (MinIO/Ceph 等使用 path-style),
+测试可用 bench/fake_s3.py
+用法:
+    sink = open_sink("s3://bucket/fastq/")  # 或本地目录
+    stream_download(url, sink, "SRR123_1.fastq.gz", expected_md5=md5)
+"""
+import os
+import time
+import hmac
+import base64
+import hashlib
+import datetime
+import threading
+import urllib.parse
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+import requests
+import bandwidth
+import metrics
+import transfer_watch
+from transfer_watch import Stalled
+from md5_stream import HashingWriter, finish_download, is_verified
+from range_download import thread_session
+
+# 配置参数
+S3_ENDPOINT = None  # 如 "http://minio.local:9000"; None 时使用 AWS_ENDPOINT_URL 或 AWS 官方地址
+S3_REGION = "us-east-1"  # 未设置 AWS_REGION / AWS_DEFAULT_REGION 时使用
+PART_SIZE = 16 * 1024 * 1024  # 分片大小 (S3 要求除最后一片外不小于5MB, 最多10000片, 大文件自动增大)
+MAX_PARTS = 10000
+UPLOAD_CONCURRENCY = 4  # 每个文件同时上传的分片数
+UPLOAD_RETRIES = 4  # 单个分片/请求的重试次数
+STREAM_RETRIES = 3  # 下载连接中断后从已接收位置继续的次数
+CHUNK_SIZE = 1024 * 1024  # 下载时每次读取的字节数
+TIMEOUT = 60
+
+
+class S3Error(Exception):
+    pass
+
+
+# ---------------- SigV4 ----------------
+
+def _hmac(key, text):
+    return hmac.new(key, text.encode('utf-8'), hashlib.sha256).digest()
+
+
+def _quote(text, safe='-_.~'):
+    return urllib.parse.quote(text, safe=safe)
+
+
+def sign_v4(method, url, headers, access_key, secret_key, region, payload_hash, now=None,
+            service='s3'):
+    """
+    计算 AWS SigV4 签名, 返回需要加入请求的头 (Authorization / x-amz-date / x-amz-content-sha256)
+    :param headers: 参与签名的其他请求头 (host 自动加入)
+    """
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    amz_date = now.strftime('%Y%m%dT%H%M%SZ')
+    date = amz_date[:8]
+    parts = urllib.parse.urlsplit(url)
+    signed = {k.lower(): str(v).strip() for k, v in headers.items()}
+    signed['host'] = parts.netloc
+    signed['x-amz-date'] = amz_date
+    signed['x-amz-content-sha256'] = payload_hash
+    query = sorted((_quote(k), _quote(v)) for k, v in urllib.parse.parse_qsl(parts.query, keep_blank_values=True))
+    names = sorted(signed)
+    canonical = "\n".join([
+        method,
+        _quote(urllib.parse.unquote(parts.path) or '/', safe='/-_.~'),
+        "&".join(f"{k}={v}" for k, v in query),
+        "".join(f"{name}:{signed[name]}\n" for name in names),
+        ";".join(names),
+        payload_hash,
+    ])
+    scope = f"{date}/{region}/{service}/aws4_request"
+    to_sign = "\n".join(["AWS4-HMAC-SHA256", amz_date, scope,
+                         hashlib.sha256(canonical.encode('utf-8')).hexdigest()])
+    key = _hmac(_hmac(_hmac(_hmac(("AWS4" + secret_key).encode('utf-8'), date), region), service),
+                "aws4_request")
+    signature = hmac.new(key, to_sign.encode('utf-8'), hashlib.sha256).hexdigest()
+    return {
+        'Authorization': (f"AWS4-HMAC-SHA256 Credential={access_key}/{scope}, "
+                          f"SignedHeaders={';'.join(names)}, Signature={signature}"),
+        'x-amz-date': amz_date,
+        'x-amz-content-sha256': payload_hash,
+    }
+
+
+class S3Client:
+    """multipart upload 所需的最少 S3 接口"""
+
+    def __init__(self, endpoint=None, region=None, access_key=None, secret_key=None, session_token=None):
+        self.endpoint = (endpoint or S3_ENDPOINT or os.environ.get('AWS_ENDPOINT_URL') or '').rstrip('/')
+        self.region = region or os.environ.get('AWS_REGION') or os.environ.get('AWS_DEFAULT_REGION') or S3_REGION
+        self.access_key = access_key or os.environ.get('AWS_ACCESS_KEY_ID')
+        self.secret_key = secret_key or os.environ.get('AWS_SECRET_ACCESS_KEY')
+        self.session_token = session_token or os.environ.get('AWS_SESSION_TOKEN')
+        if not self.access_key or not self.secret_key:
+            raise S3Error("缺少 S3 凭据: 请设置 AWS_ACCESS_KEY_ID / AWS_SECRET_ACCESS_KEY")
+
+    def url(self, bucket, key, params=None):
+        path = "/" + _quote(key, safe='/-_.~')
+        if self.endpoint:
+            url = f"{self.endpoint}/{bucket}{path}"  # path-style (MinIO / Ceph 等)
+        else:
+            url = f"https://{bucket}.s3.{self.region}.amazonaws.com{path}"
+        if params:
+            url += "?" + "&".join(f"{_quote(k)}={_quote(str(v))}" if v != '' else _quote(k)
+                                  for k, v in params.items())
+        return url
+
+    def request(self, method, bucket, key, params=None, headers=None, data=b'', unsigned_payload=False):
+        """发送签名的请求, 429/5xx/网络错误时退避重试; 其他错误抛出 S3Error"""
+        url = self.url(bucket, key, params)
+        headers = dict(headers or {})
+        if self.session_token:
+            headers['x-amz-security-token'] = self.session_token
+        payload_hash = "UNSIGNED-PAYLOAD" if unsigned_payload else hashlib.sha256(data).hexdigest()
+        for attempt in range(UPLOAD_RETRIES + 1):
+            signed = dict(headers)
+            signed.update(sign_v4(method, url, headers, self.access_key, self.secret_key, self.region,
+                                  payload_hash))
+            try:
+                response = thread_session().request(method, url, headers=signed, data=data,
+                                                    timeout=TIMEOUT)
+            except requests.exceptions.RequestException as e:
+                error = str(e)
+            else:
+                if response.status_code < 300 or response.status_code == 404 and method == 'HEAD':
+                    return response
+                error = f"HTTP {response.status_code}: {response.text[:200]}"
+                if response.status_code != 429 and response.status_code < 500:
+                    raise S3Error(f"{method} {bucket}/{key} 失败: {error}")
+            if attempt < UPLOAD_RETRIES:
+                metrics.inc('upload_retries')
+                time.sleep(min(2 ** attempt, 30))
+        raise S3Error(f"{method} {bucket}/{key} 失败: {error}")
+
+    def head(self, bucket, key):
+        """对象存在时返回响应头, 不存在时返回None"""
+        response = self.request('HEAD', bucket, key)
+        return response.headers if response.status_code == 200 else None
+
+    def create_multipart(self, bucket, key, metadata=None):
+        headers = {f"x-amz-meta-{k}": v for k, v in (metadata or {}).items()}
+        response = self.request('POST', bucket, key, {'uploads': ''}, headers)
+        return _xml_text(response.content, 'UploadId')
+
+    def upload_part(self, bucket, key, upload_id, number, data):
+        """上传一个分片, 返回 ETag; Content-MD5 由服务端核对传输是否完整"""
+        content_md5 = base64.b64encode(hashlib.md5(data).digest()).decode()
+        response = self.request('PUT', bucket, key, {'partNumber': number, 'uploadId': upload_id},
+                                {'Content-MD5': content_md5}, data, unsigned_payload=True)
+        return response.headers.get('ETag', '').strip()
+
+    def complete_multipart(self, bucket, key, upload_id, etags):
+        body = "<CompleteMultipartUpload>" + "".join(
+            f"<Part><PartNumber>{number}</PartNumber><ETag>{etag}</ETag></Part>"
+            for number, etag in enumerate(etags, 1)) + "</CompleteMultipartUpload>"
+        response = self.request('POST', bucket, key, {'uploadId': upload_id}, data=body.encode())
+        if b"<Error>" in response.content:  # S3 可能在200响应中返回错误
+            raise S3Error(f"CompleteMultipartUpload 失败: {response.text[:200]}")
+
+    def abort_multipart(self, bucket, key, upload_id):
+        self.request('DELETE', bucket, key, {'uploadId': upload_id})
+
+
+def _xml_text(content, tag):
+    for element in ET.fromstring(content).iter():
+        if element.tag.split('}')[-1] == tag:
+            return element.text
+    raise S3Error(f"响应中没有 {tag}")
+
+
+# ---------------- sinks ----------------
+
+class LocalWriter:
+    """写入本地文件 (HashingWriter), 已有的部分文件自动续传"""
+
+    def __init__(self, path, expected_md5=None):
+        self.path = path
+        self.expected_md5 = expected_md5
+        self.writer = HashingWriter(path)
+
+    @property
+    def offset(self):
+        return self.writer.offset
+
+    def write(self, chunk):
+        self.writer.write(chunk)
+
+    def commit(self):
+        return finish_download(self.path, self.writer.close(), self.expected_md5)
+
+    def abort(self):
+        self.writer.close()  # 保留已下载的部分, 下次续传
+
+
+class LocalSink:
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def describe(self, name):
+        return os.path.join(self.directory, name)
+
+    def is_done(self, name, expected_md5=None):
+        return bool(expected_md5) and is_verified(self.describe(name), expected_md5)
+
+    def open(self, name, size=None, expected_md5=None):
+        return LocalWriter(self.describe(name), expected_md5)
+
+
+class S3Writer:
+    """流式写入一个 multipart upload: 攒满分片后台上传, 同时计算整体MD5"""
+
+    def __init__(self, client, bucket, key, size=None, expected_md5=None,
+                 part_size=PART_SIZE, concurrency=UPLOAD_CONCURRENCY):
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.name = os.path.basename(key)
+        self.expected_md5 = expected_md5
+        if size:  # 分片数不能超过 MAX_PARTS, 按1MB取整
+            part_size = max(part_size, -(-size // MAX_PARTS // (1024 * 1024)) * 1024 * 1024)
+        self.part_size = part_size
+        self.md5 = hashlib.md5()
+        self.buffer = bytearray()
+        self.offset = 0
+        self.futures = []
+        self.slots = threading.BoundedSemaphore(concurrency + 1)  # 限制内存中等待上传的分片数
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+        metadata = {'md5': expected_md5} if expected_md5 else None
+        self.upload_id = client.create_multipart(bucket, key, metadata)
+
+    def _submit(self, data):
+        self.slots.acquire()
+        for future in self.futures:
+            if future.done() and future.exception() is not None:
+                self.slots.release()
+                raise future.exception()  # 分片上传失败, 停止下载
+        future = self.executor.submit(self.client.upload_part, self.bucket, self.key, self.upload_id,
+                                      len(self.futures) + 1, bytes(data))
+        future.add_done_callback(lambda _: self.slots.release())
+        self.futures.append(future)
+
+    def write(self, chunk):
+        self.md5.update(chunk)
+        self.buffer += chunk
+        self.offset += len(chunk)
+        metrics.add(self.name, len(chunk))
+        while len(self.buffer) >= self.part_size:
+            self._submit(self.buffer[:self.part_size])
+            del self.buffer[:self.part_size]
+
+    def commit(self):
+        """等待所有分片上传完成; MD5一致时完成上传, 否则放弃"""
+        try:
+            if self.buffer or not self.futures:
+                self._submit(self.buffer)
+                self.buffer = bytearray()
+            etags = [future.result() for future in self.futures]
+            actual_md5 = self.md5.hexdigest()
+            if self.expected_md5 and actual_md5 != self.expected_md5:
+                print(f"MD5校验失败 {self.name}: 预期 {self.expected_md5}, 实际 {actual_md5}, 放弃上传")
+                self.abort()
+                return False
+            self.client.complete_multipart(self.bucket, self.key, self.upload_id, etags)
+            return True
+        finally:
+            self.executor.shutdown(wait=False)
+
+    def abort(self):
+        for future in self.futures:
+            future.cancel()
+        self.executor.shutdown(wait=True)
+        try:
+            self.client.abort_multipart(self.bucket, self.key, self.upload_id)
+        except S3Error as e:
+            print(f"放弃上传失败 {self.key}: {e}")
+
+
+class S3Sink:
+    def __init__(self, bucket, prefix='', client=None, part_size=PART_SIZE, concurrency=UPLOAD_CONCURRENCY):
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client = client or S3Client()
+        self.part_size = part_size
+        self.concurrency = concurrency
+
+    def key(self, name):
+        return self.prefix + name
+
+    def describe(self, name):
+        return f"s3://{self.bucket}/{self.key(name)}"
+
+    def is_done(self, name, expected_md5=None):
+        """对象已存在; 有预期MD5时要求元数据中的MD5一致"""
+        headers = self.client.head(self.bucket, self.key(name))
+        if headers is None:
+            return False
+        return not expected_md5 or headers.get('x-amz-meta-md5') == expected_md5
+
+    def open(self, name, size=None, expected_md5=None):
+        return S3Writer(self.client, self.bucket, self.key(name), size, expected_md5,
+                        self.part_size, self.concurrency)
+
+
+def open_sink(target):
+    """s3://bucket/prefix 返回 S3Sink, 其他值作为本地目录"""
+    if target.startswith('s3://'):
+        bucket, _, prefix = target[5:].partition('/')
+        if prefix and not prefix.endswith('/'):
+            prefix += '/'
+        return S3Sink(bucket, prefix)
+    return LocalSink(target)
+
+
+def stream_download(url, sink, name, expected_md5=None, size=None, session=None):
+    """
+    单连接下载并按顺序写入 sink, 写入的同时计算MD5
+    连接中断或卡住时从已接收的位置 (Range) 继续, 重试用尽后放弃 (S3 上未完成的上传被 Abort)
+    :return: 是否成功 (有预期MD5时需一致)
+    """
+    if sink.is_done(name, expected_md5):
+        print(f"已存在并校验, 跳过: {sink.describe(name)}")
+        return True
+    session = session or thread_session()
+    try:
+        writer = sink.open(name, size, expected_md5)
+    except S3Error as e:
+        print(f"无法开始上传 {name}: {e}")
+        return False
+    print(f"正在下载: {name} -> {sink.describe(name)}")
+    committed = False
+    try:
+        for attempt in range(1, STREAM_RETRIES + 2):
+            offset = writer.offset
+            headers = {"Range": f"bytes={offset}-"} if offset else {}
+            try:
+                with transfer_watch.watch(name) as monitor, \
+                        session.get(url, headers=headers, stream=True, timeout=TIMEOUT) as response:
+                    if response.status_code == 416 and offset:
+                        pass  # 已接收完整
+                    elif offset and response.status_code != 206:
+                        raise requests.exceptions.RequestException(
+                            f"服务器不支持续传 (HTTP {response.status_code})")
+                    else:
+                        response.raise_for_status()
+                        for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                            if chunk:
+                                monitor.update(len(chunk))  # 先检查是否卡住/被取消, 被取消后不再写入
+                                writer.write(chunk)
+                                bandwidth.throttle(len(chunk))
+                if size and writer.offset < size:
+                    raise requests.exceptions.RequestException(f"连接提前结束 ({writer.offset}/{size})")
+                ok = writer.commit()  # MD5不一致时 commit 自己放弃上传
+                committed = True
+                print(f"文件{'已写入' if ok else '写入失败'}: {sink.describe(name)}")
+                return ok
+            except (requests.exceptions.RequestException, Stalled) as e:
+                print(f"下载中断 {name} (第{attempt}次): {e}")
+                metrics.inc('retries')
+            except S3Error as e:
+                print(f"上传失败 {name}: {e}")
+                return False
+        return False
+    finally:
+        # 重试用尽、上传出错、被取消或其他异常: S3 上未完成的上传一律 Abort (已上传的分片会持续计费)
+        if not committed:
+            writer.abort()
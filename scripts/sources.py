@@ -0,0 +1,370 @@
+"""
+多镜像 / 多协议自动切换
+
+清单中每个文件有多个等价来源: fastq_ftp (ENA FTP, 同一路径也可以用HTTPS访问) 和 fastq_aspera,
+EXTRA_MIRRORS 中还可以配置同路径的其他镜像 (例如所里的本地镜像)。
+- 按各来源 (协议+主机) 的实测吞吐排序, 测速结果保存在下载目录的 source_stats.json 中供以后运行使用;
+  没有记录或记录过期的 HTTP/FTP 来源先试探下载一小段测速, Aspera 无法廉价试探, 没有记录时先试用一次
+- 下载中途出错、超时或吞吐低于下限 (transfer_watch) 时切换到下一个来源, 从本地已下载的位置继续 (HTTP Range / FTP REST / ascp -k 1)
+- 所有来源写入同一个文件并边下载边计算MD5, 结束后与 fastq_md5 比对
+注意: sra_ftp 列是 .sra 格式 (NCBI/ENA 的归档格式), 内容与 fastq.gz 不同, 不能作为 fastq 的镜像
+用法:
+    selector = SourceSelector(default_stats_path(download_dir))
+    selector.download(manifest.by_name[file_name], dest_path, expected_md5)
+"""
+import os
+import json
+import time
+import shlex
+import shutil
+import ftplib
+import threading
+import requests
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+import aspera
+import bandwidth
+import metrics
+import transfer_watch
+from transfer_watch import Stalled
+from md5_stream import HashingWriter, finish_download, is_verified
+from range_download import thread_session, download_segmented, contiguous_done, state_path
+from download_engine import http_url
+
+# 配置参数
+PROTOCOLS = ('https', 'ftp', 'aspera')  # 允许使用的协议
+# 同路径的其他镜像: 清单中的主机 -> 替换 "协议://主机" 的前缀列表
+EXTRA_MIRRORS = {
+    # 'ftp.sra.ebi.ac.uk': ['https://ena-mirror.example.edu'],
+}
+STATS_FILE = "source_stats.json"  # 默认放在下载目录中
+STATS_TTL = 24 * 3600  # 测速记录的有效期(秒), 过期后重新试探
+PROBE_BYTES = 1024 * 1024  # 试探下载的字节数
+MIN_SAMPLE_BYTES = 8 * 1024 * 1024  # 传输量达到该值才计入吞吐 (小文件主要是握手耗时)
+EWMA_ALPHA = 0.3  # 吞吐滑动平均的权重
+CONNECT_TIMEOUT = 30
+STALL_TIMEOUT = 60  # 超过该时间收不到数据视为卡住, 切换来源
+CHUNK_SIZE = 1024 * 1024
+
+
+class SourceError(Exception):
+    """来源不可用或中途失败"""
+
+
+def default_stats_path(download_dir):
+    return os.path.join(download_dir, STATS_FILE)
+
+
+def _source(kind, url):
+    parsed = urlparse(url if '://' in url else f"{kind}://{url}")
+    return {'kind': kind, 'url': url, 'key': f"{kind}://{parsed.netloc.rstrip(':')}"}
+
+
+def candidates(record, protocols=PROTOCOLS, mirrors=None):
+    """
+    列出一个文件的全部来源
+    :param record: 清单中的文件记录 (Manifest.by_name 的值)
+    :return: [{'kind', 'url', 'key'}], key 为 "协议://主机", 吞吐按 key 统计
+    """
+    mirrors = EXTRA_MIRRORS if mirrors is None else mirrors
+    sources = []
+    if record.get('ftp'):
+        link = record['ftp'].split('://', 1)[-1]
+        host, _, path = link.partition('/')
+        if 'https' in protocols:
+            sources.append(_source('https', http_url(link)))
+        if 'ftp' in protocols:
+            sources.append(_source('ftp', f"ftp://{link}"))
+        for base in mirrors.get(host, ()):
+            kind = base.split('://', 1)[0]
+            kind = 'https' if kind == 'http' else kind
+            if kind in protocols:
+                sources.append(_source(kind, f"{base.rstrip('/')}/{path}"))
+    if record.get('aspera') and 'aspera' in protocols and _ascp_available():
+        sources.append(_source('aspera', record['aspera']))
+    return sources
+
+
+def _ascp_available():
+    return shutil.which(shlex.split(aspera.ASCP_CMD)[0]) is not None
+
+
+class SourceStats:
+    """各来源的实测吞吐 (滑动平均) 与连续失败次数, 保存为JSON"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                self.stats = json.load(f)
+        except (OSError, ValueError):
+            self.stats = {}
+
+    def get(self, key):
+        with self.lock:
+            return dict(self.stats.get(key, {}))
+
+    def fresh(self, key):
+        """最近 STATS_TTL 内是否测过 (失败也算, 避免每个文件都去试探不可用的来源)"""
+        return time.time() - self.get(key).get('checked', 0) < STATS_TTL
+
+    def record(self, key, nbytes, seconds, ok, sample=True):
+        """
+        记录一次传输
+        :param sample: 是否计入吞吐 (传输量太小时只记录成功/失败)
+        """
+        with self.lock:
+            entry = self.stats.setdefault(key, {'rate': None, 'ok': 0, 'failed': 0, 'streak': 0})
+            if ok:
+                entry['ok'] += 1
+                entry['streak'] = 0
+            else:
+                entry['failed'] += 1
+                entry['streak'] += 1
+            entry['checked'] = time.time()
+            if sample and seconds > 0 and nbytes > 0:
+                rate = nbytes / seconds
+                entry['rate'] = rate if entry['rate'] is None else (
+                    EWMA_ALPHA * rate + (1 - EWMA_ALPHA) * entry['rate'])
+            self._save()
+
+    def order(self, key):
+        """
+        排序键: 从未用过的来源最先 (试用一次), 其次按吞吐从高到低 (每连续失败一次打对折),
+        没有测出吞吐且失败过的来源最后
+        """
+        entry = self.get(key)
+        if entry.get('rate') is None:
+            return (2 if entry.get('streak') else 0, 0)
+        return (1, -entry['rate'] * 0.5 ** entry['streak'])
+
+    def _save(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.stats, f, indent=1)
+        os.replace(tmp, self.path)
+
+
+def fetch_http(source, writer, limit=None):
+    """从 writer.offset 处用 Range 继续下载; limit 为最多读取的字节数 (试探用)"""
+    offset = writer.offset
+    headers = {"Range": f"bytes={offset}-"} if offset else {}
+    if limit:
+        headers = {"Range": f"bytes={offset}-{offset + limit - 1}"}
+    try:
+        with transfer_watch.watch(source['url']) as monitor, \
+                thread_session().get(source['url'], headers=headers, stream=True,
+                                     timeout=(CONNECT_TIMEOUT, STALL_TIMEOUT)) as response:
+            if response.status_code == 416 and offset:
+                return  # 本地文件已完整
+            response.raise_for_status()
+            if 'Range' in headers and response.status_code != 206:
+                raise SourceError(f"服务器不支持断点续传 (HTTP {response.status_code})")
+            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                if chunk:
+                    monitor.update(len(chunk))  # 被取消 (租约被接手) 后不再写入
+                    writer.write(chunk)
+                    bandwidth.throttle(len(chunk))
+                    if limit and writer.offset - offset >= limit:
+                        return
+    except (requests.exceptions.RequestException, Stalled) as e:
+        raise SourceError(str(e)) from e
+
+
+def fetch_ftp(source, writer, limit=None):
+    """从 writer.offset 处用 REST 继续下载"""
+    parsed = urlparse(source['url'])
+    directory, _, name = parsed.path.rpartition('/')
+    offset = writer.offset
+    ftp = ftplib.FTP(timeout=STALL_TIMEOUT)
+    try:
+        ftp.connect(parsed.hostname, parsed.port or 21, timeout=CONNECT_TIMEOUT)
+        ftp.login()
+        ftp.voidcmd('TYPE I')
+        ftp.cwd(directory or '/')
+        conn = ftp.transfercmd(f"RETR {name}", rest=offset or None)
+        with conn, transfer_watch.watch(source['url']) as monitor:
+            while chunk := conn.recv(CHUNK_SIZE):
+                monitor.update(len(chunk))  # 被取消 (租约被接手) 后不再写入
+                writer.write(chunk)
+                bandwidth.throttle(len(chunk))
+                if limit and writer.offset - offset >= limit:
+                    return  # 试探到此为止, 直接断开
+        ftp.voidresp()
+    except (OSError, EOFError, ftplib.Error, Stalled) as e:
+        raise SourceError(str(e)) from e
+    finally:
+        ftp.close()
+
+
+def fetch_aspera(source, dest_path, file_name):
+    """用 ascp -k 1 续传本地已有的部分文件"""
+    host, _ = aspera.split_link(source['url'])
+    task = {'link': source['url'], 'file_name': file_name, 'dest_path': dest_path, 'size': None}
+    limit = bandwidth.manager().ascp_limit(1) or aspera.DEFAULT_LIMIT
+    session = aspera.AsperaSession(host, [task], os.path.dirname(dest_path) or '.', limit)
+    returncode = session.run()
+    if not session.completed(task, returncode):
+        raise SourceError(session.errors[-1] if session.errors else f"ascp 退出码 {returncode}")
+
+
+FETCHERS = {'https': fetch_http, 'ftp': fetch_ftp}
+
+
+def _load_segments(dest_path):
+    try:
+        with open(state_path(dest_path), 'r', encoding='utf-8') as f:
+            return json.load(f)['segments']
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def downloaded_bytes(dest_path):
+    """本地已下载的字节数 (分段下载中的文件按从开头起连续完成的部分计算)"""
+    if not os.path.exists(dest_path):
+        return 0
+    segments = _load_segments(dest_path)
+    return contiguous_done(segments) if segments is not None else os.path.getsize(dest_path)
+
+
+def adopt_segmented(dest_path):
+    """
+    分段下载 (range_download) 留下的部分文件: 截断到从开头起连续已完成的位置,
+    以便其他来源从该位置继续
+    """
+    segments = _load_segments(dest_path)
+    if segments is None:
+        return
+    if os.path.exists(dest_path):
+        with open(dest_path, 'r+b') as f:
+            f.truncate(contiguous_done(segments))
+    os.remove(state_path(dest_path))
+
+
+class SourceSelector:
+    """为每个文件选择最快的来源, 出错时切换"""
+
+    def __init__(self, stats_path, protocols=PROTOCOLS, mirrors=None, segments=1):
+        """
+        :param segments: HTTPS 来源的分段并行连接数 (range_download), 1 为单连接
+        """
+        self.stats = SourceStats(stats_path)
+        self.protocols = protocols
+        self.mirrors = EXTRA_MIRRORS if mirrors is None else mirrors
+        self.segments = segments
+        self.lock = threading.Lock()
+        self.probe_locks = {}  # 来源 -> 试探锁 (同一来源只需要一个线程试探, 不同来源互不等待)
+
+    def rank(self, sources):
+        """按实测吞吐排序; 没有记录的 HTTP/FTP 来源先并行试探测速, 没有记录的 Aspera 排在最前面试用"""
+        stale = [s for s in sources if s['kind'] in FETCHERS and not self.stats.fresh(s['key'])]
+        if len(stale) == 1:
+            self._probe_once(stale[0])
+        elif stale:
+            with ThreadPoolExecutor(max_workers=len(stale)) as executor:
+                list(executor.map(self._probe_once, stale))
+        return sorted(sources, key=lambda source: self.stats.order(source['key']))
+
+    def _probe_once(self, source):
+        """试探一个来源; 其他线程正在试探同一来源时等它的结果"""
+        with self.lock:
+            lock = self.probe_locks.setdefault(source['key'], threading.Lock())
+        with lock:
+            if not self.stats.fresh(source['key']):
+                self.probe(source)
+
+    def probe(self, source):
+        """下载开头 PROBE_BYTES 字节测速 (含连接耗时), 数据丢弃"""
+        sink = _CountingSink()
+        start = time.time()
+        try:
+            FETCHERS[source['kind']](source, sink, limit=PROBE_BYTES)
+            ok = sink.offset > 0
+        except SourceError as e:
+            print(f"来源不可用: {source['key']} ({e})")
+            ok = False
+        self.stats.record(source['key'], sink.offset, time.time() - start, ok)
+
+    def transfer(self, source, dest_path, file_name):
+        """
+        从一个来源下载, 续传本地已有的部分
+        :return: 边下载边算出的MD5 (ascp 自己写文件, 返回None)
+        """
+        if source['kind'] == 'aspera':
+            adopt_segmented(dest_path)
+            fetch_aspera(source, dest_path, file_name)
+            return None
+        if source['kind'] == 'https' and self.segments > 1:
+            result, actual_md5 = download_segmented(source['url'], dest_path, self.segments,
+                                                    hash_md5=True)
+            if result:
+                return actual_md5
+            if result is False:
+                adopt_segmented(dest_path)
+                raise SourceError("分段下载失败")
+            # 服务器不支持分段, 退回单连接
+        adopt_segmented(dest_path)
+        writer = HashingWriter(dest_path)
+        try:
+            FETCHERS[source['kind']](source, writer)
+        finally:
+            actual_md5 = writer.close()
+        return actual_md5
+
+    def download(self, record, dest_path, expected_md5=None):
+        """
+        依次尝试各来源下载一个文件, 中途失败时从当前位置换下一个来源继续
+        :param record: 清单中的文件记录
+        :return: 是否成功 (有预期MD5时还要求MD5一致)
+        """
+        file_name = record['file_name']
+        if expected_md5 and is_verified(dest_path, expected_md5):
+            print(f"文件已下载并校验, 跳过: {dest_path}")
+            return True
+        sources = self.rank(candidates(record, self.protocols, self.mirrors))
+        if not sources:
+            print(f"没有可用的来源: {file_name}")
+            return False
+        size = record.get('bytes')
+        if size and os.path.exists(dest_path) and os.path.getsize(dest_path) > size:
+            os.remove(dest_path)
+
+        for i, source in enumerate(sources):
+            before = downloaded_bytes(dest_path)
+            if size and before == size:  # 上次已下载完整, 只需计算MD5
+                return finish_download(dest_path, HashingWriter(dest_path).close(), expected_md5)
+            start = time.time()
+            try:
+                actual_md5 = self.transfer(source, dest_path, file_name)
+                done = downloaded_bytes(dest_path)
+                if size and done != size:
+                    raise SourceError(f"文件不完整: {done}/{size} 字节")
+                ok = True
+            except SourceError as e:
+                ok = False
+                done = downloaded_bytes(dest_path)
+                following = (f", 从 {done} 字节处切换到 {sources[i + 1]['key']}"
+                             if i + 1 < len(sources) else "")
+                print(f"来源 {source['key']} 下载 {file_name} 出错: {e}{following}")
+                if following:
+                    metrics.inc('failovers')
+            transferred = max(done - before, 0)
+            self.stats.record(source['key'], transferred, time.time() - start, ok,
+                              sample=transferred >= MIN_SAMPLE_BYTES)
+            if ok:
+                if actual_md5 is None:  # ascp 自己写文件, 从磁盘计算MD5
+                    actual_md5 = HashingWriter(dest_path).close()
+                print(f"文件下载完成 ({source['key']}): {dest_path}")
+                return finish_download(dest_path, actual_md5, expected_md5)
+        return False
+
+
+class _CountingSink:
+    """试探测速用的写入器: 只计数不保存"""
+
+    def __init__(self):
+        self.offset = 0
+
+    def write(self, chunk):
+        self.offset += len(chunk)
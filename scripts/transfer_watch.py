@@ -0,0 +1,262 @@
+"""
+传输看门狗: 卡住检测与拖尾优化
+
+- 每个传输 (一个文件或一个分段) 登记一个 RateMonitor, 每写入一块数据调用 update(字节数)
+- 后台线程每 CHECK_INTERVAL 秒计算各传输最近 WINDOW 秒的吞吐, 低于下限时判定为卡住:
+  下一次 update 抛出 Stalled; 对 wget/curl 等子进程 (读阻塞时 update 不会被调用) 直接调用 abort 结束进程,
+  下载函数捕获后从已下载的位置重新连接续传
+- 设置了全局带宽上限时, 下限不超过 每个传输平均份额 的 BUDGET_SHARE, 避免把被限速的传输误判为卡住
+- 拖尾: 剩余文件数不超过 TAIL_FILES 时, 吞吐明显低于最快传输的连接会被重新发起 (换一条新连接),
+  分段下载的空闲连接还会接手剩余最多的分段的后半部分 (见 range_download.py)
+- 取消: cancel(文件名) 使该文件的所有传输 (含各分段) 在下一次 update 时抛出 Cancelled 并调用 abort,
+  on_cancel 登记的回调 (如结束 ascp 进程) 也被调用; 用于多节点租约被其他节点接手时立即停止写入 (见 leases.py)
+用法:
+    with transfer_watch.watch(file_name, abort=process.kill) as monitor:
+        for chunk in ...:
+            monitor.update(len(chunk))
+"""
+import os
+import time
+import threading
+from collections import deque, defaultdict
+from contextlib import contextmanager
+import bandwidth
+import metrics
+
+# 配置参数
+MIN_RATE = 50 * 1024  # 吞吐下限 (字节/秒), 0 表示不检测
+WINDOW = 60  # 统计吞吐的窗口 (秒)
+CHECK_INTERVAL = 5  # 检查间隔 (秒)
+BUDGET_SHARE = 0.25  # 有全局带宽上限时, 下限不超过平均份额的比例
+TAIL_FILES = 4  # 剩余文件数不超过该值时进入拖尾模式
+TAIL_RATIO = 0.3  # 拖尾模式下吞吐低于最快传输的该比例时重新连接
+TAIL_RESTARTS = 2  # 同一传输因拖尾最多重新连接的次数
+
+
+class Stalled(Exception):
+    """传输过慢或卡住, 应从已下载的位置重新连接"""
+
+
+class Cancelled(Exception):
+    """传输被取消 (如租约已被其他节点接手), 不应重试"""
+
+
+def file_key(name):
+    """传输名对应的文件名 (分段传输名为 '<文件名> [起点-]', 多来源下载时为URL)"""
+    return os.path.basename(name.split(' [', 1)[0])
+
+
+class RateMonitor:
+    """单个传输的字节计数, 吞吐由看门狗线程计算"""
+
+    def __init__(self, watchdog, name, abort=None):
+        self.watchdog = watchdog
+        self.name = name
+        self.file = file_key(name)
+        self.abort = abort
+        self.total = 0
+        self.started = time.monotonic()
+        self.samples = deque([(self.started, 0)])
+        self.rate = None  # 最近一个窗口的吞吐, 不足一个窗口时为None
+        self.reason = None  # 被判定为卡住/需要重连的原因
+        self.cancelled = False  # 被取消 (不应重连)
+
+    def update(self, amount):
+        self.total += amount
+        if self.reason:
+            raise (Cancelled if self.cancelled else Stalled)(self.reason)
+
+    @property
+    def stalled(self):
+        return self.reason is not None
+
+    def sample(self, now, window):
+        """记录当前计数, 返回最近一个窗口的吞吐 (不足一个窗口时返回None)"""
+        self.samples.append((now, self.total))
+        while len(self.samples) > 2 and now - self.samples[1][0] >= window:
+            self.samples.popleft()
+        first_time, first_total = self.samples[0]
+        if now - first_time < window:
+            return None
+        self.rate = (self.total - first_total) / (now - first_time)
+        return self.rate
+
+    def trip(self, reason, cancel=False):
+        if self.cancelled or self.reason and not cancel:
+            return
+        self.reason = reason
+        self.cancelled = cancel
+        if not cancel:
+            print(f"\n{reason}: {self.name}, 将重新连接续传")
+        if self.abort is not None:
+            try:
+                self.abort()
+            except Exception:
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.watchdog.unwatch(self)
+
+
+class Watchdog:
+    """后台检查所有登记的传输"""
+
+    def __init__(self, min_rate=MIN_RATE, window=WINDOW, interval=CHECK_INTERVAL):
+        self.min_rate = min_rate
+        self.window = window
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.monitors = set()
+        self.thread = None
+        self.remaining = None  # 剩余文件数 (调度器设置), 用于判断是否进入拖尾模式
+        self.best_rate = 0.0  # 已结束传输的最高平均吞吐
+        self.restarts = {}  # 传输名 -> 因拖尾重新连接的次数
+        self.cancelled = {}  # 文件名 -> 取消原因
+        self.hooks = defaultdict(list)  # 文件名 -> 取消时调用的函数
+
+    def watch(self, name, abort=None):
+        """
+        登记一个传输
+        :param abort: 卡住时调用的函数 (如结束子进程), 读阻塞的传输需要提供
+        """
+        monitor = RateMonitor(self, name, abort)
+        with self.lock:
+            self.monitors.add(monitor)
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._loop, daemon=True)
+                self.thread.start()
+            reason = self.cancelled.get(monitor.file)
+        if reason is not None:
+            monitor.trip(reason, cancel=True)
+        return monitor
+
+    def cancel(self, file_name, reason):
+        """取消一个文件正在进行和之后开始的所有传输, 直到 resume"""
+        with self.lock:
+            self.cancelled[file_name] = reason
+            monitors = [m for m in self.monitors if m.file == file_name]
+            hooks = list(self.hooks.get(file_name, ()))
+        for monitor in monitors:
+            monitor.trip(reason, cancel=True)
+        for hook in hooks:
+            try:
+                hook()
+            except Exception:
+                pass
+
+    def resume(self, file_name):
+        with self.lock:
+            self.cancelled.pop(file_name, None)
+
+    def is_cancelled(self, file_name):
+        with self.lock:
+            return file_name in self.cancelled
+
+    @contextmanager
+    def on_cancel(self, file_name, func):
+        """在 with 块内文件被取消时调用 func (如结束不经过 update 的子进程); 已被取消时立即调用"""
+        with self.lock:
+            self.hooks[file_name].append(func)
+            cancelled = file_name in self.cancelled
+        if cancelled:
+            func()
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.hooks[file_name].remove(func)
+                if not self.hooks[file_name]:
+                    del self.hooks[file_name]
+
+    def unwatch(self, monitor):
+        elapsed = time.monotonic() - monitor.started
+        with self.lock:
+            self.monitors.discard(monitor)
+            if not monitor.stalled and elapsed >= self.window:
+                self.best_rate = max(self.best_rate, monitor.total / elapsed)
+
+    def set_remaining(self, count):
+        self.remaining = count
+
+    def floor(self, active):
+        """当前的吞吐下限"""
+        budget = bandwidth.manager().current_rate()
+        if budget and active:
+            return min(self.min_rate, budget / active * BUDGET_SHARE)
+        return self.min_rate
+
+    def _loop(self):
+        while True:
+            time.sleep(self.interval)
+            with self.lock:
+                monitors = list(self.monitors)
+            if not monitors:
+                with self.lock:
+                    if not self.monitors:
+                        self.thread = None
+                        return
+                continue
+            self.check(monitors)
+
+    def check(self, monitors):
+        now = time.monotonic()
+        floor = self.floor(len(monitors))
+        rates = {}
+        for monitor in monitors:
+            rate = monitor.sample(now, self.window)
+            if rate is None or monitor.stalled:
+                continue
+            if floor and rate < floor:
+                metrics.inc('stalls')
+                monitor.trip(f"最近{self.window}秒吞吐 {rate / 1024:.0f} KB/s 低于下限 {floor / 1024:.0f} KB/s")
+            else:
+                rates[monitor] = rate
+
+        # 拖尾模式: 每次最多重连一个最慢的传输
+        if self.remaining is None or self.remaining > TAIL_FILES or not rates:
+            return
+        reference = max(self.best_rate, max(rates.values()))
+        slowest = min(rates, key=rates.get)
+        if (rates[slowest] < reference * TAIL_RATIO
+                and self.restarts.get(slowest.name, 0) < TAIL_RESTARTS):
+            self.restarts[slowest.name] = self.restarts.get(slowest.name, 0) + 1
+            metrics.inc('tail_restarts')
+            slowest.trip(f"拖尾: 吞吐 {rates[slowest] / 1024 ** 2:.2f} MB/s 远低于 "
+                         f"{reference / 1024 ** 2:.2f} MB/s")
+
+
+_watchdog = Watchdog()
+
+
+def configure(min_rate=MIN_RATE, window=WINDOW):
+    """设置吞吐下限与统计窗口 (脚本启动时调用, 不调用时使用默认值)"""
+    global _watchdog
+    _watchdog = Watchdog(min_rate, window)
+    return _watchdog
+
+
+def watch(name, abort=None):
+    return _watchdog.watch(name, abort)
+
+
+def set_remaining(count):
+    _watchdog.set_remaining(count)
+
+
+def cancel(file_name, reason):
+    _watchdog.cancel(file_name, reason)
+
+
+def resume(file_name):
+    _watchdog.resume(file_name)
+
+
+def is_cancelled(file_name):
+    return _watchdog.is_cancelled(file_name)
+
+
+def on_cancel(file_name, func):
+    return _watchdog.on_cancel(file_name, func)